@@ -0,0 +1,88 @@
+import time
+import numpy as np
+import pandas as pd
+
+import demografia
+from benchmark_dtypes import PARTIDO_COUNT
+from censo_utils import dtypes
+from cubo import BANDAS_DE_EDAD, Cube, banda_de_edad, build_cube
+
+ROW_COUNTS = [100_000, 1_000_000, 3_000_000]
+
+# Distinct professions and birthplaces, a few of them common and most rare
+PROFESION_COUNT = 400
+LUGAR_COUNT = 100
+
+MENORES = BANDAS_DE_EDAD[:3]
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def zipf_choice(rng, values: list, rows: int) -> np.ndarray:
+    p = 1 / np.arange(1, len(values) + 1)
+    return rng.choice(np.array(values, dtype=object), rows, p=p / p.sum())
+
+def make_poblacion(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic poblacion.xlsx where, as in the census, children have no
+    profession, only school-age children go to school and most people share
+    a few professions and birthplaces."""
+    rng = np.random.default_rng(seed)
+    edad = np.minimum(rng.exponential(25, rows), 99).astype(int).astype(float)
+    profesion = zipf_choice(rng, ['Chacarero', 'jornalero', 'agricultor', 'Estanciero', 'Peón'] +
+                            [f'Oficio {i}' for i in range(PROFESION_COUNT - 5)], rows)
+    profesion[edad < 12] = None
+    escuela = rng.choice(np.array(['si', 'no'], dtype=object), rows)
+    escuela[(edad < 5) | (edad >= 15)] = None
+    return pd.DataFrame({
+        'Partido': zipf_choice(rng, [f'Partido {i}' for i in range(PARTIDO_COUNT)], rows),
+        'Condición': rng.choice(np.array(['Rural', 'Urbana'], dtype=object), rows, p=[0.7, 0.3]),
+        'Profesión': profesion,
+        'Lugar de nacimiento': zipf_choice(rng, ['Argentina', 'Italia', 'España', 'Francia'] +
+                                           [f'Lugar {i}' for i in range(LUGAR_COUNT - 4)], rows),
+        'Edad': edad,
+        'Sexo': rng.choice(np.array(['Mujer', 'Varón'], dtype=object), rows),
+        'Lee y escribe': np.where(edad < 6, None, rng.choice(np.array(['si', 'no'], dtype=object), rows)),
+        'Va a la escuela': escuela,
+    })
+
+def compare(name: str, cube_query, rows_query, df: pd.DataFrame, cube: Cube) -> None:
+    """Answer a question from the cube and from the records, checking they agree."""
+    from_cube, cube_seconds = timed(cube_query, cube)
+    from_rows, rows_seconds = timed(rows_query, df)
+    pd.testing.assert_frame_equal(from_cube.reset_index(drop=True), from_rows.reset_index(drop=True),
+                                  check_dtype=False, check_categorical=False)
+    print(f"    {name:<45} cube {cube_seconds * 1000:>7.1f} ms | records {rows_seconds * 1000:>8.1f} ms")
+
+def italian_farmers_literacy(df: pd.DataFrame) -> pd.DataFrame:
+    rows = df[(df['Condición'] == 'Rural') & (df['Lugar de nacimiento'] == 'Italia')
+              & df['Profesión'].isin(demografia.AGRICULTORES)]
+    keys = [rows['Sexo'], banda_de_edad(rows['Edad']).rename('Banda de edad'), rows['Lee y escribe']]
+    return rows.groupby(keys, observed=True, dropna=False).size().rename('Count').reset_index()
+
+def people_by_partido(df: pd.DataFrame) -> pd.DataFrame:
+    return df.groupby('Partido', observed=True, dropna=False).size().rename('Count').reset_index()
+
+def minors_literacy(df: pd.DataFrame) -> pd.DataFrame:
+    rural_df = demografia.rural_poblacion(df)
+    info = demografia.menores_info(rural_df, rural_df['Partido'].dropna().unique())
+    return info.dropna(subset=['Proporción Lee y Escribe'])[['Partido', 'Proporción Lee y Escribe']].rename(
+        columns={'Proporción Lee y Escribe': 'Proporción'}).sort_values('Partido')
+
+def main():
+    for rows in ROW_COUNTS:
+        df = demografia.canonical_poblacion(dtypes.apply_dtypes(make_poblacion(rows)))
+        cube, build_seconds = timed(lambda: Cube(build_cube(df)))
+        print(f"{rows:,} rows | cube of {len(cube.counts):,} cells built in {build_seconds:.2f}s")
+        compare('literacy of Italian-born farmers', lambda cube: cube.query(
+            by=['Sexo', 'Banda de edad', 'Lee y escribe'],
+            where={'Condición': 'Rural', 'Lugar de nacimiento': 'Italia', 'Profesión': demografia.AGRICULTORES}),
+            italian_farmers_literacy, df, cube)
+        compare('people by partido', lambda cube: cube.query(by=['Partido']), people_by_partido, df, cube)
+        compare('literacy of rural minors by partido', lambda cube: cube.proportion(
+            'Lee y escribe', 'si', by=['Partido'], where={'Condición': 'Rural', 'Banda de edad': MENORES}).dropna(
+            subset=['Partido']), minors_literacy, df, cube)
+
+if __name__ == "__main__":
+    main()
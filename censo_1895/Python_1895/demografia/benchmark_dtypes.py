@@ -0,0 +1,65 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import dtypes
+from demografia import build_tables, partido_counts, province_counts, rural_poblacion
+
+# Population registers up to a whole province, over PARTIDO_COUNT partidos
+ROW_COUNTS = [100_000, 1_000_000, 3_000_000]
+PARTIDO_COUNT = 120
+
+def make_poblacion(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic poblacion.xlsx, with text in object columns as read_workbook gave it before pandas 3."""
+    rng = np.random.default_rng(seed)
+
+    def text(values, p=None):
+        return pd.Series(rng.choice(np.array(values, dtype=object), rows, p=p), dtype=object)
+
+    return pd.DataFrame({
+        'Partido': text([f'Partido {i}' for i in range(PARTIDO_COUNT)]),
+        'Condición': text(['Rural', 'Urbana'], p=[0.7, 0.3]),
+        'Profesión': text(['Chacarero', 'agricultor', 'Estanciero', 'jornalero', 'Costurera', 'Peón', None]),
+        'Lugar de nacimiento': text(['Argentina', 'Italia', 'España', 'Francia', 'Uruguay', None]),
+        'Edad': rng.integers(0, 90, rows).astype(float),
+        'Sexo': text(['Mujer', 'Varón', None], p=[0.49, 0.49, 0.02]),
+        'Lee y escribe': text(['si', 'no', None]),
+        'Va a la escuela': text(['si', 'no', None]),
+    })
+
+def time_tables(df: pd.DataFrame, policy: str) -> tuple:
+    """Apply the policy and build every table demografia writes, timing both."""
+    dtypes.DTYPE_POLICY = policy
+    start = time.perf_counter()
+    df = dtypes.apply_dtypes(df)
+    loaded = time.perf_counter()
+    rural_df = rural_poblacion(df)
+    tables = build_tables(rural_df)
+    partidos = tables['partidos']
+    counts = [tables[name] for name in ('profesion_counts', 'nacimiento_counts', 'agricultores_counts')]
+    results = [tables['menores_info']]
+    results += [table for count in counts for table in partido_counts(count, partidos).values()]
+    results += [province_counts(count) for count in counts]
+    return df, results, loaded - start, time.perf_counter() - loaded
+
+def main():
+    for rows in ROW_COUNTS:
+        raw = make_poblacion(rows)
+        frames, seconds, expected = {}, [], None
+        for policy in dtypes.POLICIES[::-1]:
+            frames[policy], results, load_seconds, table_seconds = time_tables(raw, policy)
+            seconds.append(f"{policy} load {load_seconds:.2f}s, tables {table_seconds:.2f}s")
+            if expected is None:
+                expected = results
+            for before, after in zip(expected, results):
+                pd.testing.assert_frame_equal(before, after, check_dtype=False, check_categorical=False,
+                                              check_index_type=False)
+        print(f"{rows:,} rows | " + ' | '.join(seconds) + ' | identical tables')
+        print(dtypes.memory_report(frames))
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import time
+
+import demografia
+from benchmark_dtypes import make_poblacion
+from censo_utils import dtypes
+
+# Population register over benchmark_dtypes.PARTIDO_COUNT partidos, and the
+# workbooks asked for after the dataset is written
+ROW_COUNT = 1_000_000
+REQUESTED_PARTIDOS = ['Partido 0', 'Partido 1', 'Partido 2']
+
+def time_write(write, tables: dict) -> float:
+    start = time.perf_counter()
+    write(tables)
+    return time.perf_counter() - start
+
+def main():
+    rural_df = demografia.rural_poblacion(dtypes.apply_dtypes(make_poblacion(ROW_COUNT)))
+    tables = demografia.build_tables(rural_df)
+    with tempfile.TemporaryDirectory() as directory:
+        demografia.directory_path = directory
+        demografia.dataset_directory = os.path.join(directory, 'dataset')
+
+        excel_seconds = time_write(demografia.write_all_workbooks, tables)
+        dataset_seconds = time_write(demografia.write_partido_dataset, tables)
+        start = time.perf_counter()
+        results = demografia.write_partido_workbooks(REQUESTED_PARTIDOS)
+        lazy_seconds = time.perf_counter() - start
+        assert all(result.ok for result in results)
+
+    print(f"{ROW_COUNT:,} rows | {len(tables['partidos'])} partidos | every workbook {excel_seconds:.2f}s | "
+          f"dataset {dataset_seconds:.2f}s | {len(REQUESTED_PARTIDOS)} workbooks from it {lazy_seconds:.2f}s")
+
+if __name__ == "__main__":
+    main()
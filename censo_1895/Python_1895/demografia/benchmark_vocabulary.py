@@ -0,0 +1,45 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils.vocabulary import Vocabulary
+
+ROW_COUNTS = [100_000, 1_000_000, 5_000_000]
+
+# Birthplaces, each also written in the variants a census taker might use
+LUGARES = ['Argentina', 'Italia', 'España', 'Francia', 'Uruguay', 'Suiza', 'Alemania', 'Inglaterra'] + [
+    f'Partido {i}, Buenos Aires, Argentina' for i in range(200)]
+
+def variants(value: str) -> list:
+    return [value, value.lower(), value.upper(), f' {value} ', value.replace(' ', '  '),
+            value.replace('ñ', 'n').replace('a', 'á', 1)]
+
+def make_column(rows: int, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    spellings = np.array([spelling for value in LUGARES for spelling in variants(value)] + [None], dtype=object)
+    return pd.Series(rng.choice(spellings, rows), name='Lugar de nacimiento', dtype=str)
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    for rows in ROW_COUNTS:
+        raw = make_column(rows)
+        vocabulary = Vocabulary()
+        canonical, first_seconds = timed(vocabulary.canonicalize, raw)
+        _, memo_seconds = timed(vocabulary.canonicalize, raw)
+        _, raw_group_seconds = timed(lambda: raw.groupby(raw).size())
+        counts, canonical_group_seconds = timed(lambda: canonical.groupby(canonical, observed=True).size())
+        assert counts.sum() == raw.notna().sum() and len(counts) == len(LUGARES)
+        report = vocabulary.report().iloc[0]
+        print(f"{rows:>10,} rows | {report['Raw values']:,} raw values -> {report['Canonical values']:,} canonical | "
+              f"mapped {rows / first_seconds:>12,.0f} rows/s, memoized {rows / memo_seconds:>12,.0f} rows/s | "
+              f"groupby raw {raw_group_seconds:.3f}s, canonical {canonical_group_seconds:.3f}s")
+
+if __name__ == "__main__":
+    main()
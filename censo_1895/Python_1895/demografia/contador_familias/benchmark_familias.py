@@ -0,0 +1,121 @@
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Callable
+
+from contador_familias import prepare, prev_apellido_pila, prev_apellido_pila_loop, sharded_blocks, stream_blocks
+
+# Registers small enough for the row-by-row reference, then up to a whole province
+REFERENCE_ROW_COUNTS = [2_000, 22_000]
+ROW_COUNTS = [2_000, 22_000, 200_000, 2_000_000, 5_000_000]
+
+# Register written to CSV and read back in chunks of STREAM_CHUNK_ROWS
+STREAM_ROW_COUNT = 1_000_000
+STREAM_CHUNK_ROWS = 100_000
+
+# Register split into census sheets of SHEET_ROWS rows, found with each worker count
+SHARDED_ROW_COUNT = 2_000_000
+SHEET_ROWS = 1_500
+WORKER_COUNTS = [1, 2, 4, 8]
+
+SURNAMES = [f'Apellido{i}' for i in range(3_000)]
+
+def make_register(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic population register of households, listed husband,
+    wife and children, mixed with people living alone and blank cells."""
+    rng = np.random.default_rng(seed)
+    apellido, edad, sexo, estado, hijos = [], [], [], [], []
+    while len(apellido) < rows:
+        surname = SURNAMES[rng.integers(len(SURNAMES))]
+        if rng.random() < 0.3:
+            apellido.append(surname if rng.random() > 0.01 else None)
+            edad.append(float(rng.integers(15, 80)))
+            sexo.append(rng.choice(['Male', 'Female']))
+            estado.append(rng.choice(['Single', 'Widowed', None]))
+            hijos.append(None)
+            continue
+        children = int(rng.integers(0, 8))
+        mother_age = float(rng.integers(18, 50))
+        apellido += [surname, SURNAMES[rng.integers(len(SURNAMES))]]
+        edad += [mother_age + rng.integers(0, 15), mother_age]
+        sexo += ['Male', 'Female']
+        estado += ['Married', rng.choice(['Married', 'Single'], p=[0.9, 0.1])]
+        hijos += [None, str(children) if children else None]
+        for _ in range(children):
+            # Now and then a child is listed older than the mother or under another surname
+            apellido.append(surname if rng.random() > 0.05 else SURNAMES[rng.integers(len(SURNAMES))])
+            edad.append(float(rng.integers(0, mother_age + 3)) if rng.random() > 0.02 else np.nan)
+            sexo.append(rng.choice(['Male', 'Female']))
+            estado.append(None)
+            hijos.append(None)
+    return pd.DataFrame({
+        'Apellido_pila': pd.Series(apellido[:rows], dtype=str),
+        'Edad': edad[:rows],
+        'Sexo': pd.Series(sexo[:rows], dtype=str),
+        'Estado Civil': pd.Series(estado[:rows], dtype=str),
+        'Hijos': pd.Series(hijos[:rows], dtype=str),
+    })
+
+def time_blocks(blocks: Callable, df: pd.DataFrame) -> tuple:
+    start = time.perf_counter()
+    result = blocks(df)
+    return result, time.perf_counter() - start
+
+def compare_streaming(rows: int, chunk_rows: int) -> None:
+    """Stream a register from CSV and check it against reading it whole."""
+    df = make_register(rows)
+    df.insert(0, 'Nombre', 'Juan ' + df.pop('Apellido_pila'))
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = os.path.join(directory, 'register.csv')
+        output_path = os.path.join(directory, 'blocks.csv')
+        df.to_csv(input_path, index=False)
+
+        start = time.perf_counter()
+        stats = stream_blocks(input_path, chunk_rows, output_path)
+        seconds = time.perf_counter() - start
+
+        whole = prepare(pd.read_csv(input_path, dtype=str))
+        whole['Prev_Apellido_pila'] = prev_apellido_pila(whole)
+        streamed = pd.read_csv(output_path, dtype=str, keep_default_na=False)['Prev_Apellido_pila']
+    assert (streamed.to_numpy() == whole['Prev_Apellido_pila'].to_numpy()).all()
+    expected = whole.groupby('Prev_Apellido_pila')['Edad'].agg(Mean_Edad='mean', Count='count').reset_index()
+    pd.testing.assert_frame_equal(expected, stats.mean_edad_and_count(), check_dtype=False)
+    print(f"{rows:>10,} rows | streamed from CSV in chunks of {chunk_rows:,} | {rows / seconds:>12,.0f} rows/s")
+
+def compare_sharded(rows: int, sheet_rows: int) -> None:
+    """Check that sharding by census sheet gives the serial blocks, run after run.
+
+    Sheets are cut every sheet_rows rows, through households too, so the
+    runs that have to be found again from the state before them are covered.
+    """
+    df = make_register(rows)
+    df['Hoja_Censo'] = 'Hoja'
+    df['Subhoja_censo'] = (np.arange(rows) // sheet_rows).astype(str)
+    serial, serial_seconds = time_blocks(prev_apellido_pila, df)
+    expected = df.assign(Prev_Apellido_pila=serial).groupby('Prev_Apellido_pila')['Edad'].agg(
+        Mean_Edad='mean', Count='count').reset_index()
+    for workers in WORKER_COUNTS:
+        for run in range(2):
+            (prev, stats), seconds = time_blocks(lambda df: sharded_blocks(df, workers), df)
+            pd.testing.assert_series_equal(serial, prev, check_exact=True)
+            pd.testing.assert_frame_equal(expected, stats.mean_edad_and_count(), check_exact=True, check_dtype=False)
+        print(f"{rows:>10,} rows | {workers} workers | sharded {rows / seconds:>12,.0f} rows/s | "
+              f"serial {rows / serial_seconds:>12,.0f} rows/s | identical in 2 runs")
+
+def main():
+    for rows in ROW_COUNTS:
+        df = make_register(rows)
+        after, after_seconds = time_blocks(prev_apellido_pila, df)
+        line = f"{rows:>10,} rows | {(after != '').sum():>9,} in blocks | linear {len(df) / after_seconds:>12,.0f} rows/s"
+        if rows in REFERENCE_ROW_COUNTS:
+            before, before_seconds = time_blocks(prev_apellido_pila_loop, df)
+            pd.testing.assert_series_equal(before, after, check_dtype=False)
+            line += f" | loop {len(df) / before_seconds:>9,.0f} rows/s | speed-up {before_seconds / after_seconds:.0f}x"
+        print(line)
+    compare_streaming(STREAM_ROW_COUNT, STREAM_CHUNK_ROWS)
+    compare_sharded(SHARDED_ROW_COUNT, SHEET_ROWS)
+
+if __name__ == "__main__":
+    main()
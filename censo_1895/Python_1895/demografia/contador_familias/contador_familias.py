@@ -1,51 +1,329 @@
+import sys
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 
-df=pd.read_csv('C:/Users/tomia/OneDrive/Documentos/Python_1895/demografia/contador_familias/df_familias.csv')
-
-df['Nombre_pila'] = df['Nombre'].str.rsplit(' ', n=1).str[0]
-
-df['Apellido_pila'] = df['Nombre'].str.split().str[-1]
-
-# Convert 'Edad' column to numeric, coercing errors to NaN
-df['Edad'] = pd.to_numeric(df['Edad'], errors='coerce')
-
-# Continue with the rest of your code as before
-
-# Inicializar la columna para almacenar Apellido_pila de la fila anterior
-df['Prev_Apellido_pila'] = ''
-
-# Iterar a través del DataFrame para actualizar la columna
-for i in range(1, len(df)):
-    if pd.notnull(df.loc[i, 'Hijos']) and df.loc[i, 'Sexo'] == 'Female' and (df.loc[i, 'Estado Civil'] == 'Married' or df.loc[i, 'Estado Civil'] == 'Single'):
-        current_apellido_pila = df.loc[i, 'Apellido_pila']
-        previous_apellido_pila = df.loc[i - 1, 'Apellido_pila']
-        values_written = False
-        
-        # Iterar sobre las filas siguientes
-        for j in range(i + 1, len(df)):
-            if df.loc[j, 'Apellido_pila'] == previous_apellido_pila and df.loc[j, 'Edad'] < df.loc[i, 'Edad']:
-                df.loc[j, 'Prev_Apellido_pila'] = previous_apellido_pila
-                values_written = True
-            else:
-                break
-        
-        # Verificar condiciones para la fila i-1
-        if (df.loc[i - 1, 'Apellido_pila'] == previous_apellido_pila and 
-            df.loc[i - 1, 'Sexo'] == 'Male' and 
-            df.loc[i - 1, 'Estado Civil'] == 'Married'):
-            df.loc[i - 1, 'Prev_Apellido_pila'] = previous_apellido_pila
-        
-        # Si se escribieron valores, actualizar las filas i e i-1
-        if values_written:
-            df.loc[i, 'Prev_Apellido_pila'] = previous_apellido_pila
-            df.loc[i - 1, 'Prev_Apellido_pila'] = previous_apellido_pila
-
-bloques = df.groupby('Prev_Apellido_pila').size().reset_index(name='Cantidad')
-
-# Calculate the mean Edad for each Prev_Apellido_pila bloque
-mean_edad_and_count = df.groupby('Prev_Apellido_pila')['Edad'].agg(Mean_Edad='mean', Count='count').reset_index()
-
-print(mean_edad_and_count)
-# Mostrar el DataFrame actualizado
-#df.to_csv('C:/Users/tomia/OneDrive/Documentos/Python_1895/demografia/contador_familias/output.csv', index=False)
\ No newline at end of file
+sys.path.append(str(Path(__file__).resolve().parents[4]))
+from censo_utils import dtypes, parallel
+from censo_utils.vocabulary import Vocabulary
+
+INPUT_PATH = 'C:/Users/tomia/OneDrive/Documentos/Python_1895/demografia/contador_familias/df_familias.csv'
+OUTPUT_PATH = 'C:/Users/tomia/OneDrive/Documentos/Python_1895/demografia/contador_familias/output.csv'
+
+# Canonical spellings shared with demografia.py, and the vocabulary column of each column here
+VOCABULARY_PATH = 'C:/Users/tomia/OneDrive/Documentos/Python_1895/demografia/vocabulario.json'
+VOCABULARY_COLUMNS = {'Lugar de nacimiento': 'Lugar de nacimiento', 'Profesion': 'Profesión'}
+
+# Read the register this many rows at a time, so memory does not grow with
+# its size; None reads it whole
+CHUNK_ROWS = None
+
+# Write every row with its block to OUTPUT_PATH
+WRITE_OUTPUT = False
+
+# Find the blocks of runs of whole census sheets on their own, on
+# parallel.WORKERS processes, SHARDS_PER_WORKER runs per worker
+SHARD_BY_SHEET = True
+SHARDS_PER_WORKER = 4
+
+# A row's block depends on the two rows on either side of it
+CONTEXT_ROWS = 2
+
+# Columns naming the census sheet of a row
+SHEET_COLUMNS = ['Hoja_Censo', 'Subhoja_censo']
+
+# Columns family_blocks reads
+BLOCK_COLUMNS = ['Apellido_pila', 'Edad', 'Sexo', 'Estado Civil', 'Hijos']
+
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """Add the given names, surname and numeric age the family blocks are built from."""
+    # Everything before the last space, and the last word; as rsplit and split
+    # would give, but also on a chunk whose names are all blank
+    df['Nombre_pila'] = df['Nombre'].str.replace(r' [^ ]*$', '', regex=True)
+
+    df['Apellido_pila'] = df['Nombre'].str.extract(r'(\S+)\s*$', expand=False)
+
+    # Convert 'Edad' column to numeric, coercing errors to NaN; float even
+    # when a chunk has no blanks, so every chunk is written alike
+    df['Edad'] = pd.to_numeric(df['Edad'], errors='coerce').astype(float)
+    return df
+
+def canonicalize(df: pd.DataFrame, vocabulary: Vocabulary) -> pd.DataFrame:
+    """Replace birthplaces and professions with their canonical spelling."""
+    for column, vocabulary_column in VOCABULARY_COLUMNS.items():
+        if column in df.columns:
+            df[column] = vocabulary.canonicalize(df[column], vocabulary_column)
+    return df
+
+def prev_apellido_pila_loop(df: pd.DataFrame) -> pd.Series:
+    """Original row-by-row implementation, kept as the reference for benchmark_familias.py."""
+    df = df[['Apellido_pila', 'Edad', 'Sexo', 'Estado Civil', 'Hijos']].copy()
+
+    # Inicializar la columna para almacenar Apellido_pila de la fila anterior
+    df['Prev_Apellido_pila'] = ''
+
+    # Iterar a través del DataFrame para actualizar la columna
+    for i in range(1, len(df)):
+        if pd.notnull(df.loc[i, 'Hijos']) and df.loc[i, 'Sexo'] == 'Female' and (df.loc[i, 'Estado Civil'] == 'Married' or df.loc[i, 'Estado Civil'] == 'Single'):
+            current_apellido_pila = df.loc[i, 'Apellido_pila']
+            previous_apellido_pila = df.loc[i - 1, 'Apellido_pila']
+            values_written = False
+
+            # Iterar sobre las filas siguientes
+            for j in range(i + 1, len(df)):
+                if df.loc[j, 'Apellido_pila'] == previous_apellido_pila and df.loc[j, 'Edad'] < df.loc[i, 'Edad']:
+                    df.loc[j, 'Prev_Apellido_pila'] = previous_apellido_pila
+                    values_written = True
+                else:
+                    break
+
+            # Verificar condiciones para la fila i-1
+            if (df.loc[i - 1, 'Apellido_pila'] == previous_apellido_pila and
+                df.loc[i - 1, 'Sexo'] == 'Male' and
+                df.loc[i - 1, 'Estado Civil'] == 'Married'):
+                df.loc[i - 1, 'Prev_Apellido_pila'] = previous_apellido_pila
+
+            # Si se escribieron valores, actualizar las filas i e i-1
+            if values_written:
+                df.loc[i, 'Prev_Apellido_pila'] = previous_apellido_pila
+                df.loc[i - 1, 'Prev_Apellido_pila'] = previous_apellido_pila
+
+    return df['Prev_Apellido_pila']
+
+def prev_apellido_pila(df: pd.DataFrame) -> pd.Series:
+    """Surname of the family block each row belongs to, '' outside any block.
+
+    A block starts at a mother: a married or single woman with children
+    listed after the row holding her husband's surname. Her children are
+    the rows right after her with that surname, younger than her, and the
+    row before her joins the block if it is a married man or she has
+    children. Gives the same result as prev_apellido_pila_loop with one pass
+    over the rows: the loop's later writes to a row win, and they come in a
+    fixed order. Being the row before the next row's mother comes first,
+    then being a mother with children, then being a child.
+    """
+    return family_blocks(df)[0]
+
+def family_blocks(df: pd.DataFrame, mother_edad: Optional[float] = None) -> Tuple[pd.Series, List[float]]:
+    """prev_apellido_pila of df and the state of the scan after each row.
+
+    The state is the age of the mother whose block the row continues, -inf
+    if none. With mother_edad None, df starts the register; otherwise its
+    first CONTEXT_ROWS rows come from before and mother_edad is the state
+    after them.
+    """
+    apellido = df['Apellido_pila']
+    edad = df['Edad'].to_numpy(dtype=float)
+    n = len(df)
+
+    mother = (df['Hijos'].notna() & (df['Sexo'] == 'Female')
+              & df['Estado Civil'].isin(['Married', 'Single'])).to_numpy(copy=True)
+    if mother_edad is None:
+        mother[:1] = False
+        mother_edad = -np.inf
+    husband = ((df['Sexo'] == 'Male') & (df['Estado Civil'] == 'Married') & apellido.notna()).to_numpy()
+
+    # Mothers whose next row is a younger child with the surname of the row before them
+    next_edad = np.append(edad[1:], np.nan)
+    with np.errstate(invalid='ignore'):
+        has_children = mother & (apellido.shift(-1) == apellido.shift(1)).to_numpy() & (next_edad < edad)
+
+    # A child continues the block of the oldest mother whose children it follows:
+    # same surname as the row before and younger than her
+    same_as_previous = (apellido == apellido.shift(1)).to_numpy().tolist()
+    edades = edad.tolist()
+    starts = has_children.tolist()
+    child = [False] * n
+    states = [mother_edad] * min(n, CONTEXT_ROWS)
+    for r in range(CONTEXT_ROWS, n):
+        if not (same_as_previous[r] and edades[r] < mother_edad):
+            mother_edad = -np.inf
+        if starts[r - 1]:
+            mother_edad = max(mother_edad, edades[r - 1])
+        child[r] = mother_edad > -np.inf
+        states.append(mother_edad)
+    child = np.array(child, dtype=bool)
+
+    next_mother = np.append(mother[1:], False)
+    next_has_children = np.append(has_children[1:], False)
+    first_row = next_mother & (husband | next_has_children)
+
+    apellidos = apellido.to_numpy(dtype=object)
+    previous = np.empty(n, dtype=object)
+    previous[1:] = apellidos[:-1]
+    prev = np.full(n, '', dtype=object)
+    prev[child] = apellidos[child]
+    prev[has_children] = previous[has_children]
+    prev[first_row] = apellidos[first_row]
+    return pd.Series(prev, index=df.index, name='Prev_Apellido_pila', dtype=str), states
+
+class BlockStats:
+    """Rows, ages and age sum of every block, added up chunk by chunk.
+
+    Stats of separate parts of a register merge into those of the whole.
+    Ages are whole numbers of years, so the sums are exact and the mean
+    ages match a groupby over the whole register.
+    """
+
+    def __init__(self):
+        self.totals = pd.DataFrame({'Cantidad': [], 'Count': [], 'Suma_Edad': []},
+                                   index=pd.Index([], name='Prev_Apellido_pila'))
+
+    def add(self, df: pd.DataFrame) -> None:
+        """Add rows holding Prev_Apellido_pila and Edad."""
+        totals = df.groupby('Prev_Apellido_pila')['Edad'].agg(Cantidad='size', Count='count', Suma_Edad='sum')
+        self.totals = self.totals.add(totals, fill_value=0)
+
+    def merge(self, other: 'BlockStats') -> None:
+        self.totals = self.totals.add(other.totals, fill_value=0)
+
+    def bloques(self) -> pd.DataFrame:
+        """Rows in each block, as df.groupby('Prev_Apellido_pila').size()."""
+        return self.totals['Cantidad'].astype(np.int64).reset_index()
+
+    def mean_edad_and_count(self) -> pd.DataFrame:
+        """Mean age and ages given in each block, as df.groupby(...)['Edad'].agg(mean, count)."""
+        count = self.totals['Count'].astype(np.int64)
+        mean_edad = (self.totals['Suma_Edad'] / count).where(count > 0)
+        return pd.DataFrame({'Mean_Edad': mean_edad, 'Count': count}).sort_index().reset_index()
+
+def sheet_bounds(df: pd.DataFrame) -> List[Tuple[int, int]]:
+    """(start, end) positions of each run of rows from the same census sheet."""
+    sheets = df[SHEET_COLUMNS].astype(object).fillna('')
+    new_sheet = (sheets != sheets.shift()).any(axis=1).to_numpy()
+    starts = np.flatnonzero(new_sheet).tolist()
+    return list(zip(starts, starts[1:] + [len(df)]))
+
+def shard_bounds(df: pd.DataFrame, shards: int) -> List[Tuple[int, int]]:
+    """(start, end) positions of runs of whole census sheets, about len(df) / shards rows each."""
+    size = -(-len(df) // max(1, shards))
+    bounds = []
+    for start, end in sheet_bounds(df):
+        if bounds and end - bounds[-1][0] <= size:
+            bounds[-1] = (bounds[-1][0], end)
+        else:
+            bounds.append((start, end))
+    return bounds
+
+def sheet_buffer(df: pd.DataFrame, start: int, end: int) -> Tuple[pd.DataFrame, int]:
+    """Rows of a sheet with the context rows around it, and the position of
+    its first row. Sheets near the top are run from the start of the register."""
+    first = start - CONTEXT_ROWS if start > CONTEXT_ROWS else 0
+    return df.iloc[first:end + CONTEXT_ROWS], start - first
+
+def sheet_blocks(buffer: pd.DataFrame, offset: int, rows: int,
+                 mother_edad: Optional[float]) -> Tuple[pd.Series, float, BlockStats]:
+    """Blocks of the rows rows of buffer from offset, the state after them and their stats.
+
+    mother_edad is the state before them, or None if the buffer starts the register.
+    """
+    prev, states = family_blocks(buffer, mother_edad)
+    prev = prev.iloc[offset:offset + rows]
+    stats = BlockStats()
+    stats.add(pd.DataFrame({'Prev_Apellido_pila': prev, 'Edad': buffer['Edad'].iloc[offset:offset + rows]}))
+    return prev, states[offset + rows - 1], stats
+
+def _sheet_blocks(task: tuple) -> Tuple[pd.Series, float, BlockStats]:
+    return sheet_blocks(*task)
+
+def sharded_blocks(df: pd.DataFrame, workers: Optional[int] = None) -> Tuple[pd.Series, BlockStats]:
+    """prev_apellido_pila of df and its stats, finding the blocks of runs of census sheets separately.
+
+    Each run is found as if no block were open where it starts. Blocks are
+    not expected to cross a sheet, but if the run before does end with one
+    open, the run is found again from that state, so the result always
+    matches prev_apellido_pila exactly.
+    """
+    workers = workers or parallel.WORKERS
+    columns = df[BLOCK_COLUMNS]
+    tasks = [(*sheet_buffer(columns, start, end), end - start, -np.inf if start > CONTEXT_ROWS else None)
+             for start, end in shard_bounds(df, workers * SHARDS_PER_WORKER if workers > 1 else 1)]
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        results = [_sheet_blocks(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_sheet_blocks, tasks))
+
+    blocks, stats, mother_edad = [], BlockStats(), -np.inf
+    for task, (prev, end_edad, sheet_stats) in zip(tasks, results):
+        if task[-1] is not None and mother_edad != task[-1]:
+            prev, end_edad, sheet_stats = sheet_blocks(*task[:-1], mother_edad)
+        blocks.append(prev)
+        stats.merge(sheet_stats)
+        mother_edad = end_edad
+    prev = pd.concat(blocks) if blocks else pd.Series([], index=df.index, name='Prev_Apellido_pila', dtype=str)
+    return prev, stats
+
+def stream_chunks(path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Rows of the register with their block, a chunk at a time.
+
+    The last CONTEXT_ROWS rows of each chunk are held back until the next
+    chunk is read, together with the state of the scan, so a block running
+    across chunks comes out as if the register were read whole.
+    """
+    carry, emitted, mother_edad = None, 0, None
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=str):
+        buffer = prepare(chunk) if carry is None else pd.concat([carry, prepare(chunk)])
+        prev, states = family_blocks(buffer, mother_edad)
+        end = len(buffer) - CONTEXT_ROWS
+        if end > emitted:
+            yield buffer.iloc[emitted:end].assign(Prev_Apellido_pila=prev.iloc[emitted:end])
+        # Keep the rows not yet emitted and the context before them
+        start = max(0, max(end, emitted) - CONTEXT_ROWS)
+        if start > 0:
+            mother_edad = states[start + CONTEXT_ROWS - 1]
+        emitted = max(end, emitted) - start
+        carry = buffer.iloc[start:]
+    if carry is not None and len(carry) > emitted:
+        prev, _ = family_blocks(carry, mother_edad)
+        yield carry.iloc[emitted:].assign(Prev_Apellido_pila=prev.iloc[emitted:])
+
+def stream_blocks(path: str, chunk_rows: int, output_path: Optional[str] = None,
+                  vocabulary: Optional[Vocabulary] = None) -> BlockStats:
+    """Find the blocks of a register read chunk_rows at a time, writing each
+    chunk to output_path as it is done, and return their stats. With a
+    vocabulary, chunks are written with canonical spellings."""
+    stats = BlockStats()
+    for i, chunk in enumerate(stream_chunks(path, chunk_rows)):
+        stats.add(chunk)
+        if output_path is not None:
+            if vocabulary is not None:
+                chunk = canonicalize(chunk, vocabulary)
+            chunk.to_csv(output_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return stats
+
+def main():
+    vocabulary = Vocabulary.load(VOCABULARY_PATH)
+    if CHUNK_ROWS is not None:
+        stats = stream_blocks(INPUT_PATH, CHUNK_ROWS, OUTPUT_PATH if WRITE_OUTPUT else None, vocabulary)
+        bloques = stats.bloques()
+        print(stats.mean_edad_and_count())
+        vocabulary.save()
+        print(vocabulary.report().to_string(index=False))
+        return
+
+    df = canonicalize(dtypes.apply_dtypes(prepare(pd.read_csv(INPUT_PATH))), vocabulary)
+    vocabulary.save()
+    print(vocabulary.report().to_string(index=False))
+    if SHARD_BY_SHEET:
+        df['Prev_Apellido_pila'], stats = sharded_blocks(df)
+        bloques = stats.bloques()
+        mean_edad_and_count = stats.mean_edad_and_count()
+    else:
+        df['Prev_Apellido_pila'] = prev_apellido_pila(df)
+
+        bloques = df.groupby('Prev_Apellido_pila').size().reset_index(name='Cantidad')
+
+        # Calculate the mean Edad for each Prev_Apellido_pila bloque
+        mean_edad_and_count = df.groupby('Prev_Apellido_pila')['Edad'].agg(Mean_Edad='mean', Count='count').reset_index()
+
+    print(mean_edad_and_count)
+    # Mostrar el DataFrame actualizado
+    if WRITE_OUTPUT:
+        df.to_csv(OUTPUT_PATH, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Counts of the 1895 population in every combination of a few dimensions.
+
+Running this script counts the people of poblacion.xlsx once by Partido,
+Condición, Sexo, age band, profession, birthplace, literacy and schooling,
+and writes the counts of the combinations that occur to cubo.parquet. Any
+breakdown along those dimensions is then added up from the cube instead of
+rescanning the records, for example literacy by sex and age band of the
+Italian-born farmers of the rural partidos:
+
+    cube = Cube.load()
+    cube.query(by=['Sexo', 'Banda de edad', 'Lee y escribe'],
+               where={'Condición': 'Rural', 'Lugar de nacimiento': 'Italia',
+                      'Profesión': demografia.AGRICULTORES})
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import storage
+from censo_utils.vocabulary import Vocabulary
+import demografia
+
+cube_path = os.path.join(demografia.directory_path, 'cubo')
+
+# Age bands, closed on the left; minors (under demografia.EDAD_MENORES) are whole bands
+EDAD_LIMITES = [0, 5, 10, demografia.EDAD_MENORES, 20, 30, 40, 50, 60, 70, 80, np.inf]
+BANDAS_DE_EDAD = ['0-4', '5-9', f'10-{demografia.EDAD_MENORES - 1}', f'{demografia.EDAD_MENORES}-19', '20-29',
+                  '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
+
+# Dimensions of the cube; professions and birthplaces in their canonical spelling
+DIMENSIONS = ['Partido', 'Condición', 'Sexo', 'Banda de edad', 'Profesión', 'Lugar de nacimiento',
+              'Lee y escribe', 'Va a la escuela']
+
+def banda_de_edad(edad: pd.Series) -> pd.Series:
+    """Age band of each age, NaN where the age is not given."""
+    return pd.cut(edad, EDAD_LIMITES, right=False, labels=BANDAS_DE_EDAD)
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """People of df in each combination of DIMENSIONS that occurs, missing values included."""
+    cells = df[[dim for dim in DIMENSIONS if dim != 'Banda de edad']].assign(
+        **{'Banda de edad': banda_de_edad(df['Edad'])})
+    return cells.groupby(DIMENSIONS, observed=True, dropna=False).size().rename('Count').reset_index()
+
+class Cube:
+    """Counts built by build_cube, with the breakdowns of the population they add up to."""
+
+    def __init__(self, counts: pd.DataFrame):
+        self.counts = counts
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'Cube':
+        return cls(storage.read_table(path or storage.table_path(cube_path, 'parquet')))
+
+    def save(self, path_stem: Optional[str] = None) -> Path:
+        return storage.write_table(self.counts, path_stem or cube_path, 'parquet')
+
+    def slice(self, where: Optional[Dict[str, object]] = None) -> 'Cube':
+        """The cells whose dimensions take the given value, or one of the given list of values."""
+        mask = np.ones(len(self.counts), dtype=bool)
+        for dim, value in (where or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.counts[dim].isin(values).to_numpy()
+        return Cube(self.counts[mask])
+
+    def query(self, by: Sequence[str] = (), where: Optional[Dict[str, object]] = None) -> pd.DataFrame:
+        """People in each combination of the by dimensions, among those selected by where."""
+        counts = self.slice(where).counts
+        if not by:
+            return pd.DataFrame({'Count': [int(counts['Count'].sum())]})
+        return counts.groupby(list(by), observed=True, dropna=False)['Count'].sum().reset_index()
+
+    def proportion(self, dim: str, value, by: Sequence[str] = (),
+                   where: Optional[Dict[str, object]] = None) -> pd.DataFrame:
+        """Share of the people of each combination of the by dimensions whose dim is value."""
+        total = self.query(by, where)
+        matching = self.query(by, {**(where or {}), dim: value})
+        if not by:
+            return pd.DataFrame({'Proporción': matching['Count'] / total['Count']})
+        merged = total.merge(matching, on=list(by), how='left', suffixes=('', '_value'))
+        total['Proporción'] = merged['Count_value'].fillna(0).to_numpy() / merged['Count'].to_numpy()
+        return total.drop(columns='Count')
+
+def main():
+    start = time.perf_counter()
+    vocabulary = Vocabulary.load(demografia.vocabulary_path)
+    df = demografia.canonical_poblacion(demografia.load_poblacion(demografia.excel_file_path), vocabulary)
+    cube = Cube(build_cube(df))
+    vocabulary.save()
+    path = cube.save()
+    print(f"{len(df):,} people in {len(cube.counts):,} cells written to {path} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
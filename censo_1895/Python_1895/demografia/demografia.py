@@ -1,68 +1,196 @@
 import pandas as pd
 import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import dtypes, excel, parallel, storage
+from censo_utils.vocabulary import Vocabulary
 
 directory_path = 'C:/Users/tomia/OneDrive/Documentos/Python_1895/demografia/'
 excel_file_path = os.path.join(directory_path, 'poblacion.xlsx')
+dataset_directory = os.path.join(directory_path, 'dataset')
+
+# Canonical spellings of professions and birthplaces, shared with contador_familias
+vocabulary_path = os.path.join(directory_path, 'vocabulario.json')
+
+# 'dataset' writes every table once, partitioned by Partido, under dataset_directory;
+# a partido's workbook is written from it when asked for, as in
+#   python demografia.py "San Pedro" Arrecifes
+# 'excel' writes every partido's workbook straight away, as the script always did
+OUTPUT_MODE = 'dataset'
+
+# Columns of poblacion.xlsx used below
+USED_COLUMNS = ['Partido', 'Condición', 'Profesión', 'Lugar de nacimiento', 'Edad', 'Sexo',
+                'Lee y escribe', 'Va a la escuela']
+
+# Professions counted as farmers
+AGRICULTORES = ['chacarero', 'agricultor', 'estanciero']
+
+# Minors are younger than this
+EDAD_MENORES = 14
+
+# Sheet of each partido's workbook and the table it holds
+PARTIDO_SHEETS = {
+    'Menores Info': 'menores_info',
+    'Profesion Counts': 'profesion_counts',
+    'Nacimiento Counts': 'nacimiento_counts',
+    'Agricultores Profesion': 'agricultores_counts',
+}
+
+def count_by_partido(df: pd.DataFrame, column: str) -> pd.Series:
+    """Rows of each value of column in each partido, indexed by (Partido, column)."""
+    return df.groupby(['Partido', column], observed=True).size().rename('Count')
+
+def partido_counts(counts: pd.Series, partidos) -> Dict[object, pd.DataFrame]:
+    """The counts of each partido, as groupby(column).size() over its rows gives them."""
+    tables = {partido: group.droplevel('Partido').reset_index()
+              for partido, group in counts.groupby(level='Partido', sort=False, observed=True)}
+    empty = counts.iloc[:0].droplevel('Partido').reset_index()
+    return {partido: tables.get(partido, empty) for partido in partidos}
+
+def province_counts(counts: pd.Series) -> pd.DataFrame:
+    """The counts of every partido added up."""
+    return counts.groupby(level=1, observed=True).sum().reset_index()
+
+def menores_info(df: pd.DataFrame, partidos) -> pd.DataFrame:
+    """Literacy, schooling, profession and sex of the minors of each partido, one row per partido."""
+    menores_df = df[df['Edad'] < EDAD_MENORES]
+    flags = pd.DataFrame({
+        'Partido': menores_df['Partido'],
+        'Proporción Lee y Escribe': menores_df['Lee y escribe'] == 'si',
+        'Proporción Va a la Escuela': menores_df['Va a la escuela'] == 'si',
+        'Proporción con Profesión': menores_df['Profesión'].notna(),
+        'Total Mujer': menores_df['Sexo'] == 'Mujer',
+        'Total Varon': menores_df['Sexo'] == 'Varón',
+    })
+    grouped = flags.groupby('Partido', observed=True)
+    info = pd.DataFrame({
+        'Proporción Lee y Escribe': grouped['Proporción Lee y Escribe'].mean(),
+        'Proporción Va a la Escuela': grouped['Proporción Va a la Escuela'].mean(),
+        'Proporción con Profesión': grouped['Proporción con Profesión'].mean(),
+        'Total de menores': grouped.size(),
+        'Total Mujer': grouped['Total Mujer'].sum(),
+        'Total Varon': grouped['Total Varon'].sum(),
+    }).reindex(pd.Index(partidos, name='Partido'))
+
+    # Partidos without minors have no proportions and no minors
+    totals = ['Total de menores', 'Total Mujer', 'Total Varon']
+    info[totals] = info[totals].fillna(0).astype('int64')
+    return info.reset_index()
+
+def load_poblacion(path: str) -> pd.DataFrame:
+    """The columns of poblacion.xlsx used here, in the dtypes of dtypes.DTYPE_POLICY."""
+    return dtypes.apply_dtypes(excel.read_workbook(path, usecols=USED_COLUMNS))
+
+def lowercase(values: pd.Series) -> pd.Series:
+    """A categorical with its labels lowercased, kept in sorted order."""
+    values = values.cat.rename_categories([label.lower() for label in values.cat.categories])
+    return values.cat.reorder_categories(sorted(values.cat.categories))
+
+def canonical_poblacion(df: pd.DataFrame, vocabulary: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """df with professions and birthplaces in their canonical spelling and professions lowercased."""
+    vocabulary = vocabulary or Vocabulary()
+    df = df.copy()
+    df['Profesión'] = lowercase(vocabulary.canonicalize(df['Profesión']))
+    df['Lugar de nacimiento'] = vocabulary.canonicalize(df['Lugar de nacimiento'])
+    return df
+
+def rural_poblacion(df: pd.DataFrame, vocabulary: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """The rural population, as canonical_poblacion gives it."""
+    return canonical_poblacion(df[df['Condición'] == 'Rural'], vocabulary)
+
+def build_tables(rural_df: pd.DataFrame) -> Dict[str, object]:
+    """The partidos, the minors of each and the grouped counts of the rural population."""
+    partidos = rural_df['Partido'].unique()
+    # Every table is grouped by partido in one pass; each partido's tables are sliced from them
+    return {
+        'partidos': partidos,
+        'menores_info': menores_info(rural_df, partidos),
+        'profesion_counts': count_by_partido(rural_df, 'Profesión'),
+        'nacimiento_counts': count_by_partido(rural_df, 'Lugar de nacimiento'),
+        'agricultores_counts': count_by_partido(rural_df[rural_df['Profesión'].isin(AGRICULTORES)],
+                                                'Lugar de nacimiento'),
+    }
+
+def write_all_workbooks(tables: Dict[str, object]) -> None:
+    """Write the workbook of every partido straight from the tables."""
+    partidos = tables['partidos']
+    profesion_tables = partido_counts(tables['profesion_counts'], partidos)
+    nacimiento_tables = partido_counts(tables['nacimiento_counts'], partidos)
+    agricultores_tables = partido_counts(tables['agricultores_counts'], partidos)
+
+    for i, partido in enumerate(partidos):
+        # Write to Excel for each 'Partido'
+        excel.write_workbook(os.path.join(directory_path, f'{partido}.xlsx'), {
+            'Menores Info': tables['menores_info'].iloc[[i]],
+            'Profesion Counts': profesion_tables[partido],
+            'Nacimiento Counts': nacimiento_tables[partido],
+            'Agricultores Profesion': agricultores_tables[partido],
+        })
+
+def write_partido_dataset(tables: Dict[str, object]) -> None:
+    """Write each table of the partido workbooks once, as a dataset partitioned by Partido."""
+    for name in PARTIDO_SHEETS.values():
+        table = tables[name] if name == 'menores_info' else tables[name].reset_index()
+        storage.write_dataset(table, os.path.join(dataset_directory, name), 'Partido')
+
+def write_partido_workbook(partido, dataset_directory: str, output_directory: str) -> str:
+    """Write the workbook of one partido from the dataset, as the 'excel' mode writes it."""
+    sheets = {}
+    for sheet, name in PARTIDO_SHEETS.items():
+        table = storage.read_dataset(os.path.join(dataset_directory, name), 'Partido', [partido])
+        sheets[sheet] = table if name == 'menores_info' else table.drop(columns='Partido')
+    if sheets['Menores Info'].empty:
+        raise ValueError(f"Partido '{partido}' is not in {dataset_directory}")
+    return str(excel.write_workbook(os.path.join(output_directory, f'{partido}.xlsx'), sheets))
+
+def write_partido_workbooks(partidos: Optional[List] = None, workers: Optional[int] = None) -> List[parallel.FileResult]:
+    """Write the workbooks of the given partidos from the dataset, of every
+    partido in it if None, on parallel.WORKERS processes."""
+    if partidos is None:
+        partidos = storage.dataset_values(os.path.join(dataset_directory, 'menores_info'), 'Partido')
+    results = parallel.map_files(write_partido_workbook, partidos, dataset_directory, directory_path,
+                                 workers=workers)
+    parallel.report_failures(results)
+    return results
+
+def main(requested_partidos: Optional[List[str]] = None):
+    if requested_partidos:
+        write_partido_workbooks(requested_partidos)
+        return
+
+    vocabulary = Vocabulary.load(vocabulary_path)
+    tables = build_tables(rural_poblacion(load_poblacion(excel_file_path), vocabulary))
+    vocabulary.save()
+    print(vocabulary.report().to_string(index=False))
+    suggestions = vocabulary.suggestions()
+    if not suggestions.empty:
+        print(f"Spellings that may be the same value, to add to {vocabulary_path}:")
+        print(suggestions.to_string(index=False))
+    all_menores_info_df = tables['menores_info']
+    profesion_counts = tables['profesion_counts']
+    nacimiento_counts = tables['nacimiento_counts']
+    agricultores_counts = tables['agricultores_counts']
+
+    if OUTPUT_MODE == 'dataset':
+        write_partido_dataset(tables)
+    else:
+        write_all_workbooks(tables)
+
+    # Province totals from the same grouped counts
+    all_profesion_counts_df = province_counts(profesion_counts)
+    all_nacimiento_counts_df = province_counts(nacimiento_counts)
+    all_agricultores_info_df = province_counts(agricultores_counts)
 
-df = pd.read_excel(excel_file_path)
-rural_df = df[df['Condición'] == 'Rural'].copy()
-rural_df['Profesión'] = rural_df['Profesión'].str.lower()  # Lowercase once
-
-partidos = rural_df['Partido'].unique()
-
-# Lists to store DataFrames for concatenation
-all_menores_info = []
-all_profesion_counts = []
-all_nacimiento_counts = []
-all_agricultores_info = []
-
-for partido in partidos:
-    partido_df = rural_df[rural_df['Partido'] == partido].copy()
-
-    # Agricultores profession
-    agricultores_profesion = partido_df[partido_df['Profesión'].isin(['chacarero', 'agricultor', 'estanciero'])]
-    agricultores_profesion = agricultores_profesion.groupby('Lugar de nacimiento').size().reset_index(name='Count')
-
-    # Profesion counts
-    profesion_counts_df = partido_df.groupby('Profesión').size().reset_index(name='Count')
-    
-    # Nacimiento counts
-    nacimiento_counts_df = partido_df.groupby('Lugar de nacimiento').size().reset_index(name='Count')
-    
-    # Menores info
-    menores_df = partido_df[partido_df['Edad'] < 14]
-    info_menores_df = pd.DataFrame({
-        'Partido': [partido],
-        'Proporción Lee y Escribe': [(menores_df['Lee y escribe'] == 'si').mean()],
-        'Proporción Va a la Escuela': [(menores_df['Va a la escuela'] == 'si').mean()],
-        'Proporción con Profesión': [menores_df['Profesión'].notna().mean()],
-        'Total de menores': [len(menores_df)],
-        'Total Mujer': [(menores_df['Sexo'] == 'Mujer').sum()],
-        'Total Varon': [(menores_df['Sexo'] == 'Varón').sum()]
+    # Write aggregated counts to a new Excel file
+    excel.write_workbook(os.path.join(directory_path, 'aggregated_counts.xlsx'), {
+        'Aggregated Menores Info': all_menores_info_df,
+        'Aggregated Profesion Counts': all_profesion_counts_df,
+        'Aggregated Nacimiento Counts': all_nacimiento_counts_df,
+        'Agricultores Profesion': all_agricultores_info_df,
     })
 
-    # Append to lists
-    all_menores_info.append(info_menores_df)
-    all_profesion_counts.append(profesion_counts_df)
-    all_nacimiento_counts.append(nacimiento_counts_df)
-    all_agricultores_info.append(agricultores_profesion)
-
-    # Write to Excel for each 'Partido'
-    with pd.ExcelWriter(os.path.join(directory_path, f'{partido}.xlsx')) as writer:
-        info_menores_df.to_excel(writer, sheet_name='Menores Info', index=False)
-        profesion_counts_df.to_excel(writer, sheet_name='Profesion Counts', index=False)
-        nacimiento_counts_df.to_excel(writer, sheet_name='Nacimiento Counts', index=False)
-        agricultores_profesion.to_excel(writer, sheet_name='Agricultores Profesion', index=False)
-
-# Concatenate all DataFrames outside the loop
-all_menores_info_df = pd.concat(all_menores_info)
-all_profesion_counts_df = pd.concat(all_profesion_counts).groupby('Profesión').sum().reset_index()
-all_nacimiento_counts_df = pd.concat(all_nacimiento_counts).groupby('Lugar de nacimiento').sum().reset_index()
-all_agricultores_info_df = pd.concat(all_agricultores_info).groupby('Lugar de nacimiento').sum().reset_index()
-
-# Write aggregated counts to a new Excel file
-with pd.ExcelWriter(os.path.join(directory_path, 'aggregated_counts.xlsx')) as writer:
-    all_menores_info_df.to_excel(writer, sheet_name='Aggregated Menores Info', index=False)
-    all_profesion_counts_df.to_excel(writer, sheet_name='Aggregated Profesion Counts', index=False)
-    all_nacimiento_counts_df.to_excel(writer, sheet_name='Aggregated Nacimiento Counts', index=False)
-    all_agricultores_info_df.to_excel(writer, sheet_name='Agricultores Profesion', index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    main(sys.argv[1:])
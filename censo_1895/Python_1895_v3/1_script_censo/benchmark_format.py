@@ -0,0 +1,63 @@
+import time
+import numpy as np
+import pandas as pd
+from typing import Callable
+
+from script_format import remove_blank_rows, clean_question_marks, extract_first_letter, transform_values, transform_values_rowwise
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+COLUMNS_TO_CHECK = [2, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+COLUMNS_TO_TRANSFORM = [2, 4, 5, 6, 7, 8]
+
+# Spellings found in the transcribed workbooks
+MEASURE_SPELLINGS = ['12', '3,5', '1/2', '1 1/2', '10 H', '4 h', '3,5 cc', '2 CC', '500 METROS', '250 M',
+                     '80 mt', '7 MC', 'sin dato', '', '?']
+MEDIDAS = ['H', 'CC', 'M', 'MC', np.nan]
+TENENCIAS = ['A', 'M', 'P', 'a', 'propietario', np.nan]
+
+def make_partido(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic stage 1 input workbook with the spellings seen in the census."""
+    rng = np.random.default_rng(seed)
+
+    def measure_column(numeric_share: float) -> list:
+        numbers = rng.gamma(1.5, 80, rows).round(1)
+        spellings = rng.choice(MEASURE_SPELLINGS, rows)
+        use_number = rng.random(rows) < numeric_share
+        return [float(n) if keep else (s or np.nan) for n, s, keep in zip(numbers, spellings, use_number)]
+
+    df = pd.DataFrame({
+        'cuartel': rng.integers(1, 10, rows),
+        'titular': [f'Titular {i}' for i in rng.integers(0, rows, rows)],
+        'tenencia': rng.choice(np.array(TENENCIAS, dtype=object), rows),
+        'extension': measure_column(0.7),
+        'medida': rng.choice(np.array(MEDIDAS, dtype=object), rows),
+    })
+    for crop in ['trigo', 'maiz', 'lino', 'cebada', 'alfalfa']:
+        df[crop] = measure_column(0.9)
+    for machine in ['arados', 'segadoras', 'rastrillos', 'trilladoras', 'vapor', 'agua', 'bombas']:
+        df[machine] = rng.integers(0, 5, rows)
+    return df
+
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """Run the steps of process_file that come before transform_values."""
+    df = remove_blank_rows(df).iloc[:, 1:]
+    df = clean_question_marks(df, [i for i in COLUMNS_TO_CHECK if i < df.shape[1]])
+    return extract_first_letter(df, 1)
+
+def time_transform(transform: Callable, df: pd.DataFrame) -> tuple:
+    start = time.perf_counter()
+    result = transform(df.copy(), COLUMNS_TO_TRANSFORM)
+    return result, time.perf_counter() - start
+
+def main():
+    for rows in ROW_COUNTS:
+        df = prepare(make_partido(rows))
+        before, before_seconds = time_transform(transform_values_rowwise, df)
+        after, after_seconds = time_transform(transform_values, df)
+
+        pd.testing.assert_frame_equal(before.fillna(''), after.fillna(''))
+        print(f"{rows:>9,} rows | row-wise {len(df) / before_seconds:>12,.0f} rows/s | "
+              f"columnar {len(df) / after_seconds:>12,.0f} rows/s | speed-up {before_seconds / after_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import tempfile
+import importlib.util
+import pandas as pd
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import excel
+
+from benchmark_format import make_partido
+
+# Rows of the smallest, a typical and the largest partido workbooks
+ROW_COUNTS = [2_000, 20_000, 100_000]
+# Styled but empty rows left below the data by the spreadsheet it was typed in
+TRAILING_FORMATTED_ROWS = 200_000
+# Columns a stage that only needs a few of them would ask for
+PROJECTED_COLUMNS = ['cuartel', 'titular', 'tenencia', 'extension', 'medida', 'trigo', 'maiz']
+
+def available_engines() -> list:
+    engines = ['pandas', 'streaming']
+    if importlib.util.find_spec('python_calamine') is not None:
+        engines.append('calamine')
+    return engines
+
+def write_partido(path: str, rows: int, trailing_rows: int = 0) -> None:
+    """Write a synthetic stage 1 input, optionally formatted far below its data."""
+    df = make_partido(rows)
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+        if trailing_rows:
+            worksheet = writer.sheets['Sheet1']
+            border = writer.book.add_format({'border': 1})
+            for row in range(rows + 1, rows + 1 + trailing_rows):
+                worksheet.write_blank(row, 0, None, border)
+
+def time_read(path: str, engine: str, usecols=None) -> tuple:
+    start = time.perf_counter()
+    df = excel.read_workbook(path, usecols=usecols, engine=engine)
+    return df, time.perf_counter() - start
+
+def compare_engines(label: str, path: str, usecols=None) -> None:
+    reference = None
+    timings = []
+    for engine in available_engines():
+        df, seconds = time_read(path, engine, usecols)
+        if reference is None:
+            reference = df
+        else:
+            pd.testing.assert_frame_equal(reference, df, check_exact=True)
+        timings.append(f"{engine} {seconds:6.2f}s")
+    size = os.path.getsize(path) / 2**20
+    print(f"{label:<40} {size:6.1f} MB | {len(reference):>9,} rows | " + " | ".join(timings))
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in ROW_COUNTS:
+            path = os.path.join(directory, f'partido_{rows}.xlsx')
+            write_partido(path, rows)
+            compare_engines(f"{rows:,} rows, all columns", path)
+            compare_engines(f"{rows:,} rows, {len(PROJECTED_COLUMNS)} columns", path, PROJECTED_COLUMNS)
+
+        rows = ROW_COUNTS[1]
+        path = os.path.join(directory, 'partido_formatted.xlsx')
+        write_partido(path, rows, TRAILING_FORMATTED_ROWS)
+        compare_engines(f"{rows:,} rows + {TRAILING_FORMATTED_ROWS:,} formatted", path)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,47 @@
 import os
+import sys
 import pandas as pd
 import numpy as np
 import re
-from typing import List, Dict, Callable
+import json
+import hashlib
+import inspect
+from pathlib import Path
+from typing import List, Dict, Callable, Optional
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import excel, parallel, storage
 
 INPUT_DIRECTORY = 'C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/1_script_censo/input'
 OUTPUT_DIRECTORY = 'C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/1_script_censo/output'
+PARSE_CACHE_PATH = 'C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/1_script_censo/parse_cache.json'
+
+# Factor applied to every measurement of a row according to its 'medida'
+MEDIDA_FACTORS = {'CC': 1.68, 'M': 1/1000, 'MC': 1/10000}
+
+# Unit suffixes understood by cell_checker, in the order they are tried
+SUFFIX_RULES = [
+    (suffix, re.compile(rf'(\d+\.?\d*)\s*{suffix}'), transformation)
+    for suffix, transformation in [
+        ('MC', lambda x: x / 1000),
+        ('H', lambda x: x),
+        ('h', lambda x: x),
+        ('1/2', lambda x: 0.5),
+        ('1 1/2', lambda x: 1.5),
+        ('CC', lambda x: x * 1.68),
+        ('cc', lambda x: x * 1.68),
+        ('METROS', lambda x: x / 1000),
+        ('M', lambda x: x / 1000),
+        ('m', lambda x: x / 1000),
+        ('mt', lambda x: x / 1000)
+    ]
+]
 
 def setup_directories() -> None:
     os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
 
 def get_excel_files(directory: str) -> List[str]:
-    return [f for f in os.listdir(directory) if f.endswith('.xlsx')]
+    return sorted(f for f in os.listdir(directory) if f.endswith('.xlsx'))
 
 def remove_blank_rows(df: pd.DataFrame) -> pd.DataFrame:
     """Remove rows that are completely blank."""
@@ -30,34 +60,132 @@ def extract_first_letter(df: pd.DataFrame, column: int) -> pd.DataFrame:
         df.iloc[:, column] = df.iloc[:, column].astype(str).str[0].str.upper()
     return df
 
-def cell_checker(value):
+def parse_suffix(text: str) -> Optional[float]:
+    """Apply the suffix grammar to a comma-repaired string, None if no rule matches."""
+    for suffix, pattern, transformation in SUFFIX_RULES:
+        if suffix in text:
+            match = pattern.search(text)
+            if match:
+                return transformation(float(match.group(1)))
+    return None
+
+def grammar_hash() -> str:
+    """Hash of the source of SUFFIX_RULES and of the functions applying them."""
+    digest = hashlib.sha256()
+    for suffix, pattern, transformation in SUFFIX_RULES:
+        digest.update(repr((suffix, pattern.pattern, inspect.getsource(transformation).strip())).encode())
+    for func in (parse_suffix, parse_suffixes):
+        digest.update(inspect.getsource(func).encode())
+    return digest.hexdigest()
+
+class ParseCache:
+    """Suffix grammar results for distinct raw cell strings, persisted between runs.
+
+    Entries map the raw string to its parsed number, or None when no rule
+    matched. Only strings missing from the cache reach the regex path. The
+    file records the grammar_hash the entries were parsed with; a cache
+    saved under another grammar is discarded on load.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, Optional[float]]] = None, path: Optional[str] = None):
+        self.entries = entries if entries is not None else {}
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.unparseable = set()
+        self.added = set()
+
+    @classmethod
+    def load(cls, path: str) -> 'ParseCache':
+        """Load the cache from path, starting empty if it does not exist yet or
+        was saved under another grammar."""
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.keys() == {'grammar', 'entries'} and saved['grammar'] == grammar_hash():
+                return cls(saved['entries'], path)
+        return cls(path=path)
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the cache atomically so an interrupted run never corrupts it."""
+        path = path or self.path
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'grammar': grammar_hash(), 'entries': self.entries}, f,
+                      ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def take_added(self) -> 'ParseCache':
+        """The entries added and the lookups counted since the last call, as a
+        cache to merge; they are reset here. Workers hand this back instead of
+        the whole cache."""
+        added = ParseCache({raw: self.entries[raw] for raw in self.added})
+        added.hits, added.misses, added.unparseable = self.hits, self.misses, self.unparseable
+        self.hits, self.misses, self.unparseable, self.added = 0, 0, set(), set()
+        return added
+
+    def merge(self, other: 'ParseCache') -> None:
+        """Add the entries and counters of a cache made by take_added."""
+        self.entries.update(other.entries)
+        self.hits += other.hits
+        self.misses += other.misses
+        self.unparseable.update(other.unparseable)
+
+    def parse(self, raw: str) -> Optional[float]:
+        """Parse a single raw string through the cache."""
+        if raw in self.entries:
+            self.hits += 1
+            number = self.entries[raw]
+        else:
+            self.misses += 1
+            number = self.entries[raw] = parse_suffix(raw.replace(',', '.'))
+            self.added.add(raw)
+        if number is None:
+            self.unparseable.add(raw)
+        return number
+
+    def parse_many(self, raw: pd.Series) -> pd.Series:
+        """Parse a Series of distinct raw strings, sending only unseen ones to parse_suffixes."""
+        known = raw.isin(self.entries.keys()).to_numpy()
+        self.hits += int(known.sum())
+        self.misses += int((~known).sum())
+
+        if not known.all():
+            unseen = raw[~known]
+            parsed = parse_suffixes(unseen.str.replace(',', '.', regex=False))
+            self.entries.update(zip(unseen, parsed.astype(object).where(parsed.notna(), None)))
+            self.added.update(unseen)
+
+        numbers = raw.map(self.entries).astype(float)
+        self.unparseable.update(raw[numbers.isna()])
+        return numbers
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        """Summarize cache use and the strings nothing could parse during this run."""
+        lines = [f"Parse cache: {self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate), "
+                 f"{len(self.entries)} entries"]
+        if self.unparseable:
+            lines.append(f"Unparseable strings ({len(self.unparseable)}): "
+                         + ', '.join(repr(str(raw)) for raw in sorted(self.unparseable)))
+        return '\n'.join(lines)
+
+def cell_checker(value, parse_cache: Optional[ParseCache] = None):
     """Check and transform cell based on specific patterns."""
-    conditions = {
-        'MC': lambda x: float(x) / 1000,
-        'H': float,
-        'h': float,
-        '1/2': lambda x: 0.5,
-        '1 1/2': lambda x: 1.5,
-        'CC': lambda x: float(x) * 1.68,
-        'cc': lambda x: float(x) * 1.68,
-        'METROS': lambda x: float(x) / 1000,
-        'M': lambda x: float(x) / 1000,
-        'm': lambda x: float(x) / 1000,
-        'mt': lambda x: float(x) / 1000
-    }
-    
     value_str = str(value).replace(',', '.')
-    for condition, transformation in conditions.items():
-        if condition in value_str:
-            match = re.search(rf'(\d+\.?\d*)\s*{condition}', value_str)
-            if match:
-                return transformation(match.group(1))
+    number = parse_cache.parse(str(value)) if parse_cache is not None else parse_suffix(value_str)
+    if number is not None:
+        return number
     try:
         return float(value_str)
     except ValueError:
         return value
 
-def transform_values(df: pd.DataFrame, columns_to_transform: List[int]) -> pd.DataFrame:
+def transform_values_rowwise(df: pd.DataFrame, columns_to_transform: List[int]) -> pd.DataFrame:
+    """Original row-by-row implementation, kept as the reference for benchmark_format.py."""
     def transform_row(row):
         transformation_factor = 1
 
@@ -86,9 +214,93 @@ def transform_values(df: pd.DataFrame, columns_to_transform: List[int]) -> pd.Da
 
     return df.apply(transform_row, axis=1)
 
-def process_file(file_path: str) -> None:
-    df = pd.read_excel(file_path)
-    
+def parse_suffixes(text: pd.Series) -> pd.Series:
+    """Apply the cell_checker suffix grammar to a whole column of strings.
+
+    Returns the parsed number for each string, or NaN where no rule matched.
+    Rules are tried in SUFFIX_RULES order, exactly like cell_checker.
+    """
+    parsed = pd.Series(np.nan, index=text.index, dtype=float)
+    pending = pd.Series(True, index=text.index)
+    for suffix, pattern, transformation in SUFFIX_RULES:
+        candidates = pending & text.str.contains(suffix, regex=False)
+        if not candidates.any():
+            continue
+        number = text[candidates].str.extract(pattern, expand=False).dropna()
+        parsed[number.index] = transformation(number.astype(float))
+        pending[number.index] = False
+    return parsed
+
+def normalize_column(column: pd.Series, factor: np.ndarray, parse_cache: Optional[ParseCache] = None) -> pd.Series:
+    """Convert a measurement column to numbers, scaling plain numbers by factor.
+
+    Numbers and strings that float() accepts are multiplied by the row factor,
+    strings with a unit suffix go through the cell_checker grammar unscaled and
+    anything else is kept as the comma-repaired string. Each distinct string
+    is parsed once and the result is broadcast back to the rows. Suffixed
+    strings are looked up in parse_cache when one is given.
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype(float) * factor
+
+    values = column.to_numpy(dtype=object)
+    is_text = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+    result = np.empty(len(values), dtype=object)
+    result[~is_text] = np.asarray(values[~is_text], dtype=float) * factor[~is_text]
+
+    if is_text.any():
+        codes, uniques = pd.factorize(pd.Series(values[is_text], dtype=object))
+        uniques = pd.Series(uniques, dtype=object)
+        repaired = uniques.str.replace(',', '.', regex=False)
+        as_float = [_float_or_none(value) for value in repaired]
+        scaled = np.array([value is not None for value in as_float], dtype=bool)
+        if parse_cache is not None:
+            suffixed = parse_cache.parse_many(uniques[~scaled])
+        else:
+            suffixed = parse_suffixes(repaired[~scaled])
+
+        parsed = np.array(as_float, dtype=object)
+        parsed[~scaled] = np.where(suffixed.notna(), suffixed.to_numpy(dtype=object), repaired[~scaled].to_numpy())
+
+        text_result = parsed[codes]
+        scale_rows = scaled[codes]
+        text_result[scale_rows] = text_result[scale_rows].astype(float) * factor[is_text][scale_rows]
+        result[is_text] = text_result
+
+    return pd.Series(result, index=column.index, name=column.name).infer_objects()
+
+def _float_or_none(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def transform_values(df: pd.DataFrame, columns_to_transform: List[int],
+                     parse_cache: Optional[ParseCache] = None) -> pd.DataFrame:
+    """Normalize measurement columns to hectares using whole-column operations.
+
+    Produces the same result as transform_values_rowwise: the 'medida' column
+    (index 3) sets a per-row factor and is then replaced by 'H'.
+    """
+    df = df.copy()
+    factor = np.ones(len(df))
+
+    if df.shape[1] > 3:
+        medida = df.iloc[:, 3]
+        has_medida = (medida.notna() & df.iloc[:, 2].notna()).to_numpy()
+        for unit, unit_factor in MEDIDA_FACTORS.items():
+            factor[has_medida & (medida == unit).to_numpy()] = unit_factor
+        if has_medida.any():
+            df.isetitem(3, medida.astype(object).mask(has_medida, 'H').infer_objects())
+
+    for col in columns_to_transform:
+        if col < df.shape[1]:
+            df.isetitem(col, normalize_column(df.iloc[:, col], factor, parse_cache))
+
+    return df
+
+def format_dataframe(df: pd.DataFrame, parse_cache: Optional[ParseCache] = None) -> pd.DataFrame:
+    """Clean and normalize a raw census workbook."""
     # Remove blank rows
     df = remove_blank_rows(df)
     
@@ -106,9 +318,7 @@ def process_file(file_path: str) -> None:
         df = extract_first_letter(df, 1)
     
     # Apply transformations
-    df = transform_values(df, columns_to_transform)
-    
-    df = df.fillna('')
+    df = transform_values(df, columns_to_transform, parse_cache)
     
     # Assign column names
     column_names = [
@@ -118,21 +328,53 @@ def process_file(file_path: str) -> None:
         'Rastrillos', 'Trilladoras a vapor', 'Maquinas a vapor', 'Maquinas a agua', 'Bombas'
     ]
     df.columns = column_names[:df.shape[1]]  # Assign only as many names as there are columns
-    
-    output_file_path = os.path.join(OUTPUT_DIRECTORY, os.path.basename(file_path))
-    df.to_excel(output_file_path, index=False)
+    return df
+
+def output_stem(input_stem: str) -> str:
+    """Output path, without extension, for the workbook named input_stem."""
+    return os.path.join(OUTPUT_DIRECTORY, input_stem)
+
+def save_results(df: pd.DataFrame, output_stem: str) -> str:
+    """Save a formatted partido in the intermediate format."""
+    # Blank cells are written as '' in Excel; columnar formats keep them as nulls
+    if storage.INTERMEDIATE_FORMAT == 'xlsx':
+        df = df.fillna('')
+    return storage.write_table(df, output_stem)
+
+def read_file(file_path: str) -> pd.DataFrame:
+    return excel.read_workbook(file_path)
+
+def format_file(file_path: str, df: pd.DataFrame, parse_cache: Optional[ParseCache] = None) -> tuple:
+    """Format one workbook, returning it with the parse cache entries it added."""
+    df = format_dataframe(df, parse_cache)
+    return df, parse_cache.take_added() if parse_cache is not None else None
+
+def save_file(file_path: str, formatted: tuple) -> Optional[ParseCache]:
+    """Save a workbook formatted by format_file, returning the parse cache entries it added."""
+    df, parse_cache = formatted
+    input_stem = os.path.splitext(os.path.basename(file_path))[0]
+    output_file_path = save_results(df, output_stem(input_stem))
     print(f"Processed and saved {os.path.basename(file_path)} to {output_file_path}")
+    return parse_cache
+
+def process_file(file_path: str, parse_cache: Optional[ParseCache] = None) -> Optional[ParseCache]:
+    """Format and save one workbook, returning the parse cache entries it added."""
+    return save_file(file_path, format_file(file_path, read_file(file_path), parse_cache))
 
 def main():
     setup_directories()
     excel_files = get_excel_files(INPUT_DIRECTORY)
+    parse_cache = ParseCache.load(PARSE_CACHE_PATH)
     
-    for file in excel_files:
-        file_path = os.path.join(INPUT_DIRECTORY, file)
-        try:
-            process_file(file_path)
-        except Exception as e:
-            print(f"Error processing {file}: {str(e)}")
+    file_paths = [os.path.join(INPUT_DIRECTORY, file) for file in excel_files]
+    results = parallel.map_stages(read_file, format_file, save_file, file_paths, parse_cache)
+    for result in results:
+        if result.ok and result.value is not None:
+            parse_cache.merge(result.value)
+    parallel.report_failures(results)
+
+    parse_cache.save()
+    print(parse_cache.report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
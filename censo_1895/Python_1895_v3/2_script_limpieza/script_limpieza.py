@@ -1,80 +1,144 @@
 import pandas as pd
 import os
+import sys
 import logging
 from typing import List, Dict, Optional
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import dtypes, excel, filters, linkage, parallel, storage
+
 # Constants
 INPUT_DIRECTORY = Path('C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/1_script_censo/output')
 OUTPUT_DIRECTORY = Path('C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/2_script_limpieza/output')
 
+# Also write a workbook with one sheet per filter level, for review only
+WRITE_REVIEW_WORKBOOK = False
+REVIEW_DIRECTORY = Path('C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/2_script_limpieza/revision')
+
+# Also add linkage.OWNER_ID_COLUMN, the titular with the spelling variants of
+# the name linked into one owner, for the stages after this one to group on
+LINK_TITULARES = False
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def setup_directories() -> None:
     """Ensure the output directory exists."""
     OUTPUT_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    if WRITE_REVIEW_WORKBOOK:
+        REVIEW_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
-def get_excel_files(directory: Path) -> List[Path]:
-    """Get a list of Excel files in the given directory."""
-    return list(directory.glob('*.xlsx'))
+def get_input_files(directory: Path) -> List[Path]:
+    """Get the stage 1 outputs in the given directory."""
+    return storage.list_tables(directory)
 
-def apply_filters(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-    """Apply filters to the dataframe and return filtered dataframes with descriptions."""
-    # Ensure columns 4, 5, 6, 7, 8 are numeric
+def apply_filters(df: pd.DataFrame) -> pd.DataFrame:
+    """Add the deepest filter level each row passes as filters.LEVEL_COLUMN.
+
+    The cascade is titular, extension and tipo not null, tipo A, M or P,
+    and at least one hectare of a crop (ten of alfalfa).
+    """
+    # Ensure columns 4, 5, 6, 7, 8 are numeric. isetitem replaces the column: assigning
+    # through iloc keeps an object column, which stage 3 adds up differently than the
+    # float column read back from disk, so results would depend on the handoff
     for col in [4, 5, 6, 7, 8]:
-        df.iloc[:, col] = pd.to_numeric(df.iloc[:, col], errors='coerce')
-
-    filters = {
-        '0_tabla_original': df,
-        '1_filtro_titular_(nonulo)': df[df.iloc[:, 0].notna()],
-        '2_filtro_extension_(nonulo)': df[df.iloc[:, 0].notna() & df.iloc[:, 2].notna()],
-        '3_filtro_tipo_(nonulos)': df[df.iloc[:, 0].notna() & df.iloc[:, 2].notna() & df.iloc[:, 1].notna()],
-        '4_filtro_tipo_AMP': df[df.iloc[:, 0].notna() & df.iloc[:, 2].notna() & df.iloc[:, 1].notna() &
-                                df.iloc[:, 1].astype(str).str.upper().isin(['A', 'M', 'P'])],
-        '5_filtro_cultivo_(_1)': df[df.iloc[:, 0].notna() & df.iloc[:, 2].notna() & df.iloc[:, 1].notna() &
-                                    df.iloc[:, 1].astype(str).str.upper().isin(['A', 'M', 'P']) &
-                                    ((df.iloc[:, 4] >= 1) | (df.iloc[:, 5] >= 1) |
-                                     (df.iloc[:, 6] >= 1) | (df.iloc[:, 7] >= 10))]
-    }
-    return filters
-
-def process_file(file_path: Path) -> Optional[Dict[str, pd.DataFrame]]:
-    """Process a single Excel file, apply filters, and return results."""
-    logging.info(f"Processing file: {file_path.name}")
-   
+        df.isetitem(col, pd.to_numeric(df.iloc[:, col], errors='coerce'))
+
+    tipo = df.iloc[:, 1]
+    conditions = [
+        df.iloc[:, 0].notna(),
+        df.iloc[:, 2].notna(),
+        tipo.notna(),
+        tipo.astype(str).str.upper().isin(['A', 'M', 'P']),
+        (df.iloc[:, 4] >= 1) | (df.iloc[:, 5] >= 1) | (df.iloc[:, 6] >= 1) | (df.iloc[:, 7] >= 10),
+    ]
+
+    passed = pd.Series(True, index=df.index)
+    level = pd.Series(0, index=df.index, dtype='int8')
+    for condition in conditions:
+        passed &= condition
+        level += passed
+
+    df[filters.LEVEL_COLUMN] = level
+    return df
+
+def clean_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Stage 2 of a stage 1 table: the dtypes of dtypes.DTYPE_POLICY, the filter
+    level of each row and, with LINK_TITULARES, the owner id of each titular.
+    The pipeline runner and main both go through here."""
+    table = apply_filters(dtypes.apply_dtypes(df))
+    if LINK_TITULARES:
+        owners = linkage.link(table.iloc[:, 0])
+        table[linkage.OWNER_ID_COLUMN] = owners.ids
+        logging.info(f"{owners.names} titulares linked into {owners.owners} owners")
+    return table
+
+def read_file(file_path: Path) -> Optional[pd.DataFrame]:
+    """Read a stage 1 output, logging instead of raising if it cannot be read."""
     try:
-        df = pd.read_excel(file_path)
+        return storage.read_table(file_path)
     except Exception as e:
         logging.error(f"Error reading file {file_path}: {e}")
         return None
 
-    filtered_dfs = apply_filters(df)
-    for description, filtered_df in filtered_dfs.items():
-        logging.info(f"{description}: {len(filtered_df)} rows")
+def filter_file(file_path: Path, df: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """Apply the filters to a stage 1 output read by read_file."""
+    logging.info(f"Processing file: {file_path.name}")
+    if df is None:
+        return None
+
+    table = clean_table(df)
+    for description, rows in filters.level_counts(table).items():
+        logging.info(f"{description}: {rows} rows")
+
+    return table
 
-    return filtered_dfs
+def process_file(file_path: Path) -> Optional[pd.DataFrame]:
+    """Process a single Excel file, apply filters, and return results."""
+    return filter_file(file_path, read_file(file_path))
+
+def output_stem(input_stem: str) -> Path:
+    """Output path, without extension, for the stage 1 output named input_stem."""
+    return OUTPUT_DIRECTORY / f'{input_stem}_tabla_final'
+
+def save_review_workbook(table: pd.DataFrame, output_stem: Path) -> Path:
+    """Write one sheet per filter level, as stage 2 used to, for review."""
+    return excel.write_workbook(REVIEW_DIRECTORY / f'{output_stem.name}.xlsx', filters.split_levels(table))
 
-def save_results(filtered_dfs: Dict[str, pd.DataFrame], output_path: Path) -> None:
-    """Save filtered dataframes to an Excel file."""
+def save_results(table: pd.DataFrame, output_stem: Path) -> None:
+    """Save the filtered table in the intermediate format, with a sidecar
+    holding the rows of each filter level and the size and modification
+    time of the table."""
     try:
-        with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-            for sheet_name, filtered_df in filtered_dfs.items():
-                filtered_df.to_excel(writer, sheet_name=sheet_name, index=False)
-        logging.info(f"Excel saved: {output_path}")
+        output_path = storage.write_table(table, output_stem)
+        storage.write_metadata(output_path, {
+            'rows': len(table),
+            'level_counts': filters.level_counts(table),
+            'signature': storage.file_signature(output_path),
+        })
+        logging.info(f"Results saved: {output_path}")
+        if WRITE_REVIEW_WORKBOOK:
+            logging.info(f"Review workbook saved: {save_review_workbook(table, output_stem)}")
     except Exception as e:
-        logging.error(f"Error saving Excel file {output_path}: {e}")
+        logging.error(f"Error saving results {output_stem}: {e}")
+
+def save_file(file_path: Path, table: Optional[pd.DataFrame]) -> None:
+    """Save the table filter_file made from a stage 1 output."""
+    if table is not None:
+        save_results(table, output_stem(storage.table_stem(file_path)))
+
+def process_and_save(file_path: Path) -> None:
+    """Filter one stage 1 output and save the result."""
+    save_file(file_path, process_file(file_path))
 
 def main() -> None:
-    """Main function to process all Excel files in the input directory."""
+    """Main function to process all stage 1 outputs in the input directory."""
     setup_directories()
-    excel_files = get_excel_files(INPUT_DIRECTORY)
+    input_files = get_input_files(INPUT_DIRECTORY)
 
-    for file_path in excel_files:
-        filtered_dfs = process_file(file_path)
-        if filtered_dfs:
-            output_path = OUTPUT_DIRECTORY / f'{file_path.stem}_tabla_final.xlsx'
-            save_results(filtered_dfs, output_path)
+    results = parallel.map_stages(read_file, filter_file, save_file, input_files)
+    parallel.report_failures(results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
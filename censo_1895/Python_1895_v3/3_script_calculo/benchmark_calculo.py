@@ -0,0 +1,40 @@
+import sys
+import time
+import pandas as pd
+from pathlib import Path
+from typing import Callable
+
+# Build the synthetic partidos with stages 1 and 2
+STAGES_DIRECTORY = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(STAGES_DIRECTORY / '1_script_censo'), str(STAGES_DIRECTORY / '2_script_limpieza')]
+
+from benchmark_format import make_partido
+from script_format import format_dataframe
+from script_limpieza import apply_filters
+from script_calculo import calculate_tables, calculate_tables_per_level
+
+ROW_COUNTS = [10_000, 100_000, 1_000_000]
+
+def make_table(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a synthetic stage 2 table, with its filter level column."""
+    return apply_filters(format_dataframe(make_partido(rows, seed)))
+
+def time_calculate(calculate: Callable, table: pd.DataFrame) -> tuple:
+    start = time.perf_counter()
+    result = calculate(table)
+    return result, time.perf_counter() - start
+
+def main():
+    for rows in ROW_COUNTS:
+        table = make_table(rows)
+        before, before_seconds = time_calculate(calculate_tables_per_level, table)
+        after, after_seconds = time_calculate(calculate_tables, table)
+
+        assert list(before) == list(after)
+        for sheet in before:
+            pd.testing.assert_frame_equal(before[sheet], after[sheet], check_exact=True)
+        print(f"{rows:>9,} rows | per level {len(table) / before_seconds:>12,.0f} rows/s | "
+              f"one pass {len(table) / after_seconds:>12,.0f} rows/s | speed-up {before_seconds / after_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
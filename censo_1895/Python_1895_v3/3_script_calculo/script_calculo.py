@@ -1,8 +1,13 @@
+import numpy as np
 import pandas as pd
 import os
-from typing import List, Dict
+import sys
+from typing import List, Dict, Optional
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import excel, filters, linkage, parallel, storage
+
 # Constants
 INPUT_DIRECTORY = Path('C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/2_script_limpieza/output')
 OUTPUT_DIRECTORY = Path('C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/3_script_calculo/output')
@@ -13,6 +18,27 @@ BIN_LABELS = ['Hasta 10 hectáreas', '11 a 100 hectáreas', '101 a 200 hectárea
               '1001 a 1250 hectáreas', '1250 a 2500 hectáreas', 'más de 2500 hectáreas']
 CUSTOM_ORDER = BIN_LABELS
 
+TENENCIA_COLUMN = 'La explota el propietario, arrendatario o mediero'
+EXTENSION_COLUMN = 'Extensión total de las tierras dedicadas a labranza'
+SUM_COLUMNS = [EXTENSION_COLUMN, 'Trigo', 'Maíz', 'Lino', 'Cebada', 'Alfalfa', 'Arados', 'Maquinas de segar',
+               'Rastrillos', 'Trilladoras a vapor', 'Maquinas a vapor', 'Maquinas a agua', 'Bombas']
+TENURES = ['A', 'M', 'P']
+
+# Filter level of each result sheet pair, shallowest first
+SHEET_LEVELS = {
+    'sinfiltro': '4_filtro_tipo_AMP',
+    'filtro': '5_filtro_cultivo_(_1)',
+}
+
+# Bin and count owners instead of EAPs: the EAPs of one owner of the same tenure are
+# added up into one before binning. Needs the linkage.OWNER_ID_COLUMN stage 2 adds
+# with LINK_TITULARES
+GROUP_BY_OWNER = False
+
+# Level of the per-bin, per-tenure partial that stage 4 adds up over partidos
+TENURE_PARTIAL_LEVEL = '4_filtro_tipo_AMP'
+TENURE_PARTIAL_SHEET = 'tenencia_parcial'
+
 SHEET_DESCRIPTIONS = {
     '0_tabla_original': 'Tabla original, con todas las EAPs incluyendo las que no tienen tipo de tenencia y extensión',
     '1_filtro_titular_(nonulo)': 'Tabla con EAPs con titular no nulo',
@@ -26,25 +52,27 @@ def setup_directories() -> None:
     """Ensure the output directory exists."""
     OUTPUT_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
-def get_excel_files(directory: Path) -> List[Path]:
-    """Get a list of Excel files in the given directory."""
-    return list(directory.glob('*.xlsx'))
+def get_input_files(directory: Path) -> List[Path]:
+    """Get the stage 2 outputs in the given directory."""
+    return storage.list_tables(directory)
 
-def create_filter_result_df(file_path: Path) -> pd.DataFrame:
-    """Create a DataFrame with filter results for each sheet."""
-    xls = pd.ExcelFile(file_path)
-    filter_result_df = pd.DataFrame(columns=['Nombre de hoja', 'Descripción', 'Número de filas'])
-    
-    for sheet_name in xls.sheet_names[:6]:
-        df = pd.read_excel(file_path, sheet_name)
-        num_rows = df.shape[0]
-        description = SHEET_DESCRIPTIONS.get(sheet_name, 'No description available')
-        sheet_info_df = pd.DataFrame({'Nombre de hoja': [sheet_name], 'Descripción': [description], 'Número de filas': [num_rows]})
-        filter_result_df = pd.concat([filter_result_df, sheet_info_df], ignore_index=True)
-    
-    return filter_result_df
+def read_level_counts(file_path: Path) -> Optional[Dict[str, int]]:
+    """Rows of each filter level from the stage 2 sidecar, None if it is
+    missing or was written for a different table."""
+    metadata = storage.read_metadata(file_path)
+    if metadata is None or metadata.get('signature') != storage.file_signature(file_path):
+        return None
+    return metadata['level_counts']
+
+def create_filter_result_df(level_counts: Dict[str, int]) -> pd.DataFrame:
+    """Create a DataFrame with the number of rows of each filter level."""
+    return pd.DataFrame({
+        'Nombre de hoja': list(level_counts),
+        'Descripción': [SHEET_DESCRIPTIONS.get(name, 'No description available') for name in level_counts],
+        'Número de filas': list(level_counts.values())
+    })
 
-def process_dataframe(df: pd.DataFrame, file: str) -> pd.DataFrame:
+def process_dataframe(df: pd.DataFrame, file: Optional[str] = None) -> pd.DataFrame:
     """Process the DataFrame by creating bins and aggregating data."""
     # Ensure 'Extensión total de las tierras dedicadas a labranza' is numeric
     df['Extensión total de las tierras dedicadas a labranza'] = pd.to_numeric(df['Extensión total de las tierras dedicadas a labranza'], errors='coerce')
@@ -103,40 +131,222 @@ def process_tenencia_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     
     return df_tenencia_final
 
-def process_file(file_path: Path) -> None:
-    """Process a single Excel file."""
-    print(f"Processing file: {file_path.name}")
-    
-    filter_result_df = create_filter_result_df(file_path)
-    
-    df_filtrado = pd.read_excel(file_path, '5_filtro_cultivo_(_1)', header=0)
-    df_sin_filtrar = pd.read_excel(file_path, '4_filtro_tipo_AMP', header=0)
+def bin_index(extension: np.ndarray) -> np.ndarray:
+    """Index in BIN_LABELS of the bin of every extension, -1 if it is in none.
+
+    Same bins as pd.cut(extension, BIN_EDGES, include_lowest=True): closed on
+    the right, with 0 in the first bin.
+    """
+    codes = np.searchsorted(BIN_EDGES, extension, side='left') - 1
+    codes[extension == BIN_EDGES[0]] = 0
+    codes[np.isnan(extension) | (codes >= len(BIN_LABELS))] = -1
+    return codes
+
+def group_owners(table: pd.DataFrame) -> pd.DataFrame:
+    """The EAPs of each owner of the same tenure as one row: SUM_COLUMNS added
+    up, the lowest filter level of them, the other columns of the first EAP.
+
+    EAPs without an owner id, as those without a titular, stay as they are.
+    """
+    if linkage.OWNER_ID_COLUMN not in table.columns:
+        raise ValueError(f"GROUP_BY_OWNER needs the {linkage.OWNER_ID_COLUMN} column: run stage 2 with LINK_TITULARES")
+    has_owner = table[linkage.OWNER_ID_COLUMN].notna()
+    owned = table[has_owner]
+    keys = [linkage.OWNER_ID_COLUMN, TENENCIA_COLUMN]
+    grouped = owned.assign(**{col: pd.to_numeric(owned[col], errors='coerce') for col in SUM_COLUMNS}).groupby(
+        keys, sort=False, dropna=False)
+    others = [col for col in table.columns if col not in SUM_COLUMNS + keys + [filters.LEVEL_COLUMN]]
+    owners = pd.concat([grouped[SUM_COLUMNS].sum(min_count=1), grouped[filters.LEVEL_COLUMN].min(),
+                        grouped[others].first()], axis=1).reset_index()
+    return pd.concat([owners[table.columns], table[~has_owner]], ignore_index=True)
+
+def aggregate_levels(table: pd.DataFrame, levels: Dict[str, str] = SHEET_LEVELS,
+                     partial_level: str = TENURE_PARTIAL_LEVEL) -> Dict[str, pd.DataFrame]:
+    """Compute the cultivo and tenencia sheets of every level in levels in one pass.
+
+    Gives the same sheets as process_dataframe and process_tenencia_dataframe
+    on each level of table, also for partidos lacking a tenure, which those
+    failed on. The bin of every row is computed once; counts are
+    taken with np.bincount, and sums with a single groupby in which rows below
+    a level are NaN for that level, so each sum adds the same values in the
+    same order as the per-level groupby did.
+
+    The same pass gives the TENURE_PARTIAL_SHEET of partial_level: titulares
+    and extension per bin for each tenure, which stage 4 adds up over partidos.
+    """
+    names = list(levels)
+    level_indexes = [filters.level_index(levels[name]) for name in names]
+    partial_index = filters.level_index(partial_level)
+    if partial_index < min(level_indexes):
+        raise ValueError(f"Tenure partial level {partial_level} is below the levels {list(levels.values())}")
+    row_levels = table[filters.LEVEL_COLUMN].to_numpy()
+    df = table[row_levels >= min(level_indexes)]
+    row_levels = df[filters.LEVEL_COLUMN].to_numpy()
+
+    values = df[SUM_COLUMNS].copy()
+    values[EXTENSION_COLUMN] = pd.to_numeric(values[EXTENSION_COLUMN], errors='coerce')
+    codes = bin_index(values[EXTENSION_COLUMN].to_numpy(dtype=float))
+    binned = codes >= 0
+    tenencia = df[TENENCIA_COLUMN]
+    has_tenencia = tenencia.notna().to_numpy()
+
+    def bin_counts(rows: np.ndarray) -> np.ndarray:
+        return np.bincount(codes[rows & binned], minlength=len(BIN_LABELS))
+
+    tenure_rows = {tenure: (tenencia == tenure).to_numpy() for tenure in TENURES}
+    in_partial = row_levels >= partial_index
+    tenure_extension = pd.DataFrame({tenure: values[EXTENSION_COLUMN].where(in_partial & rows)
+                                     for tenure, rows in tenure_rows.items()})
+
+    level_values = pd.concat(
+        [values if index == min(level_indexes) else values.where(pd.Series(row_levels >= index, index=values.index), axis=0)
+         for index in level_indexes] + [tenure_extension], axis=1, keys=names + [TENURE_PARTIAL_SHEET])
+    sums = level_values.groupby(codes).sum().reindex(range(len(BIN_LABELS)), fill_value=0)
+    bins = pd.Categorical(BIN_LABELS, categories=CUSTOM_ORDER, ordered=True)
+
+    results = {}
+    for name, index in zip(names, level_indexes):
+        in_level = row_levels >= index
+        cultivo = pd.DataFrame({'extension_h_bins': bins, TENENCIA_COLUMN: bin_counts(in_level & has_tenencia)})
+        for col in SUM_COLUMNS:
+            column_sums = sums[(name, col)].to_numpy()
+            if values[col].dtype.kind in 'iub':
+                # NaN for the rows below the level turned integer columns into floats
+                column_sums = column_sums.astype(np.int64)
+            cultivo[col] = column_sums
+        results[f'titular_{name}_cultivo'] = cultivo
+
+        # As pd.crosstab: only bins with a tenure. A tenure no EAP of the partido has
+        # is a column of zeros, where the crosstab had no column and failed
+        observed = bin_counts(in_level & has_tenencia) > 0
+        tenencia_df = pd.DataFrame({'extension_h_bins': bins})
+        for tenure, rows in tenure_rows.items():
+            tenencia_df[tenure] = bin_counts(in_level & rows)
+        tenencia_df[EXTENSION_COLUMN] = cultivo[EXTENSION_COLUMN]
+        results[f'titular_{name}_tenencia'] = tenencia_df[observed].reset_index(drop=True)
+
+    # Columns as 'Titular_A', '<extension>_A', ... for every tenure, titulares counted where not null
+    titular = df.columns[0]
+    has_titular = df[titular].notna().to_numpy()
+    partial = pd.DataFrame({'extension_h_bins': bins})
+    for tenure, rows in tenure_rows.items():
+        partial[f'{titular}_{tenure}'] = bin_counts(in_partial & has_titular & rows)
+        partial[f'{EXTENSION_COLUMN}_{tenure}'] = sums[(TENURE_PARTIAL_SHEET, tenure)].to_numpy()
+    results[TENURE_PARTIAL_SHEET] = partial
+    return results
+
+def aggregate_owners(table: pd.DataFrame, levels: Dict[str, str] = SHEET_LEVELS,
+                     partial_level: str = TENURE_PARTIAL_LEVEL) -> Dict[str, pd.DataFrame]:
+    """The sheets of aggregate_levels binning and counting owners instead of EAPs.
+
+    The EAPs of each owner are grouped apart at every level, from those that
+    passed it, so an owner is counted once per tenure in every sheet.
+    """
+    if partial_level not in levels.values():
+        raise ValueError(f"Tenure partial level {partial_level} is not one of the levels {list(levels.values())}")
+    results = {}
+    for name, level in levels.items():
+        passed = table[table[filters.LEVEL_COLUMN].to_numpy() >= filters.level_index(level)]
+        sheets = aggregate_levels(group_owners(passed), {name: level}, level)
+        if level != partial_level:
+            del sheets[TENURE_PARTIAL_SHEET]
+        results.update(sheets)
+    return results
+
+def calculate_tables(table: pd.DataFrame, level_counts: Optional[Dict[str, int]] = None) -> Dict[str, pd.DataFrame]:
+    """Compute the result sheets of a partido from its stage 2 table.
+
+    level_counts are the rows of each filter level, counted from table if not given.
+    With GROUP_BY_OWNER the sheets bin and count owners, level_counts still rows.
+    """
+    sheets = aggregate_owners(table) if GROUP_BY_OWNER else aggregate_levels(table)
+    sheet_names = ['titular_filtro_cultivo', 'titular_filtro_tenencia', 'titular_sinfiltro_cultivo',
+                   'titular_sinfiltro_tenencia', TENURE_PARTIAL_SHEET]
+    results = {'resultados_tablas': create_filter_result_df(level_counts or filters.level_counts(table))}
+    results.update((name, sheets[name]) for name in sheet_names)
+    return results
+
+def process_tenure_partial(df: pd.DataFrame) -> pd.DataFrame:
+    """Reference for the tenure partial: pivot the rows by bin and tenure, as stage 4 used to."""
+    df = df.copy()
+    titular = df.columns[0]
+    # Stage 4 took the extension as it came and failed on text
+    df[EXTENSION_COLUMN] = pd.to_numeric(df[EXTENSION_COLUMN], errors='coerce')
+    df['extension_h_bins'] = pd.cut(df[EXTENSION_COLUMN], bins=BIN_EDGES, labels=BIN_LABELS, include_lowest=True).astype(str)
+    df['extension_h_bins'] = pd.Categorical(df['extension_h_bins'], categories=CUSTOM_ORDER, ordered=True)
+
+    grouped = df.groupby(['extension_h_bins', TENENCIA_COLUMN], observed=False).agg({
+        titular: 'count',
+        EXTENSION_COLUMN: 'sum'
+    }).reset_index()
+
+    pivoted = grouped.pivot(index='extension_h_bins', columns=TENENCIA_COLUMN)
+    pivoted.fillna(0, inplace=True)
+    pivoted.columns = ['_'.join(col).strip() for col in pivoted.columns.values]
+    columns = [f'{measure}_{tenure}' for tenure in TENURES for measure in (titular, EXTENSION_COLUMN)]
+    return pivoted[columns].reset_index()
+
+def calculate_tables_per_level(table: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Reference for calculate_tables: one groupby, crosstab and merge per sheet."""
+    df_filtrado = filters.select_level(table, '5_filtro_cultivo_(_1)')
+    df_sin_filtrar = filters.select_level(table, '4_filtro_tipo_AMP')
     
-    df_titular_tenencia = process_dataframe(df_filtrado, file_path)
-    df_tenencia_sinfiltro = process_dataframe(df_sin_filtrar, file_path)
+    df_titular_tenencia = process_dataframe(df_filtrado)
+    df_tenencia_sinfiltro = process_dataframe(df_sin_filtrar)
     
     df_filtrado_processed = process_tenencia_dataframe(df_filtrado)
     df_sin_filtrar_processed = process_tenencia_dataframe(df_sin_filtrar)
     
-    dfs = [filter_result_df, df_titular_tenencia, df_filtrado_processed, df_tenencia_sinfiltro, df_sin_filtrar_processed]
-    sheet_names = ['resultados_tablas', 'titular_filtro_cultivo', 'titular_filtro_tenencia','titular_sinfiltro_cultivo', 'titular_sinfiltro_tenencia']
+    dfs = [create_filter_result_df(filters.level_counts(table)), df_titular_tenencia, df_filtrado_processed,
+           df_tenencia_sinfiltro, df_sin_filtrar_processed,
+           process_tenure_partial(filters.select_level(table, TENURE_PARTIAL_LEVEL))]
+    sheet_names = ['resultados_tablas', 'titular_filtro_cultivo', 'titular_filtro_tenencia','titular_sinfiltro_cultivo',
+                   'titular_sinfiltro_tenencia', TENURE_PARTIAL_SHEET]
+    return dict(zip(sheet_names, dfs))
+
+def output_stem(input_stem: str) -> Path:
+    """Output path, without extension, for the stage 2 output named input_stem."""
+    return OUTPUT_DIRECTORY / f'{input_stem}_calculos'
+
+def save_results(results: Dict[str, pd.DataFrame], output_stem: Path) -> Path:
+    """Write the result workbook and, for columnar formats, the copy stage 4 reads.
+
+    The tenure partial only goes in the workbook when the workbook is what stage 4 reads.
+    """
+    output_path = output_stem.with_name(f'{output_stem.name}.xlsx')
     
-    output_file_name = f'{file_path.stem}_calculos.xlsx'
-    output_path = OUTPUT_DIRECTORY / output_file_name
+    excel.write_workbook(output_path, {sheet_name: df for sheet_name, df in results.items()
+                                       if sheet_name != TENURE_PARTIAL_SHEET or storage.INTERMEDIATE_FORMAT == 'xlsx'})
     
-    with pd.ExcelWriter(output_path) as writer:
-        for df, sheet_name in zip(dfs, sheet_names):
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    # The workbook is for people; stage 4 reads the intermediate copy
+    if storage.INTERMEDIATE_FORMAT != 'xlsx':
+        storage.write_tables(results, output_stem)
     
-    print(f"File '{output_file_name}' has been written to '{OUTPUT_DIRECTORY}'.")
+    return output_path
+
+def read_file(file_path: Path) -> tuple:
+    """Read a stage 2 output and the level counts of its sidecar."""
+    return storage.read_table(file_path), read_level_counts(file_path)
+
+def calculate_file(file_path: Path, stage_input: tuple) -> Dict[str, pd.DataFrame]:
+    print(f"Processing file: {file_path.name}")
+    return calculate_tables(*stage_input)
+
+def save_file(file_path: Path, results: Dict[str, pd.DataFrame]) -> None:
+    output_path = save_results(results, output_stem(storage.table_stem(file_path)))
+    print(f"File '{output_path.name}' has been written to '{OUTPUT_DIRECTORY}'.")
+
+def process_file(file_path: Path) -> None:
+    """Process a single stage 2 output."""
+    save_file(file_path, calculate_file(file_path, read_file(file_path)))
 
 def main():
-    """Main function to process all Excel files in the input directory."""
+    """Main function to process all stage 2 outputs in the input directory."""
     setup_directories()
-    excel_files = get_excel_files(INPUT_DIRECTORY)
+    input_files = get_input_files(INPUT_DIRECTORY)
     
-    for file_path in excel_files:
-        process_file(file_path)
+    results = parallel.map_stages(read_file, calculate_file, save_file, input_files)
+    parallel.report_failures(results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,6 +1,12 @@
 import os
+import sys
+import numpy as np
 import pandas as pd
-from typing import List, Dict
+from pathlib import Path
+from typing import List, Dict, Iterable, Optional, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from censo_utils import excel, parallel, storage
 
 # Constants
 BIN_EDGES = [0, 10, 100, 200, 300, 500, 1000, 1250, 2500, float('inf')]
@@ -11,7 +17,6 @@ CUSTOM_ORDER = BIN_LABELS
 
 INPUT_DIRECTORY = 'C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/3_script_calculo/output'
 OUTPUT_DIRECTORY = 'C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/4_script_suma/output'
-TENENCIA_INPUT_DIRECTORY = 'C:/Users/tomia/OneDrive/Documentos/Python_1895_v3/2_script_limpieza/output'
 
 COLUMN_NAMES = [
     "extension_h_bins", "La explota el propietario, arrendatario o mediero",
@@ -20,15 +25,27 @@ COLUMN_NAMES = [
     "Trilladoras a vapor", "Maquinas a vapor", "Maquinas a agua", "Bombas"
 ]
 
+COUNT_COLUMN = "La explota el propietario, arrendatario o mediero"
+EXTENSION_COLUMN = "Extensión total de las tierras dedicadas a labranza"
+PERCENT_COLUMN = "% extensión total de las tierras dedicadas a labranza"
+# Measures summed over the partidos, then the percentage averaged over them
+CULTIVO_MEASURES = COLUMN_NAMES[1:8]
+CUADRO1_MEASURES = [COUNT_COLUMN, EXTENSION_COLUMN]
+TENURES = ['A', 'M', 'P']
+# Titulares and extension per bin and tenure, published by stage 3
+TENENCIA_PARTIAL_SHEET = 'tenencia_parcial'
+
 def ensure_output_directory(directory: str) -> None:
     """Ensure the output directory exists."""
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def process_file(file_path: str) -> pd.DataFrame:
-    """Process a single Excel file and return a grouped DataFrame."""
-    df = pd.read_excel(file_path, sheet_name='titular_sinfiltro_cultivo')
+def group_partido(df: pd.DataFrame) -> pd.DataFrame:
+    """Group the 'titular_sinfiltro_cultivo' sheet of a partido by bin."""
+    df = df.copy()
     df.columns = COLUMN_NAMES
+    # Results handed over in memory keep the categorical bins of stage 3
+    df['extension_h_bins'] = df['extension_h_bins'].astype(str)
 
     numeric_columns = COLUMN_NAMES[1:]
     df[numeric_columns] = df[numeric_columns].apply(pd.to_numeric, errors='coerce')
@@ -48,108 +65,188 @@ def process_file(file_path: str) -> pd.DataFrame:
 
     return grouped_df
 
-def aggregate_data(input_directory: str) -> pd.DataFrame:
-    """Aggregate data from all Excel files in the input directory."""
-    aggregated_df = pd.DataFrame()
-
-    for filename in os.listdir(input_directory):
-        if filename.endswith('.xlsx'):
-            print(f"Processing file: {filename}")
-            file_path = os.path.join(input_directory, filename)
-            grouped_df = process_file(file_path)
-            aggregated_df = pd.concat([aggregated_df, grouped_df], ignore_index=True)
-
-    aggregated_df['extension_h_bins'] = pd.Categorical(aggregated_df['extension_h_bins'], categories=CUSTOM_ORDER, ordered=True)
-    return aggregated_df
-
-def create_final_dataframes(aggregated_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-    """Create final dataframes from the aggregated data."""
-    cuadro1 = aggregated_df.groupby('extension_h_bins', observed=False).agg({
-        'La explota el propietario, arrendatario o mediero': 'sum',
-        'Extensión total de las tierras dedicadas a labranza': 'sum',
-        '% extensión total de las tierras dedicadas a labranza': 'mean'
-    }).reset_index()
-
-    final_grouped_df = aggregated_df.groupby('extension_h_bins', observed=False).agg({
-        'La explota el propietario, arrendatario o mediero': 'sum',
-        'Extensión total de las tierras dedicadas a labranza': 'sum',
-        'Trigo': 'sum',
-        'Maíz': 'sum',
-        'Lino': 'sum',
-        'Cebada': 'sum',
-        'Alfalfa': 'sum',
-        '% extensión total de las tierras dedicadas a labranza': 'mean'
-    }).reset_index()
-
-    return {'cuadro1': cuadro1, 'final_grouped': final_grouped_df}
-
-def process_tenencia_file(file_path: str) -> pd.DataFrame:
-    """Process a single tenencia Excel file and return a pivoted DataFrame."""
-    df = pd.read_excel(file_path, sheet_name='4_filtro_tipo_AMP')
-    
-    # Identify the relevant columns
-    extension_col = [col for col in df.columns if 'extensi' in col.lower()][0]
-    tenencia_col = [col for col in df.columns if 'explota' in col.lower()][0]
-    
-    df['extension_h_bins'] = pd.cut(df[extension_col], bins=BIN_EDGES, labels=BIN_LABELS, include_lowest=True).astype(str)
-    df['extension_h_bins'] = pd.Categorical(df['extension_h_bins'], categories=CUSTOM_ORDER, ordered=True)
-
-    grouped = df.groupby(['extension_h_bins', tenencia_col], observed=False).agg({
-        df.columns[0]: 'count',  # Assuming the first column is 'Titular'
-        extension_col: 'sum'
-    }).reset_index()
-
-    pivoted = grouped.pivot(index='extension_h_bins', columns=tenencia_col)
-    pivoted.fillna(0, inplace=True)
-    pivoted.columns = ['_'.join(col).strip() for col in pivoted.columns.values]
-
-    return pivoted
-
-def aggregate_tenencia_data(tenencia_input_directory: str) -> pd.DataFrame:
-    """Aggregate tenencia data from all Excel files in the input directory."""
-    tenencia_df = pd.DataFrame()
-
-    for filename in os.listdir(tenencia_input_directory):
-        if filename.endswith('.xlsx'):
-            print(f"Processing tenencia file: {filename}")
-            file_path = os.path.join(tenencia_input_directory, filename)
-            pivoted = process_tenencia_file(file_path)
-            tenencia_df = tenencia_df.add(pivoted, fill_value=0) if not tenencia_df.empty else pivoted
-
-    # Identify the correct column names
-    titular_cols = [col for col in tenencia_df.columns if col.startswith(tenencia_df.columns[0].split('_')[0])]
-    extension_cols = [col for col in tenencia_df.columns if col.startswith(tenencia_df.columns[1].split('_')[0])]
-
-    desired_order = []
-    for tenure in ['A', 'M', 'P']:
-        titular_col = [col for col in titular_cols if col.endswith(tenure)]
-        extension_col = [col for col in extension_cols if col.endswith(tenure)]
-        if titular_col and extension_col:
-            desired_order.extend([titular_col[0], extension_col[0]])
-
-    for col in desired_order:
-        if col not in tenencia_df.columns:
-            tenencia_df[col] = 0
-
-    return tenencia_df[desired_order]
+def process_file(file_path: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Read a single stage 3 output once, returning its grouped DataFrame and its tenure partial."""
+    print(f"Processing file: {file_path.name}")
+    tables = storage.read_tables(file_path, ['titular_sinfiltro_cultivo', TENENCIA_PARTIAL_SHEET])
+    return group_partido(tables['titular_sinfiltro_cultivo']), tables[TENENCIA_PARTIAL_SHEET]
+
+def cultivo_partial(grouped_df: pd.DataFrame) -> np.ndarray:
+    """Bins x (CULTIVO_MEASURES + percentage) array of a grouped partido, NaN for missing bins."""
+    columns = CULTIVO_MEASURES + [PERCENT_COLUMN]
+    aligned = grouped_df.set_index('extension_h_bins')[columns].reindex(BIN_LABELS)
+    return aligned.to_numpy(dtype=float)
+
+def tenencia_partial(partial_df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
+    """Bins x tenures x (titulares, extension) array of the stage 3 tenure partial
+    of a partido, and the names of the two measures.
+
+    A tenure the partido does not have counts as zero.
+    """
+    partial_df = partial_df.copy()
+    partial_df['extension_h_bins'] = partial_df['extension_h_bins'].astype(str)
+    aligned = partial_df.set_index('extension_h_bins').reindex(BIN_LABELS)
+    measures = list(dict.fromkeys(col.rsplit('_', 1)[0] for col in aligned.columns))
+    partial = np.zeros((len(BIN_LABELS), len(TENURES), len(measures)))
+    for t, tenure in enumerate(TENURES):
+        for m, measure in enumerate(measures):
+            column = f'{measure}_{tenure}'
+            if column in aligned.columns:
+                partial[:, t, m] = aligned[column].fillna(0).to_numpy(dtype=float)
+    return partial, measures
+
+class ProvinceAccumulator:
+    """Province tables as fixed-shape arrays that partido partials are added into.
+
+    Sums and means over partidos use the same compensated summation as a
+    pandas groupby over the concatenated partidos. Floating-point sums
+    depend on the order they are added in, so partials are always added in
+    sorted partido order: the totals depend only on which partidos are in
+    them, not on the order they arrive or are replaced in. The partials of
+    every partido (a few hundred numbers each) are kept, so a partido that
+    arrives out of order, is replaced or is removed is handled by adding
+    them all again.
+    """
+
+    def __init__(self):
+        self.cultivo_partials: Dict[str, np.ndarray] = {}
+        self.tenencia_partials: Dict[str, np.ndarray] = {}
+        self.tenencia_measures: Optional[List[str]] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        shape = (len(BIN_LABELS), len(CULTIVO_MEASURES) + 1)
+        self.sums = np.zeros(shape)
+        self.compensation = np.zeros(shape)
+        self.observations = np.zeros(shape, dtype=np.int64)
+        self.tenencia = np.zeros((len(BIN_LABELS), len(TENURES), 2))
+        self.tenures_seen = np.zeros(len(TENURES), dtype=bool)
+
+    def _add_cultivo(self, partial: np.ndarray) -> None:
+        # Kahan summation skipping NaN, as pandas' group_sum and group_mean
+        valid = ~np.isnan(partial)
+        y = partial - self.compensation
+        t = self.sums + y
+        compensation = t - self.sums - y
+        # An infinite value would make the compensation NaN
+        compensation[np.isnan(compensation)] = 0
+        self.sums = np.where(valid, t, self.sums)
+        self.compensation = np.where(valid, compensation, self.compensation)
+        self.observations += valid
+
+    def _add_tenencia(self, partial: np.ndarray, tenures: np.ndarray) -> None:
+        self.tenencia += partial
+        self.tenures_seen |= tenures
+
+    def _rebuild(self) -> None:
+        self._reset()
+        for partido in sorted(self.cultivo_partials):
+            self._add_cultivo(self.cultivo_partials[partido])
+        for partido in sorted(self.tenencia_partials):
+            self._add_tenencia(*self.tenencia_partials[partido])
+
+    @staticmethod
+    def _adds_last(partido: str, partials: Dict[str, object]) -> bool:
+        """Whether adding partido to the running totals keeps them in sorted partido order."""
+        return partido not in partials and all(partido > other for other in partials)
+
+    def add_cultivo(self, partido: str, grouped_df: pd.DataFrame) -> None:
+        """Add the grouped 'titular_sinfiltro_cultivo' sheet of a partido, replacing any earlier one."""
+        partial = cultivo_partial(grouped_df)
+        adds_last = self._adds_last(partido, self.cultivo_partials)
+        self.cultivo_partials[partido] = partial
+        if adds_last:
+            self._add_cultivo(partial)
+        else:
+            self._rebuild()
+
+    def add_tenencia(self, partido: str, partial_df: pd.DataFrame) -> None:
+        """Add the tenure partial of a partido, replacing any earlier one."""
+        partial, measures = tenencia_partial(partial_df)
+        self.tenencia_measures = self.tenencia_measures or measures
+        tenures = np.array([any(col.endswith(f'_{tenure}') for col in partial_df.columns) for tenure in TENURES])
+        adds_last = self._adds_last(partido, self.tenencia_partials)
+        self.tenencia_partials[partido] = (partial, tenures)
+        if adds_last:
+            self._add_tenencia(partial, tenures)
+        else:
+            self._rebuild()
+
+    def remove(self, partido: str) -> None:
+        """Take a partido out of the province totals."""
+        self.cultivo_partials.pop(partido, None)
+        self.tenencia_partials.pop(partido, None)
+        self._rebuild()
+
+    def cultivo_tables(self) -> Dict[str, pd.DataFrame]:
+        """The 'cuadro1' and 'final_grouped' tables: sums per bin and the mean percentage."""
+        bins = pd.Categorical(BIN_LABELS, categories=CUSTOM_ORDER, ordered=True)
+        final_grouped = pd.DataFrame({'extension_h_bins': bins})
+        for m, measure in enumerate(CULTIVO_MEASURES):
+            final_grouped[measure] = self.sums[:, m]
+        final_grouped[COUNT_COLUMN] = final_grouped[COUNT_COLUMN].astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percent = self.sums[:, -1] / self.observations[:, -1]
+        final_grouped[PERCENT_COLUMN] = np.where(self.observations[:, -1] > 0, percent, np.nan)
+
+        cuadro1 = final_grouped[['extension_h_bins'] + CUADRO1_MEASURES + [PERCENT_COLUMN]].copy()
+        return {'cuadro1': cuadro1, 'final_grouped': final_grouped}
+
+    def tenencia_table(self) -> pd.DataFrame:
+        """Titulares and extension per bin for every tenure found in some partido."""
+        measures = self.tenencia_measures or ['Titular', EXTENSION_COLUMN]
+        index = pd.CategoricalIndex(BIN_LABELS, categories=CUSTOM_ORDER, ordered=True, name='extension_h_bins')
+        tenencia_df = pd.DataFrame(index=index)
+        for t, tenure in enumerate(TENURES):
+            if not self.tenures_seen[t]:
+                continue
+            tenencia_df[f'{measures[0]}_{tenure}'] = self.tenencia[:, t, 0].astype(np.int64)
+            tenencia_df[f'{measures[1]}_{tenure}'] = self.tenencia[:, t, 1]
+        return tenencia_df
 
 def save_to_excel(dataframes: Dict[str, pd.DataFrame], output_path: str) -> None:
     """Save all dataframes to a single Excel file with multiple sheets."""
-    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-        dataframes['cuadro1'].to_excel(writer, sheet_name='Cuadro inicial', index=False)
-        dataframes['final_grouped'].to_excel(writer, sheet_name='Cuadro con cultivos', index=False)
-        dataframes['tenencia'].to_excel(writer, sheet_name='Cuadro por tenencia', index=True)
+    excel.write_workbook(output_path, {
+        'Cuadro inicial': dataframes['cuadro1'],
+        'Cuadro con cultivos': dataframes['final_grouped'],
+        'Cuadro por tenencia': dataframes['tenencia'].reset_index(),
+    })
+
+def summarize(grouped_dfs: Iterable[Tuple[str, pd.DataFrame]],
+              partial_dfs: Iterable[Tuple[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """Build the province tables from (partido, DataFrame) pairs of grouped DataFrames and tenure partials."""
+    accumulator = ProvinceAccumulator()
+    for partido, grouped_df in grouped_dfs:
+        accumulator.add_cultivo(partido, grouped_df)
+    for partido, partial_df in partial_dfs:
+        accumulator.add_tenencia(partido, partial_df)
+    final_dataframes = accumulator.cultivo_tables()
+    final_dataframes['tenencia'] = accumulator.tenencia_table()
+    return final_dataframes
+
+def partido_name(file_path: Path) -> str:
+    """Partido a stage 2 or stage 3 output belongs to."""
+    stem = storage.table_stem(file_path)
+    for suffix in ('_tabla_final_calculos', '_tabla_final'):
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+
+def output_path() -> str:
+    return os.path.join(OUTPUT_DIRECTORY, 'suma_de_partidos.xlsx')
 
 def main():
     ensure_output_directory(OUTPUT_DIRECTORY)
     
-    aggregated_df = aggregate_data(INPUT_DIRECTORY)
-    final_dataframes = create_final_dataframes(aggregated_df)
-    
-    tenencia_df = aggregate_tenencia_data(TENENCIA_INPUT_DIRECTORY)
-    final_dataframes['tenencia'] = tenencia_df
+    results = parallel.map_files(process_file, storage.list_tables(INPUT_DIRECTORY))
+    if parallel.report_failures(results):
+        print("Province totals not written: some partidos could not be processed")
+        return
+
+    final_dataframes = summarize(((partido_name(result.path), result.value[0]) for result in results),
+                                 ((partido_name(result.path), result.value[1]) for result in results))
 
-    final_output_path = os.path.join(OUTPUT_DIRECTORY, 'suma_de_partidos.xlsx')
+    final_output_path = output_path()
     save_to_excel(final_dataframes, final_output_path)
     
     print(f"Agregación completa. Resultados guardados en {final_output_path}")
@@ -1,23 +1,57 @@
+"""Invalidate pipeline outputs so the next run of run_sequence.py rebuilds them.
+
+    python cleaner.py --partido "Azul"             rebuild Azul from stage 1
+    python cleaner.py --partido "Azul" --stage 3   rebuild Azul from stage 3
+    python cleaner.py --stage 4                    rebuild only the province totals
+    python cleaner.py --all                        rebuild everything
+
+Only outputs recorded in the build manifest are deleted; the census
+workbooks in 1_script_censo/input are never touched.
+"""
 import os
 import shutil
+import argparse
+
+from run_sequence import MANIFEST_PATH, STAGES
+from censo_utils import manifest
+
+def remove_path(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            return
+        print(f"Removed: {path}")
+    except Exception as e:
+        print(f"Error removing {path}: {e}")
+
+def invalidate(partido=None, first_stage=1):
+    """Drop the manifest records of partido (every partido if None) from
+    first_stage on, with the province totals, and delete their outputs."""
+    build_manifest = manifest.BuildManifest.load(MANIFEST_PATH)
+    stages = [directory for directory, _ in STAGES[first_stage - 1:]]
+    outputs = build_manifest.invalidate(partido, stages)
+    if partido is not None:
+        # The province totals are built from every partido
+        outputs += build_manifest.invalidate(manifest.PROVINCE, stages)
+    for path in outputs:
+        remove_path(path)
+    build_manifest.save()
+    print(f"Invalidated {len(outputs)} outputs")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--partido", help="partido to rebuild, as named by its input workbook")
+    parser.add_argument("--stage", type=int, default=1, choices=range(1, len(STAGES) + 1),
+                        help="first stage to rebuild (default 1)")
+    parser.add_argument("--all", action="store_true", help="rebuild every partido")
+    args = parser.parse_args()
+
+    if args.partido is None and not args.all and args.stage != len(STAGES):
+        parser.error("give --partido, --all, or --stage 4")
+    invalidate(None if args.all else args.partido, args.stage)
 
-def remove_files_in_folders(root_dir, target_folders):
-    # Traverse the directory tree
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        # Check if the current directory is one of the target folders
-        if os.path.basename(dirpath) in target_folders:
-            print(f"Entering folder: {dirpath}")
-            for filename in filenames:
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    os.remove(file_path)
-                    print(f"Removed file: {file_path}")
-                except Exception as e:
-                    print(f"Error removing file {file_path}: {e}")
-
-# Define the root directory to start from and target folders to clear
-root_directory = "."
-target_folders = ["input", "output"]
-
-# Call the function
-remove_files_in_folders(root_directory, target_folders)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
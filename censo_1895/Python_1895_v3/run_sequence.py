@@ -1,40 +1,389 @@
-import subprocess
 import os
+import sys
+import time
+import functools
+import importlib
 import traceback
 import datetime
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
-# Define your scripts in the order they should run
-scripts = [
-    "1_script_censo\script_format.py",
-    "2_script_limpieza\script_limpieza.py",
-    "3_script_calculo\script_calculo.py",
-    "4_script_suma\script_suma.py"
+import pandas as pd
+
+BASE_DIRECTORY = Path(__file__).resolve().parent
+SHARED_DIRECTORY = BASE_DIRECTORY.parents[1] / "censo_utils"
+
+sys.path.append(str(SHARED_DIRECTORY.parent))
+from censo_utils import excel, manifest, parallel, storage
+
+# Stages in the order they run, as (directory, module)
+STAGES = [
+    ("1_script_censo", "script_format"),
+    ("2_script_limpieza", "script_limpieza"),
+    ("3_script_calculo", "script_calculo"),
+    ("4_script_suma", "script_suma")
 ]
 
+# Also write each stage's per-partido outputs to its output folder.
+# Stages always hand their results to the next one in memory, and the
+# province workbook of stage 4 is always written.
+WRITE_ARTIFACTS = True
+
+# Skip partidos whose outputs are current: same input, stage code and
+# configuration as recorded in the build manifest. Needs WRITE_ARTIFACTS.
+INCREMENTAL = True
+MANIFEST_PATH = BASE_DIRECTORY / "build_manifest.json"
+
+# Run each partido through stages 1 to 3 as one unit of work, on
+# parallel.WORKERS processes, and add it to the province totals of stage 4
+# as it finishes. Otherwise each stage runs on every partido before the
+# next stage starts.
+STREAMING = True
+
 # Log file path
 log_file_path = "log.txt"
 
-# Function to log errors
-def log_error(script, error_message):
+# Function to log errors and stage timings
+def log_message(script, message):
     with open(log_file_path, "a") as log_file:
         time_now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_file.write(f"{time_now}\t{script}\t{error_message}\n")
+        log_file.write(f"{time_now}\t{script}\t{message}\n")
+
+def log_error(script, error_message):
+    log_message(script, error_message)
+
+_modules: List = []
+
+def load_stages() -> List:
+    """Import the stage scripts as modules in this interpreter."""
+    if not _modules:
+        for directory, module_name in STAGES:
+            sys.path.insert(0, str(BASE_DIRECTORY / directory))
+            _modules.append(importlib.import_module(module_name))
+    return list(_modules)
+
+def stage_code_hash(module) -> str:
+    """Hash of a stage script, the shared helpers and the configuration they run with."""
+    shared = sorted(SHARED_DIRECTORY.glob("*.py"))
+    return manifest.hash_code([module.__file__, *shared], {"intermediate_format": storage.INTERMEDIATE_FORMAT})
+
+def resolve(value):
+    """Stage results are kept in memory, or as a function loading them from disk
+    when the stage was up to date and nothing has needed them yet."""
+    return value() if callable(value) else value
+
+def run_step(stage: str, func: Callable, partido: str, value, build_manifest: Optional[manifest.BuildManifest] = None,
+             code: str = "", paths: Optional[Callable] = None) -> Tuple[object, str]:
+    """Run func on one partido, returning its result and 'built', 'current' or 'failed'.
+
+    With a build manifest, paths(partido) gives the input paths, output paths
+    and a loader for the outputs of the partido. If its outputs are current
+    it is not rebuilt; the result is the loader instead.
+    """
+    if build_manifest is not None:
+        input_paths, output_paths, load = paths(partido)
+        if build_manifest.is_current(stage, partido, input_paths, code):
+            return load, "current"
+    try:
+        result = func(partido, resolve(value))
+    except Exception:
+        print(f"Error in {stage} for {partido}")
+        log_error(stage, f"{partido}: {traceback.format_exc()}")
+        if build_manifest is not None:
+            build_manifest.invalidate(partido, [stage])
+        return None, "failed"
+    if build_manifest is not None:
+        build_manifest.record(stage, partido, input_paths, output_paths, code)
+    return result, "built"
+
+def run_stage(stage: str, func: Callable, inputs: Dict[str, object], timings: Dict[str, float],
+              build_manifest: Optional[manifest.BuildManifest] = None, code: str = "",
+              paths: Optional[Callable] = None) -> Tuple[Dict[str, object], List[str]]:
+    """Run func on every partido, returning the results and the partidos that failed.
+
+    Partidos are run with run_step; those whose outputs are current are not
+    rebuilt and their result is the loader of the outputs.
+    """
+    start = time.perf_counter()
+    results, failed, current = {}, [], 0
+    for partido, value in inputs.items():
+        result, status = run_step(stage, func, partido, value, build_manifest, code, paths)
+        if status == "failed":
+            failed.append(partido)
+            continue
+        results[partido] = result
+        current += status == "current"
+    timings[stage] = time.perf_counter() - start
+    print(f"{stage}: {len(results) - current} partidos built, {current} up to date, "
+          f"{len(failed)} failed in {timings[stage]:.2f}s")
+    return results, failed
+
+@dataclass
+class PartidoRun:
+    """Outcome of running one partido through stages 1 to 3."""
+    results: object = None
+    statuses: Dict[str, str] = field(default_factory=dict)
+    parse_cache: object = None
+    build_manifest: Optional[manifest.BuildManifest] = None
+    seconds: float = 0.0
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def failed_stage(self) -> Optional[str]:
+        return next((stage for stage, status in self.statuses.items() if status == "failed"), None)
+
+    @property
+    def built(self) -> bool:
+        return "built" in self.statuses.values()
+
+class PartidoStages:
+    """Stages 1 to 3 applied to one partido, with the paths the manifest records for each.
+
+    Instances are sent to worker processes, so loaders are partials of
+    storage functions and the stage modules are looked up when needed.
+    """
+
+    def __init__(self, input_files: Dict[str, str], write_artifacts: bool, parse_cache,
+                 build_manifest: Optional[manifest.BuildManifest], codes: List[str]):
+        self.input_files = input_files
+        self.write_artifacts = write_artifacts
+        self.parse_cache = parse_cache
+        self.build_manifest = build_manifest
+        self.codes = codes
+
+    def format_output(self, partido: str) -> Path:
+        script_format = load_stages()[0]
+        return storage.table_path(script_format.output_stem(partido))
+
+    def limpieza_output(self, partido: str) -> Path:
+        script_limpieza = load_stages()[1]
+        return storage.table_path(script_limpieza.output_stem(partido))
+
+    def calculo_stem(self, partido: str) -> Path:
+        script_calculo = load_stages()[2]
+        return script_calculo.output_stem(f"{partido}_tabla_final")
+
+    def format_paths(self, partido: str):
+        output = self.format_output(partido)
+        return [self.input_files[partido]], [output], functools.partial(storage.read_table, output)
+
+    def limpieza_paths(self, partido: str):
+        output = self.limpieza_output(partido)
+        return ([self.format_output(partido)], [output, storage.metadata_path(output)],
+                functools.partial(storage.read_table, output))
+
+    def calculo_paths(self, partido: str):
+        stem = self.calculo_stem(partido)
+        # The workbook is also the intermediate output in xlsx mode
+        outputs = list(dict.fromkeys([stem.with_name(f"{stem.name}.xlsx"), storage.tables_path(stem)]))
+        return [self.limpieza_output(partido)], outputs, functools.partial(storage.read_tables, storage.tables_path(stem))
+
+    def format_partido(self, partido: str, file_path: str) -> pd.DataFrame:
+        script_format = load_stages()[0]
+        df = script_format.format_dataframe(excel.read_workbook(file_path), self.parse_cache)
+        if self.write_artifacts:
+            script_format.save_results(df, script_format.output_stem(partido))
+        return df
+
+    def clean_partido(self, partido: str, df: pd.DataFrame) -> pd.DataFrame:
+        script_limpieza = load_stages()[1]
+        table = script_limpieza.clean_table(df)
+        if self.write_artifacts:
+            script_limpieza.save_results(table, script_limpieza.output_stem(partido))
+        return table
+
+    def calculate_partido(self, partido: str, table: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        script_calculo = load_stages()[2]
+        results = script_calculo.calculate_tables(table)
+        if self.write_artifacts:
+            script_calculo.save_results(results, self.calculo_stem(partido))
+        return results
+
+    def stages(self) -> List[Tuple[str, Callable, Callable]]:
+        """(stage, function, paths) of stages 1 to 3, in the order they run."""
+        return [
+            (STAGES[0][0], self.format_partido, self.format_paths),
+            (STAGES[1][0], self.clean_partido, self.limpieza_paths),
+            (STAGES[2][0], self.calculate_partido, self.calculo_paths),
+        ]
+
+    def run_partido(self, partido: str) -> PartidoRun:
+        """Run one partido through stages 1 to 3, stopping at the first stage it fails."""
+        start = time.perf_counter()
+        run = PartidoRun(build_manifest=self.build_manifest)
+        value = self.input_files[partido]
+        for (stage, func, paths), code in zip(self.stages(), self.codes):
+            stage_start = time.perf_counter()
+            value, run.statuses[stage] = run_step(stage, func, partido, value, self.build_manifest, code, paths)
+            run.stage_seconds[stage] = time.perf_counter() - stage_start
+            if value is None:
+                break
+        # The tables of the last stage and the parse cache entries added are all the parent process needs
+        run.results = value
+        run.parse_cache = self.parse_cache.take_added()
+        run.seconds = time.perf_counter() - start
+        return run
+
+def by_size(input_files: Dict[str, str]) -> List[str]:
+    """Partidos largest input first, so the longest ones do not start last."""
+    return sorted(input_files, key=lambda partido: os.path.getsize(input_files[partido]), reverse=True)
+
+def province_tables(script_suma, script_calculo, calculated: Dict[str, object]) -> Tuple[Iterable, Iterable]:
+    """The (partido, DataFrame) pairs summarize reads from the stage 3 results."""
+    return (((partido, script_suma.group_partido(resolve(results)["titular_sinfiltro_cultivo"]))
+             for partido, results in calculated.items()),
+            ((partido, resolve(results)[script_calculo.TENURE_PARTIAL_SHEET]) for partido, results in calculated.items()))
+
+def run_pipeline(write_artifacts: bool = WRITE_ARTIFACTS, incremental: bool = INCREMENTAL,
+                 streaming: bool = STREAMING) -> Dict[str, float]:
+    """Run the four stages and return the seconds each one took.
+
+    A partido that fails a stage is dropped from the stages after it, and
+    stage 4 only runs when every partido made it through stages 1 to 3.
+    """
+    timings = {}
+    start = time.perf_counter()
+    script_format, script_limpieza, script_calculo, script_suma = load_stages()
+    timings["import"] = time.perf_counter() - start
+
+    if write_artifacts:
+        script_format.setup_directories()
+        script_limpieza.setup_directories()
+        script_calculo.setup_directories()
+    script_suma.ensure_output_directory(script_suma.OUTPUT_DIRECTORY)
+
+    parse_cache = script_format.ParseCache.load(script_format.PARSE_CACHE_PATH)
+    input_files = {os.path.splitext(file)[0]: os.path.join(script_format.INPUT_DIRECTORY, file)
+                   for file in script_format.get_excel_files(script_format.INPUT_DIRECTORY)}
+
+    build_manifest = manifest.BuildManifest.load(MANIFEST_PATH) if write_artifacts and incremental else None
+    codes = [stage_code_hash(module) for module in (script_format, script_limpieza, script_calculo, script_suma)]
+    partido_stages = PartidoStages(input_files, write_artifacts, parse_cache, build_manifest, codes)
+
+    try:
+        if streaming:
+            accumulator = script_suma.ProvinceAccumulator()
+            calculated, failed = stream_partidos(partido_stages, accumulator, timings)
+        else:
+            accumulator = None
+            calculated, failed = run_stages(partido_stages, timings)
+        parse_cache.save()
+        print(parse_cache.report())
+
+        if failed:
+            message = f"Skipped: the province totals would miss {', '.join(failed)}"
+            print(f"4_script_suma {message}")
+            log_error("4_script_suma", message)
+            return timings
+
+        start = time.perf_counter()
+        province_inputs = [storage.tables_path(partido_stages.calculo_stem(partido)) for partido in calculated]
+        if build_manifest is not None and build_manifest.is_current("4_script_suma", manifest.PROVINCE,
+                                                                    province_inputs, codes[3]):
+            print("4_script_suma: up to date")
+            return timings
+
+        if accumulator is None:
+            final_dataframes = script_suma.summarize(*province_tables(script_suma, script_calculo, calculated))
+        else:
+            # Add the partidos the stream left for here; the accumulator keeps them in partido order
+            pending = {partido: results for partido, results in calculated.items()
+                       if partido not in accumulator.cultivo_partials}
+            for partido, grouped_df in province_tables(script_suma, script_calculo, pending)[0]:
+                accumulator.add_cultivo(partido, grouped_df)
+            for partido, partial_df in province_tables(script_suma, script_calculo, pending)[1]:
+                accumulator.add_tenencia(partido, partial_df)
+            final_dataframes = accumulator.cultivo_tables()
+            final_dataframes['tenencia'] = accumulator.tenencia_table()
+        script_suma.save_to_excel(final_dataframes, script_suma.output_path())
+        if build_manifest is not None:
+            build_manifest.record("4_script_suma", manifest.PROVINCE, province_inputs,
+                                  [script_suma.output_path()], codes[3])
+        timings["4_script_suma"] = time.perf_counter() - start
+        print(f"4_script_suma: results saved to {script_suma.output_path()} in {timings['4_script_suma']:.2f}s")
+    finally:
+        if build_manifest is not None:
+            build_manifest.save()
+
+    return timings
+
+def run_stages(partido_stages: PartidoStages, timings: Dict[str, float]) -> Tuple[Dict[str, object], List[str]]:
+    """Run stages 1 to 3 one after another, each on every partido, returning the
+    stage 3 results and the partidos that failed."""
+    start = time.perf_counter()
+    values, failed = partido_stages.input_files, []
+    for (stage, func, paths), code in zip(partido_stages.stages(), partido_stages.codes):
+        values, stage_failed = run_stage(stage, func, values, timings, partido_stages.build_manifest, code, paths)
+        failed += stage_failed
+    timings["stages_1_to_3"] = time.perf_counter() - start
+    return values, failed
+
+def stream_partidos(partido_stages: PartidoStages, accumulator, timings: Dict[str, float]) -> Tuple[Dict[str, object], List[str]]:
+    """Run every partido through stages 1 to 3 as one unit of work, returning the
+    stage 3 results in input order and the partidos that failed.
+
+    Results are added to the accumulator as they arrive, once every partido
+    before them in input order has arrived too, so the accumulator rarely
+    has to add its partials again to keep them in partido order. Partidos that were up to date are
+    only loaded once some partido was rebuilt, as the province workbook may
+    otherwise be current too.
+
+    Each stage's timing is the seconds it took over all partidos, as in
+    run_stages; with several workers they add up to more than stages_1_to_3.
+    """
+    start = time.perf_counter()
+    for stage, _, _ in partido_stages.stages():
+        timings[stage] = 0.0
+    script_calculo, script_suma = load_stages()[2:]
+    order = list(partido_stages.input_files)
+    arrived: Dict[str, PartidoRun] = {}
+    calculated, failed, built, added = {}, [], 0, 0
+
+    for file_result in parallel.iter_files(partido_stages.run_partido, by_size(partido_stages.input_files)):
+        partido = file_result.path
+        if not file_result.ok:
+            print(f"Error running {partido}")
+            log_error("run_sequence", f"{partido}: {file_result.error}")
+            arrived[partido] = PartidoRun(statuses={"run_sequence": "failed"})
+        else:
+            run = arrived[partido] = file_result.value
+            if run.parse_cache is not None:
+                partido_stages.parse_cache.merge(run.parse_cache)
+            if partido_stages.build_manifest is not None:
+                partido_stages.build_manifest.merge(run.build_manifest, partido)
+            built += run.built
+            for stage, seconds in run.stage_seconds.items():
+                timings[stage] += seconds
+            if "first_result" not in timings and run.failed_stage is None:
+                timings["first_result"] = time.perf_counter() - start
+            print(f"{partido}: stages 1 to 3 {', '.join(run.statuses.values())} in {run.seconds:.2f}s")
+
+        # Add the partidos whose predecessors have all arrived
+        while built and added < len(order) and order[added] in arrived:
+            run = arrived[order[added]]
+            if run.failed_stage is None:
+                accumulator.add_cultivo(order[added], script_suma.group_partido(resolve(run.results)["titular_sinfiltro_cultivo"]))
+                accumulator.add_tenencia(order[added], resolve(run.results)[script_calculo.TENURE_PARTIAL_SHEET])
+            added += 1
+
+    for partido in order:
+        run = arrived[partido]
+        if run.failed_stage is None:
+            calculated[partido] = run.results
+        else:
+            failed.append(partido)
+    timings["stages_1_to_3"] = time.perf_counter() - start
+    print(f"Stages 1 to 3: {built} partidos built, {len(order) - built - len(failed)} up to date, "
+          f"{len(failed)} failed in {timings['stages_1_to_3']:.2f}s")
+    return calculated, failed
 
-# Run scripts in sequence
-for script in scripts:
+if __name__ == "__main__":
     try:
-        # Run the script
-        subprocess.run(["python", script], check=True)
-        print(f"{script} executed successfully.")
-
-    except subprocess.CalledProcessError as e:
-        # If an error occurs during execution, log it
-        error_message = f"Script failed with return code {e.returncode}"
-        print(f"Error running {script}: {error_message}")
-        log_error(script, error_message)
-
-    except Exception as e:
-        # Handle any unexpected errors and log them
-        error_message = f"Unexpected error: {traceback.format_exc()}"
-        print(f"Unexpected error in {script}: {error_message}")
-        log_error(script, error_message)
+        timings = run_pipeline()
+    except Exception:
+        print(f"Unexpected error: {traceback.format_exc()}")
+        log_error("run_sequence", f"Unexpected error: {traceback.format_exc()}")
+    else:
+        for stage, seconds in timings.items():
+            log_message(stage, f"completed in {seconds:.2f}s")
@@ -0,0 +1,69 @@
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from script import OwnerTotals, bin_owners, group_owners, normalize
+
+# Partidos of the province, parcels in each and owners holding land anywhere in it
+PARTIDO_COUNTS = [20, 110]
+PARCEL_COUNT = 20_000
+OWNER_COUNT = 300_000
+
+def spellings(owners: list) -> np.ndarray:
+    """Each owner's name as written, in capitals and with a trailing space."""
+    names = np.array(owners, dtype=object)
+    return np.stack([names, np.array([name.upper() for name in owners], dtype=object),
+                     np.array([name + ' ' for name in owners], dtype=object)])
+
+def make_parcels(partido: int, names: np.ndarray, seed: int = 0) -> pd.DataFrame:
+    """Parcels of one partido, as owner_hectares gives them, owned by owners of the
+    whole province and written with the spelling variants of the registers."""
+    rng = np.random.default_rng([seed, partido])
+    owner = rng.zipf(1.3, PARCEL_COUNT) % names.shape[1]
+    variant = np.searchsorted([0.92, 0.97], rng.random(PARCEL_COUNT))
+    return pd.DataFrame({'Propietarios': names[variant, owner],
+                         'Hectareas': (rng.pareto(1.2, PARCEL_COUNT) * 20 + 1.01).round(2)})
+
+def concatenated(partidos: list) -> pd.DataFrame:
+    """Every parcel of the province in one frame, grouped on the normalized owner name."""
+    parcels = pd.concat(partidos, ignore_index=True)
+    codes, names = pd.factorize(parcels['Propietarios'])
+    keys = pd.Series([normalize(name) for name in names])[codes].to_numpy()
+    grouped = parcels.groupby(keys, sort=False).agg(Propietarios=('Propietarios', 'first'),
+                                                   Hectareas=('Hectareas', 'sum'))
+    return grouped.reset_index(drop=True)
+
+def streamed(partidos: list) -> pd.DataFrame:
+    """The same totals, adding up one partido at a time."""
+    totals = OwnerTotals()
+    for parcels in partidos:
+        totals.add(group_owners(parcels))
+    return totals.owners()
+
+def measure(consolidate, partidos: list) -> tuple:
+    """Bins of the consolidated owners, seconds taken and, in a second run, peak memory
+    allocated; the parcels of the partidos are made beforehand, as reading them is the
+    same either way."""
+    start = time.perf_counter()
+    bins = bin_owners(consolidate(partidos))
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    consolidate(partidos)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return bins, seconds, peak
+
+def main():
+    names = spellings([f'Propietario{i} Nombre{i % 50}' for i in range(OWNER_COUNT)])
+    for count in PARTIDO_COUNTS:
+        partidos = [make_parcels(partido, names) for partido in range(count)]
+        before, before_seconds, before_peak = measure(concatenated, partidos)
+        after, after_seconds, after_peak = measure(streamed, partidos)
+        pd.testing.assert_frame_equal(before, after, check_exact=False, rtol=1e-12)
+        print(f"{count:>4} partidos | {count * PARCEL_COUNT:>10,} parcels | "
+              f"concat + groupby {before_seconds:6.2f}s, peak {before_peak / 2**20:7.1f} MB | "
+              f"streamed {after_seconds:6.2f}s, peak {after_peak / 2**20:7.1f} MB | same bins")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import time
+import numpy as np
+import pandas as pd
+
+from script import linkage, normalize
+
+# Owners drawn for the synthetic registers; names are also compared without blocking up to ALL_PAIRS_LIMIT
+OWNER_COUNTS = [5_000, 50_000, 200_000]
+ALL_PAIRS_LIMIT = 100_000
+
+# Surnames, the common ones first, followed by made-up ones to SURNAME_COUNT; owners
+# take a surname and one or two given names, the first of each list the most common
+APELLIDOS = ['Pereyra', 'González', 'Rodríguez', 'Fernández', 'López', 'Martínez', 'Gómez', 'Díaz', 'Álvarez',
+             'Romero', 'Sosa', 'Ruiz', 'Torres', 'Suárez', 'Castro', 'Giménez', 'Vázquez', 'Acosta', 'Benítez',
+             'Herrera', 'Medina', 'Aguirre', 'Gutiérrez', 'Pérez', 'Chávez', 'Villalba', 'Olivera', 'Quiroga',
+             'Ledesma', 'Cabrera', 'Molina', 'Ortiz', 'Silva', 'Núñez', 'Luna', 'Juárez', 'Cáceres', 'Ramírez',
+             'Rossi', 'Bianchi', 'Ferrari', 'Russo', 'Colombo', 'Ricci', 'Marino', 'Greco', 'Bruno', 'Gallo',
+             'Duhau', 'Anchorena', 'Alzaga', 'Unzué', 'Pereda', 'Santamarina', 'Llambías', 'Zuberbühler',
+             'Elía', 'Bosch', 'Iraola', 'Yrigoyen']
+SILABAS = ['ba', 'be', 'bi', 'ca', 'co', 'cu', 'da', 'de', 'do', 'fe', 'ga', 'go', 'gue', 'la', 'le', 'li', 'lo',
+           'ma', 'me', 'mi', 'mo', 'na', 'ne', 'no', 'pa', 'pe', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'so', 'ta',
+           'te', 'to', 'va', 've', 'za', 'zu', 'llo', 'rra', 'cha', 'che', 'ya', 'yo', 'qui', 'ñe']
+FINALES = ['', '', 'z', 's', 'n', 'l', 'r', 'ni', 'tti']
+SURNAME_COUNT = 30_000
+NOMBRES = ['Juan', 'José', 'Pedro', 'Manuel', 'Francisco', 'Antonio', 'Luis', 'Carlos', 'Miguel', 'Andrés',
+           'Vicente', 'Ramón', 'Santiago', 'Eduardo', 'Enrique', 'Jorge', 'Julio', 'Tomás', 'Ignacio', 'Martín',
+           'María', 'Rosa', 'Juana', 'Josefa', 'Carmen', 'Dolores', 'Isabel', 'Mercedes', 'Ana', 'Elena',
+           'Giuseppe', 'Giovanni', 'Luigi', 'Angelo', 'Domingo', 'Bautista', 'Félix', 'Celestino', 'Nicolás',
+           'Hipólito']
+
+# Ways the registers misspell a name, each a function of the name and a random generator
+VARIANTS = [
+    lambda name, rng: name.upper(),
+    lambda name, rng: name.replace('y', 'i', 1) if 'y' in name else name.replace('i', 'y', 1),
+    lambda name, rng: name.replace('z', 's').replace('Z', 'S'),
+    lambda name, rng: name.replace('v', 'b').replace('V', 'B'),
+    lambda name, rng: name.translate(str.maketrans('áéíóúÁÉÍÓÚ', 'aeiouAEIOU')),
+    lambda name, rng: ' '.join(name.split()[-1:] + name.split()[:-1]),
+    lambda name, rng: (lambda i: name[:i] + name[i + 1:])(int(rng.integers(2, len(name) - 1))),
+]
+
+def make_surnames(rng) -> list:
+    surnames = dict.fromkeys(APELLIDOS)
+    while len(surnames) < SURNAME_COUNT:
+        syllables = rng.choice(SILABAS, rng.integers(2, 5))
+        surnames[(''.join(syllables) + rng.choice(FINALES)).capitalize()] = None
+    return list(surnames)
+
+def zipf_choice(rng, values: list, size: int) -> np.ndarray:
+    weights = 1 / np.arange(1, len(values) + 1) ** 0.8
+    return np.array(values, dtype=object)[rng.choice(len(values), size, p=weights / weights.sum())]
+
+def make_names(owners: int, seed: int = 0) -> pd.DataFrame:
+    """Distinct names as the registers write them, with the owner each belongs to.
+
+    Owners are 'Apellido Nombre'; owners of the same name are one owner to
+    any linkage, so there are fewer owners than drawn. Each is written as is
+    and in a few of VARIANTS, some of them combined.
+    """
+    rng = np.random.default_rng(seed)
+    second = np.where(rng.random(owners) < 0.3, ' ' + zipf_choice(rng, NOMBRES, owners), '')
+    bases = set(zipf_choice(rng, make_surnames(rng), owners) + ' ' + zipf_choice(rng, NOMBRES, owners) + second)
+    names, truth = [], []
+    for owner, name in enumerate(sorted(bases)):
+        spellings = {name}
+        for _ in range(rng.poisson(1.5)):
+            spelling = name
+            for variant in rng.choice(len(VARIANTS), rng.integers(1, 3), replace=False):
+                spelling = VARIANTS[variant](spelling, rng)
+            spellings.add(spelling)
+        names += sorted(spellings)
+        truth += [owner] * len(spellings)
+    return pd.DataFrame({'Propietarios': names, 'owner': truth}).drop_duplicates('Propietarios', keep=False)
+
+def pairs(sizes: pd.Series) -> int:
+    return int((sizes * (sizes - 1) // 2).sum())
+
+def pair_scores(ids: pd.Series, truth: pd.Series) -> tuple:
+    """Precision and recall of the pairs of names linked, against the pairs of the same owner."""
+    both = pairs(pd.DataFrame({'id': ids, 'owner': truth}).groupby(['id', 'owner']).size())
+    return both / max(pairs(ids.value_counts()), 1), both / max(pairs(truth.value_counts()), 1)
+
+def measure(names: pd.DataFrame, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = linkage.link(names['Propietarios'], **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    for owners in OWNER_COUNTS:
+        names = make_names(owners)
+        distinct = len(names)
+        precision, recall = pair_scores(names['Propietarios'].map(normalize), names['owner'])
+        print(f"{names['owner'].nunique():>8,} owners, {distinct:>8,} names | normalized name only: "
+              f"precision {precision:.3f}, recall {recall:.3f}")
+        result, seconds = measure(names)
+        precision, recall = pair_scores(result.ids, names['owner'])
+        print(f"{'':>32} | blocked: {result.compared_pairs:>13,} pairs of {distinct * (distinct - 1) // 2:>15,} "
+              f"in {seconds:7.2f}s, precision {precision:.3f}, recall {recall:.3f}")
+        if distinct <= ALL_PAIRS_LIMIT:
+            result, seconds = measure(names, blocking=lambda name: [''])
+            precision, recall = pair_scores(result.ids, names['owner'])
+            print(f"{'':>32} | unblocked: {result.compared_pairs:>11,} pairs of {'':>15} in {seconds:7.2f}s, "
+                  f"precision {precision:.3f}, recall {recall:.3f}")
+
+if __name__ == "__main__":
+    main()
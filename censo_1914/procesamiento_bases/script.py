@@ -1,32 +1,47 @@
 import os
+import sys
 import pandas as pd
 import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from censo_utils import dtypes, excel, linkage, parallel
+from censo_utils.vocabulary import normalize
 
 # Define the directories
 input_directory = 'C:/Users/tomia/Downloads/Script bases/input'
 output_directory = 'C:/Users/tomia/Downloads/Script bases/output'
 
-# Ensure output directory exists
-os.makedirs(output_directory, exist_ok=True)
+# Also add up the hectares of every owner over all partidos, keyed on the
+# normalized name, and bin those totals into PROVINCE_FILE in the output directory
+CONSOLIDATE_PROVINCE = False
+PROVINCE_FILE = 'provincia.xlsx'
+
+# Count spelling variants of one owner's name ('Pereyra Juan', 'Juan Pereira')
+# as one owner, linked by censo_utils.linkage, instead of grouping on the exact name
+LINK_OWNERS = False
 
-# Get the list of Excel files in the input directory
-excel_files = [f for f in os.listdir(input_directory) if f.endswith('.xlsx')]
+# The two layouts the partido workbooks come in
+set1_required_columns = ['foto ', 'N° registro', 'partido', 'Apellido', 'Nombre', 'Sup.', 'prop']
+set2_required_columns = ['foto ', 'N° registro', 'partido', 'Propietario Apellido', 'Nombre', 'Superficie', 'prop']
 
-# Process each Excel file
-for file in excel_files:
+def read_file(file: str) -> pd.DataFrame:
+    """Read the columns of either layout from one partido workbook, in the dtypes of dtypes.DTYPE_POLICY."""
     file_path = os.path.join(input_directory, file)
-    df = pd.read_excel(file_path)
-    
+    used_columns = set(set1_required_columns + set2_required_columns)
+    return dtypes.apply_dtypes(excel.read_workbook(file_path, usecols=lambda col: col in used_columns))
+
+def owner_hectares(file: str, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Owner and hectares of the parcels of one partido workbook that are binned,
+    or None if it cannot be processed."""
     # Check if either set of necessary columns is present
-    set1_required_columns = ['foto ', 'N° registro', 'partido', 'Apellido', 'Nombre', 'Sup.', 'prop']
-    set2_required_columns = ['foto ', 'N° registro', 'partido', 'Propietario Apellido', 'Nombre', 'Superficie', 'prop']
-    
     set1_columns_exist = all(col in df.columns for col in set1_required_columns)
     set2_columns_exist = all(col in df.columns for col in set2_required_columns)
     
     if not (set1_columns_exist or set2_columns_exist):
         print(f"File {file} is missing required columns.")
-        continue
+        return None
     
     # Select specific columns based on which set exists
     if set1_columns_exist:
@@ -40,18 +55,27 @@ for file in excel_files:
         df['Hectareas'] = pd.to_numeric(df['Superficie'], errors='coerce') / 10000
     except ValueError:
         print(f"File {file}: Error converting 'Superficie' column to numeric. Skipping.")
-        continue
+        return None
     
     # Process the DataFrame
     df['Nombre'] = np.where(df['Nombre'].notna(), df['Nombre'], '-')
     df['Propietario Apellido'] = np.where(df['Propietario Apellido'].notna(), df['Propietario Apellido'], '-')
     df['Propietarios'] = df['Propietario Apellido'] + ' ' + df['Nombre']
     df['Hectareas'] = df['Hectareas'].astype(float).round(2)
-    df['foto '] = df['foto '].fillna('-')
 
     # Filter the DataFrame
     filtered_df = df[(df['Hectareas'] > 1) & (df['prop'] != 'E')]
+    return filtered_df[['Propietarios', 'Hectareas']]
 
+def group_owners(parcels: pd.DataFrame) -> pd.DataFrame:
+    """Hectares of each owner of the parcels, owners named by their owner id when LINK_OWNERS."""
+    if LINK_OWNERS:
+        parcels = parcels.assign(Propietarios=linkage.owner_ids(parcels['Propietarios']))
+    # Group by 'Propietarios' and sum 'Hectareas'
+    return parcels.groupby('Propietarios')['Hectareas'].sum().reset_index()
+
+def bin_owners(owners: pd.DataFrame) -> pd.DataFrame:
+    """Owners and their hectares in each size bin, from the hectares of each owner."""
     # Define bin edges and labels for 'Hectareas'
     second_bin_labels = [
         'Hasta 10 hectáreas', '11 a 100 hectáreas', '101 a 200 hectáreas',
@@ -59,15 +83,7 @@ for file in excel_files:
         '2501 a 4999 hectáreas', 'más de 5000 hectáreas'
     ]
     second_bin_edges = [0, 10, 100, 200, 500, 1000, 2500, 5000, float('inf')]
-
-    # Apply binning to 'Hectareas'
-    second_filtered_df = filtered_df.copy()
-    second_filtered_df['extension_h_bins'] = pd.cut(
-        filtered_df['Hectareas'], bins=second_bin_edges, labels=second_bin_labels, include_lowest=True
-    ).astype(str)
-
-    # Group by 'Propietarios' and sum 'Hectareas'
-    second_grouped_df = second_filtered_df.groupby('Propietarios')['Hectareas'].sum().reset_index()
+    second_grouped_df = owners.copy()
 
     # Ensure the bins are categorical and ordered
     second_grouped_df['extension_h_bins'] = pd.cut(
@@ -99,9 +115,114 @@ for file in excel_files:
     )
 
     second_df_bins.sort_values(by = "extension_h_bins",inplace=True)
+    return second_df_bins
+
+def bin_file(file: str, df: pd.DataFrame):
+    """Bin the owners of one partido workbook, or None if it cannot be processed."""
+    parcels = owner_hectares(file, df)
+    if parcels is None:
+        return None
+    return bin_owners(group_owners(parcels))
+
+class OwnerTotals:
+    """Hectares of every owner over the partidos added so far.
+
+    Owners are keyed on their normalized name, so spellings differing only in
+    case, accents or spacing are one owner, shown as first seen. Each
+    spelling is normalized once, the first time a partido has it. Hectares
+    are added up as whole hundredths, so the totals do not depend on the
+    order the partidos are added in.
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.hundredths = np.zeros(0, dtype=np.int64)
+        self._keys: Dict[str, int] = {}
+        self._spellings: Dict[str, int] = {}
+
+    def add(self, owners: pd.DataFrame) -> None:
+        """Add the hectares of each owner of one partido, as group_owners gives them."""
+        names = owners['Propietarios'].tolist()
+        # Normalize only the spellings no partido added so far had, once each
+        for name in dict.fromkeys(name for name in names if name not in self._spellings):
+            position = self._keys.setdefault(normalize(name), len(self.names))
+            if position == len(self.names):
+                self.names.append(name)
+            self._spellings[name] = position
+        positions = np.fromiter(map(self._spellings.__getitem__, names), dtype=np.int64, count=len(names))
+        if len(self.names) > len(self.hundredths):
+            self.hundredths = np.concatenate([self.hundredths,
+                                              np.zeros(len(self.names) - len(self.hundredths), dtype=np.int64)])
+        np.add.at(self.hundredths, positions, (owners['Hectareas'] * 100).round().astype(np.int64).to_numpy())
+
+    def owners(self) -> pd.DataFrame:
+        """Hectares of each owner, as group_owners gives them for one partido."""
+        return pd.DataFrame({'Propietarios': list(self.names), 'Hectareas': self.hundredths / 100})
+
+def owners_file(file: str) -> Optional[pd.DataFrame]:
+    """Bin and save the owners of one partido workbook, returning the hectares of each."""
+    parcels = owner_hectares(file, read_file(file))
+    if parcels is None:
+        return None
+    owners = group_owners(parcels)
+    save_file(file, bin_owners(owners))
+    return owners
+
+def consolidate_province(excel_files: List[str]) -> List[parallel.FileResult]:
+    """Bin and save every partido workbook, then the owners of the whole province.
+
+    Each partido's owners are added to the totals as soon as it is done and
+    then dropped, so memory holds one row per owner of the province. With
+    LINK_OWNERS the owners are linked again over the whole province, joining
+    variants written in different partidos. The province is not saved if any
+    partido could not be processed, as its totals would leave that partido out.
+    """
+    totals = OwnerTotals()
+    results = []
+    skipped = []
+    for result in parallel.iter_files(owners_file, excel_files):
+        if result.ok and result.value is not None:
+            totals.add(result.value)
+            result.value = None
+        else:
+            skipped.append(os.path.basename(str(result.path)))
+        results.append(result)
+    if skipped:
+        print(f"{PROVINCE_FILE} not written: {len(skipped)} partidos could not be processed ({', '.join(skipped)})")
+        return results
+    owners = totals.owners()
+    save_file(PROVINCE_FILE, bin_owners(group_owners(owners) if LINK_OWNERS else owners))
+    return results
+
+def save_file(file: str, second_df_bins):
+    """Save the bins of one partido workbook."""
+    if second_df_bins is None:
+        return None
 
     # Save the processed DataFrame to a new Excel file
     output_file_path = os.path.join(output_directory, file)
-    second_df_bins.to_excel(output_file_path, index=False)
+    excel.write_workbook(output_file_path, {'Sheet1': second_df_bins})
+
+    print(f"Processed and saved {file} to {output_file_path}")
+    return output_file_path
+
+def process_file(file: str):
+    """Bin the owners of one partido workbook and save the result."""
+    return save_file(file, bin_file(file, read_file(file)))
+
+def main():
+    # Ensure output directory exists
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Get the list of Excel files in the input directory
+    excel_files = sorted(f for f in os.listdir(input_directory) if f.endswith('.xlsx'))
+
+    if CONSOLIDATE_PROVINCE:
+        results = consolidate_province(excel_files)
+    else:
+        # Process the Excel files in parallel, or overlapping reads and writes with one worker
+        results = parallel.map_stages(read_file, bin_file, save_file, excel_files)
+    parallel.report_failures(results)
 
-    print(f"Processed and saved {file} to {output_file_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
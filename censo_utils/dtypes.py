@@ -0,0 +1,82 @@
+"""Dtypes census frames are held in once loaded.
+
+DTYPE_POLICY selects what apply_dtypes does to a frame:
+
+- 'compact': enumerations (CATEGORY_COLUMNS) become categoricals, names
+  (STRING_COLUMNS) Arrow-backed strings and integer columns the smallest
+  integer dtype holding their values.
+- 'object': text columns are Python-object strings, as pandas before 3.0
+  loaded them; kept to compare against and to fall back on.
+
+Float columns are left as float64 either way: float32 would change the
+sums and means computed from them.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Policy used by apply_dtypes: 'compact' or 'object'
+DTYPE_POLICY = 'compact'
+
+POLICIES = ['compact', 'object']
+
+# Columns holding one of a few values: places, professions, sex, civil state, tenure
+CATEGORY_COLUMNS = [
+    'Partido', 'partido', 'Condición', 'Profesión', 'Profesion', 'Lugar de nacimiento', 'Sexo',
+    'Estado Civil', 'Lee y escribe', 'Va a la escuela', 'Alfabetizacion', 'Escolaridad', 'Propiedad',
+    'Hijos', 'Hoja_Censo', 'Subhoja_censo', 'La explota el propietario, arrendatario o mediero', 'prop',
+]
+
+# Columns holding names, different on almost every row
+STRING_COLUMNS = ['Titular', 'Nombre', 'Nombre_pila', 'Apellido_pila', 'Apellido', 'Propietario Apellido']
+
+def _policy(policy: Optional[str]) -> str:
+    policy = policy or DTYPE_POLICY
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown dtype policy '{policy}', expected one of {POLICIES}")
+    return policy
+
+def string_dtype():
+    """Arrow-backed strings with NaN for missing values, like pandas 3's default,
+    or None if pyarrow or that dtype is not available."""
+    try:
+        import pyarrow  # noqa: F401
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except (ImportError, TypeError):
+        return None
+
+def _is_text(column: pd.Series) -> bool:
+    return (pd.api.types.is_string_dtype(column.dtype) and not isinstance(column.dtype, pd.CategoricalDtype)
+            and pd.api.types.infer_dtype(column, skipna=True) in ('string', 'empty'))
+
+def apply_dtypes(df: pd.DataFrame, columns: Optional[List[str]] = None, policy: Optional[str] = None) -> pd.DataFrame:
+    """Return df with the dtypes of the policy, for columns (all if None) that it has.
+
+    Text columns that also hold numbers are left alone, so no value changes.
+    """
+    policy = _policy(policy)
+    df = df.copy(deep=False)
+    strings = string_dtype()
+    for name in columns if columns is not None else list(df.columns):
+        if name not in df.columns:
+            continue
+        column = df[name]
+        if policy == 'object':
+            if _is_text(column) or isinstance(column.dtype, pd.CategoricalDtype):
+                df[name] = column.astype(object)
+        elif name in CATEGORY_COLUMNS and (_is_text(column) or column.dtype == object and column.isna().all()):
+            df[name] = column.astype('category')
+        elif name in STRING_COLUMNS and strings is not None and _is_text(column):
+            df[name] = column.astype(strings)
+        elif pd.api.types.is_integer_dtype(column.dtype) and not pd.api.types.is_extension_array_dtype(column.dtype):
+            df[name] = pd.to_numeric(column, downcast='integer')
+    return df
+
+def memory_report(frames: Dict[str, pd.DataFrame]) -> str:
+    """Bytes used by each column of frames loaded under different policies, side by side."""
+    usage = pd.DataFrame({label: df.memory_usage(deep=True, index=False) for label, df in frames.items()})
+    usage.loc['total'] = usage.sum()
+    dtypes = pd.DataFrame({f'{label} dtype': df.dtypes.astype(str) for label, df in frames.items()})
+    table = (usage / 2**20).round(2).add_suffix(' MB').join(dtypes)
+    return table.to_string()
@@ -0,0 +1,243 @@
+"""Reading and writing census workbooks.
+
+Reading goes through a configurable backend.
+
+READ_ENGINE selects how read_workbook parses a sheet:
+
+- 'pandas': pd.read_excel with its default engine, every column of the sheet.
+- 'streaming': openpyxl in read-only mode, taking cell values only for the
+  columns asked for and stopping after BLANK_ROW_LIMIT blank rows in a row,
+  so sheets formatted far below their data are not walked to the end. It
+  warns when the sheet has rows past the point it stopped, as any data
+  below the gap is not read.
+- 'calamine': pd.read_excel(engine='calamine'), if python-calamine is installed.
+
+The streaming reader hands its rows to the same parser pd.read_excel uses,
+so column names, missing values and types come out the same as with 'pandas'.
+
+write_workbook streams rows out with xlsxwriter's constant_memory mode,
+taking WRITE_CHUNK_ROWS rows of the frame as Python objects at a time, so
+neither the workbook nor a copy of the frame has to be held in memory. Each
+column is written with the cell type of its dtype and no styling.
+"""
+import datetime
+import itertools
+import math
+import warnings
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Backend used by read_workbook: 'streaming', 'pandas' or 'calamine'
+READ_ENGINE = 'streaming'
+
+# The streaming reader stops after this many consecutive blank rows
+BLANK_ROW_LIMIT = 1000
+
+ENGINES = ['streaming', 'pandas', 'calamine']
+
+# Values openpyxl gives for cells holding an Excel error, read as missing like pandas does
+ERROR_VALUES = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A', '#GETTING_DATA'}
+
+PathLike = Union[str, Path]
+SheetName = Union[int, str]
+UseCols = Optional[Union[Sequence[str], Sequence[int], Callable[[str], bool]]]
+
+# Rows of a frame write_workbook converts to Python objects at a time
+WRITE_CHUNK_ROWS = 10_000
+
+# The one format cells get: dates would otherwise be shown as plain numbers
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+
+def _engine(engine: Optional[str]) -> str:
+    engine = engine or READ_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown read engine '{engine}', expected one of {ENGINES}")
+    return engine
+
+def _convert_cell(value):
+    # As pandas' openpyxl reader: blank cells are '', whole floats are ints
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and value in ERROR_VALUES:
+        return np.nan
+    return value
+
+def _column_indexes(header: tuple, usecols: UseCols) -> List[int]:
+    """Positions of the columns selected by usecols, given the header row."""
+    if usecols is None:
+        return list(range(len(header)))
+    if callable(usecols):
+        return [i for i, name in enumerate(header) if usecols(str(name))]
+    usecols = list(usecols)
+    if all(isinstance(col, int) for col in usecols):
+        return sorted(col for col in usecols if col < len(header))
+    names = [str(name) if name is not None else None for name in header]
+    missing = [col for col in usecols if col not in names]
+    if missing:
+        raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+    return sorted(names.index(col) for col in usecols)
+
+def _read_streaming(path: PathLike, sheet_name: SheetName, usecols: UseCols) -> pd.DataFrame:
+    from openpyxl import load_workbook
+    from pandas.io.parsers import TextParser
+
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        indexes = _column_indexes(header, usecols)
+
+        data, blank_run = [], 0
+        for row in itertools.chain([header], rows):
+            converted = [_convert_cell(row[i]) if i < len(row) else '' for i in indexes]
+            if all(value == '' for value in converted):
+                blank_run += 1
+                if blank_run >= BLANK_ROW_LIMIT:
+                    if next(rows, None) is not None:
+                        warnings.warn(f"{Path(path).name}: stopped reading at row {len(data) + 1} after "
+                                      f"{BLANK_ROW_LIMIT} blank rows, but the sheet goes on to row "
+                                      f"{sheet.max_row or 'unknown'}; rows below were not read, raise "
+                                      f"excel.BLANK_ROW_LIMIT if they hold data")
+                    break
+            else:
+                blank_run = 0
+            data.append(converted)
+    finally:
+        workbook.close()
+
+    # Drop the blank rows at the end, as pandas does
+    while data and all(value == '' for value in data[-1]):
+        data.pop()
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+def _read_sheet(path: PathLike, sheet_name: SheetName, usecols: UseCols, engine: str) -> pd.DataFrame:
+    if engine == 'streaming':
+        return _read_streaming(path, sheet_name, usecols)
+    return pd.read_excel(path, sheet_name=sheet_name, usecols=usecols,
+                         engine='calamine' if engine == 'calamine' else None)
+
+def sheet_names(path: PathLike) -> List[str]:
+    """Names of the sheets of a workbook, in order."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+def read_workbook(path: PathLike, sheet_name: Optional[Union[SheetName, List[SheetName]]] = 0,
+                  usecols: UseCols = None, engine: Optional[str] = None) -> Union[pd.DataFrame, Dict[SheetName, pd.DataFrame]]:
+    """Read a sheet of a workbook, like pd.read_excel.
+
+    sheet_name is a position or name, a list of them, or None for every
+    sheet; a list or None gives a dict of DataFrames. usecols selects columns
+    by name, by position, or with a function of the column name.
+    """
+    engine = _engine(engine)
+    if sheet_name is None:
+        sheet_name = sheet_names(path)
+    if isinstance(sheet_name, list):
+        return {name: _read_sheet(path, name, usecols, engine) for name in sheet_name}
+    return _read_sheet(path, sheet_name, usecols, engine)
+
+def _write_number(worksheet, row: int, col: int, value, formats) -> None:
+    if value != value:
+        return
+    if math.isinf(value):
+        # As pandas' inf_rep
+        worksheet.write_string(row, col, 'inf' if value > 0 else '-inf')
+    else:
+        worksheet.write_number(row, col, value)
+
+def _write_string(worksheet, row: int, col: int, value, formats) -> None:
+    if isinstance(value, str):
+        worksheet.write_string(row, col, value)
+    elif value is not None and value == value:
+        worksheet.write_string(row, col, str(value))
+
+def _write_boolean(worksheet, row: int, col: int, value, formats) -> None:
+    worksheet.write_boolean(row, col, value)
+
+def _write_datetime(worksheet, row: int, col: int, value, formats) -> None:
+    if value is not None and value is not pd.NaT:
+        worksheet.write_datetime(row, col, value, formats['datetime'])
+
+def _write_value(worksheet, row: int, col: int, value, formats) -> None:
+    # Columns of mixed type: pick the cell type of each value
+    if value is None or value is pd.NaT:
+        return
+    if isinstance(value, (bool, np.bool_)):
+        worksheet.write_boolean(row, col, bool(value))
+    elif isinstance(value, (int, float, np.number)):
+        _write_number(worksheet, row, col, float(value), formats)
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        worksheet.write_datetime(row, col, value, formats['datetime'])
+    else:
+        _write_string(worksheet, row, col, value, formats)
+
+def _to_list(values: pd.Series) -> list:
+    return values.tolist()
+
+def _to_floats(values: pd.Series) -> list:
+    return values.astype(float).tolist()
+
+def _to_datetimes(values: pd.Series) -> list:
+    return [None if value is pd.NaT else value.to_pydatetime() for value in values]
+
+def _to_objects(values: pd.Series) -> list:
+    return values.astype(object).tolist()
+
+def _column_writer(column: pd.Series) -> Tuple[Callable, Callable]:
+    """Writer for the cells of a column, and the function giving the values of
+    a slice of it as Python objects."""
+    dtype = column.dtype
+    if pd.api.types.is_bool_dtype(dtype) and not column.hasnans:
+        return _write_boolean, _to_list
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        return _write_number, _to_floats
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return _write_datetime, _to_datetimes
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _write_value, _to_objects
+    if pd.api.types.is_string_dtype(dtype) and pd.api.types.infer_dtype(column, skipna=True) == 'string':
+        return _write_string, _to_list
+    return _write_value, _to_list
+
+def write_workbook(path: PathLike, sheets: Dict[str, pd.DataFrame]) -> Path:
+    """Write each DataFrame to a sheet, header row first, without the index.
+
+    Rows are flushed to disk as soon as the next one starts, and taken from
+    the frame WRITE_CHUNK_ROWS at a time, so memory does not grow with the
+    size of the workbook. Write frames whose index matters with reset_index()
+    first.
+    """
+    import xlsxwriter
+
+    path = Path(path)
+    workbook = xlsxwriter.Workbook(str(path), {'constant_memory': True})
+    try:
+        formats = {'datetime': workbook.add_format({'num_format': DATETIME_FORMAT})}
+        for sheet_name, df in sheets.items():
+            worksheet = workbook.add_worksheet(sheet_name)
+            for col, name in enumerate(df.columns):
+                _write_value(worksheet, 0, col, name, formats)
+
+            writers = [_column_writer(df.iloc[:, col]) for col in range(df.shape[1])]
+            for start in range(0, len(df), WRITE_CHUNK_ROWS):
+                chunk = df.iloc[start:start + WRITE_CHUNK_ROWS]
+                columns = [(write, values(chunk.iloc[:, col])) for col, (write, values) in enumerate(writers)]
+                for offset in range(len(chunk)):
+                    for col, (write, values) in enumerate(columns):
+                        write(worksheet, start + offset + 1, col, values[offset], formats)
+    finally:
+        workbook.close()
+    return path
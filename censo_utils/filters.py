@@ -0,0 +1,40 @@
+"""Filter levels of the 1895 stage 2 cascade.
+
+Each filter keeps a subset of the rows kept by the one before it, so stage 2
+stores a single table with the deepest level every row passed instead of one
+copy of the table per filter. Level n of the cascade is the rows whose level
+is at least n.
+"""
+from typing import Dict
+
+import pandas as pd
+
+# Filter levels in cascade order, named as the sheets stage 2 used to write
+FILTER_LEVELS = [
+    '0_tabla_original',
+    '1_filtro_titular_(nonulo)',
+    '2_filtro_extension_(nonulo)',
+    '3_filtro_tipo_(nonulos)',
+    '4_filtro_tipo_AMP',
+    '5_filtro_cultivo_(_1)',
+]
+
+# Column holding the deepest level each row passed
+LEVEL_COLUMN = 'nivel_filtro'
+
+def level_index(level) -> int:
+    """Position of a level given by name or by number."""
+    return FILTER_LEVELS.index(level) if isinstance(level, str) else int(level)
+
+def select_level(table: pd.DataFrame, level) -> pd.DataFrame:
+    """Rows of table that passed level, without the level column."""
+    return table[table[LEVEL_COLUMN] >= level_index(level)].drop(columns=LEVEL_COLUMN)
+
+def level_counts(table: pd.DataFrame) -> Dict[str, int]:
+    """Number of rows that passed each level."""
+    passed = table[LEVEL_COLUMN].value_counts().reindex(range(len(FILTER_LEVELS)), fill_value=0)
+    return dict(zip(FILTER_LEVELS, passed[::-1].cumsum()[::-1].tolist()))
+
+def split_levels(table: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """One table per level, as the sheets of the stage 2 review workbook."""
+    return {name: select_level(table, index) for index, name in enumerate(FILTER_LEVELS)}
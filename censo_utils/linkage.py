@@ -0,0 +1,155 @@
+"""Link the spelling variants of owner names into owners.
+
+Comparing every name with every other grows with the square of the names,
+so names are first put in blocks by blocking key: the phonetic code of one
+word of the name and the initial of another, for every two words, so that
+names written 'Apellido Nombre' or 'Nombre Apellido', or misspelling one
+word, still share a block. Only names of as many words are compared, as
+'Juan' and 'Juan Ana' are more often two people than one.
+
+The names of a block are compared with each other at once, word by word in
+sorted order, on the character bigrams of the words as pronounced (Dice
+coefficient). Pairs whose words are on average at least
+SIMILARITY_THRESHOLD alike are linked, and union-find joins the links into
+owners. Linking is transitive, so a threshold set too low chains distinct
+owners of similar names into one.
+
+An owner's id is the first of its normalized names in sorted order, so it
+stays the same from run to run while that name is in the data.
+"""
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from censo_utils.vocabulary import normalize
+
+# Dice coefficient of the bigrams of their words, on average, from which two names are the same owner
+SIMILARITY_THRESHOLD = 0.9
+
+# Names of a block compared with the whole block at a time, bounding memory on large blocks
+BLOCK_CHUNK_ROWS = 2_000
+
+# Column holding the owner id
+OWNER_ID_COLUMN = 'owner_id'
+
+# Spanish spellings of the same sound, applied in order
+PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'[^a-z0-9]', ''), (r'ch', 'x'), (r'h', ''), (r'll', 'y'), (r'qu', 'k'), (r'c(?=[ei])', 's'), (r'c', 'k'),
+    (r'z', 's'), (r'g(?=[ei])', 'j'), (r'[vw]', 'b'), (r'y', 'i'), (r'([a-z])\1+', r'\1'),
+]]
+PHONETIC_LENGTH = 6
+
+@dataclass
+class Linkage:
+    """Owner id of every name and how much comparing it took."""
+    ids: pd.Series
+    names: int
+    owners: int
+    compared_pairs: int
+
+@lru_cache(maxsize=None)
+def pronounced(word: str) -> str:
+    """The word spelled as pronounced in Spanish, so that 'Pereyra' and 'Pereira' are alike."""
+    text = normalize(word)
+    for pattern, replacement in PHONETIC_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+def phonetic(word: str) -> str:
+    """Code words sounding alike share: the first letter and the consonants after it."""
+    text = pronounced(word)
+    return (text[:1] + re.sub(r'[aeiou]', '', text[1:]))[:PHONETIC_LENGTH]
+
+def words(name: str) -> List[str]:
+    """Words of a name as pronounced, in sorted order so that the order they are written in does not matter."""
+    return sorted(word for word in map(pronounced, name.split()) if word)
+
+def blocking_keys(name: str) -> List[str]:
+    """Keys of the blocks a name is compared in."""
+    spoken = words(name)
+    if len(spoken) == 1:
+        return [phonetic(spoken[0])]
+    return sorted({f'{phonetic(word)} {other[0]}' for i, word in enumerate(spoken)
+                   for j, other in enumerate(spoken) if i != j})
+
+def _bigrams(spoken: List[str], ids: Dict[str, int]) -> List[np.ndarray]:
+    """Bigram ids of each word of a name."""
+    grams = []
+    for text in spoken:
+        padded = f' {text} '
+        grams.append(np.unique([ids.setdefault(padded[i:i + 2], len(ids)) for i in range(len(padded) - 1)]))
+    return grams
+
+def _presence(grams: List[np.ndarray]) -> tuple:
+    """Matrix of the bigrams each name has, and how many each has."""
+    rows = np.repeat(np.arange(len(grams)), [len(g) for g in grams])
+    local, columns = np.unique(np.concatenate(grams), return_inverse=True)
+    present = np.zeros((len(grams), len(local)), dtype=np.float32)
+    present[rows, columns] = 1
+    return present, present.sum(axis=1)
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def _link_block(members: np.ndarray, bigrams: List[List[np.ndarray]], parent: List[int], threshold: float) -> int:
+    """Link the names of one block, all of as many words, alike enough; return the pairs compared."""
+    word_count = len(bigrams[members[0]])
+    positions = [_presence([bigrams[i][position] for i in members]) for position in range(word_count)]
+    for start in range(0, len(members), BLOCK_CHUNK_ROWS):
+        stop = start + BLOCK_CHUNK_ROWS
+        total = np.zeros((len(members[start:stop]), len(members)), dtype=np.float32)
+        for present, sizes in positions:
+            total += 2 * (present[start:stop] @ present.T) / (sizes[start:stop, None] + sizes[None, :])
+        first, second = np.nonzero(total >= threshold * word_count)
+        first += start
+        for a, b in zip(members[first[second > first]], members[second[second > first]]):
+            root_a, root_b = _find(parent, a), _find(parent, b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+    return len(members) * (len(members) - 1) // 2
+
+def link(names: pd.Series, threshold: float = SIMILARITY_THRESHOLD,
+         blocking: Callable[[str], List[str]] = blocking_keys) -> Linkage:
+    """Link the names into owners; names normalizing alike are always the same owner.
+
+    blocking gives the keys of the blocks of a normalized name; names sharing
+    no block, or of a different number of words, are never compared.
+    """
+    codes, distinct = pd.factorize(names)
+    normalized_codes, normalized = pd.factorize(pd.Series([normalize(name) for name in distinct], dtype=object))
+    normalized = list(normalized)
+
+    blocks = defaultdict(list)
+    gram_ids = {}
+    bigrams = []
+    for i, name in enumerate(normalized):
+        spoken = words(name)
+        for key in (blocking(name) if spoken else []):
+            blocks[len(spoken), key].append(i)
+        bigrams.append(_bigrams(spoken, gram_ids))
+
+    parent = list(range(len(normalized)))
+    compared = sum(_link_block(np.array(members), bigrams, parent, threshold)
+                   for members in blocks.values() if len(members) > 1)
+
+    # The first name of each owner in sorted order names it
+    roots = [_find(parent, i) for i in range(len(normalized))]
+    representative = {}
+    for i in sorted(range(len(normalized)), key=normalized.__getitem__):
+        representative.setdefault(roots[i], normalized[i])
+    owner_of_name = np.array([representative[root] for root in roots] + [np.nan], dtype=object)
+    owner_of_distinct = owner_of_name[np.append(normalized_codes, -1)]
+    ids = pd.Series(owner_of_distinct[codes], index=names.index, name=OWNER_ID_COLUMN, dtype=object)
+    return Linkage(ids, len(normalized), len(representative), compared)
+
+def owner_ids(names: pd.Series, threshold: float = SIMILARITY_THRESHOLD) -> pd.Series:
+    """Owner id of every name, NaN where the name is missing."""
+    return link(names, threshold).ids
@@ -0,0 +1,115 @@
+"""Build manifest recording what every stage output was built from.
+
+Each record keys a stage and a partido (or PROVINCE for outputs built from
+every partido) to the content hashes of its inputs, of the code and
+configuration that ran, and of the outputs it wrote. An output is current
+while all three still match, so a rerun only rebuilds what actually changed.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+PathLike = Union[str, Path]
+
+# Key of records for outputs built from every partido
+PROVINCE = '*'
+
+def hash_path(path: PathLike) -> Optional[str]:
+    """SHA-256 of a file, or of every file in a directory; None if it does not exist."""
+    path = Path(path)
+    digest = hashlib.sha256()
+    if path.is_dir():
+        for child in sorted(p for p in path.rglob('*') if p.is_file()):
+            digest.update(child.relative_to(path).as_posix().encode())
+            digest.update(hash_path(child).encode())
+    elif path.is_file():
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    else:
+        return None
+    return digest.hexdigest()
+
+def hash_code(paths: Iterable[PathLike], config: Optional[Dict] = None) -> str:
+    """Hash the source files of a stage together with the configuration it ran with."""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(hash_path(path).encode())
+    digest.update(json.dumps(config or {}, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+class BuildManifest:
+    """Records of stage outputs, stored as JSON next to the pipeline."""
+
+    def __init__(self, path: PathLike, records: Optional[Dict[str, Dict[str, Dict]]] = None):
+        self.path = Path(path)
+        self.records = records if records is not None else {}
+        self._hashes = {}
+
+    @classmethod
+    def load(cls, path: PathLike) -> 'BuildManifest':
+        """Load the manifest, starting empty if it does not exist yet."""
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        return cls(path)
+
+    def save(self) -> None:
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.records, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def _hash(self, path: PathLike) -> Optional[str]:
+        # Outputs of one stage are the inputs of the next, so hash each path once per run
+        key = str(path)
+        if key not in self._hashes:
+            self._hashes[key] = hash_path(path)
+        return self._hashes[key]
+
+    def is_current(self, stage: str, key: str, inputs: List[PathLike], code: str) -> bool:
+        """True if the outputs recorded for stage and key are still valid."""
+        record = self.records.get(stage, {}).get(key)
+        if record is None or record['code'] != code:
+            return False
+        if record['inputs'] != {str(path): self._hash(path) for path in inputs}:
+            return False
+        return all(self._hash(path) == digest for path, digest in record['outputs'].items())
+
+    def record(self, stage: str, key: str, inputs: List[PathLike], outputs: List[PathLike], code: str) -> None:
+        """Record that stage built outputs for key from inputs with code."""
+        for path in outputs:
+            self._hashes.pop(str(path), None)
+        self.records.setdefault(stage, {})[key] = {
+            'code': code,
+            'inputs': {str(path): self._hash(path) for path in inputs},
+            'outputs': {str(path): self._hash(path) for path in outputs},
+        }
+
+    def merge(self, other: 'BuildManifest', key: str) -> None:
+        """Take the records of key from a copy updated by a worker process."""
+        if other is self:  # Serial runs hand back the same object
+            return
+        for stage in set(self.records) | set(other.records):
+            record = other.records.get(stage, {}).get(key)
+            if record is None:
+                self.records.get(stage, {}).pop(key, None)
+            else:
+                self.records.setdefault(stage, {})[key] = record
+                self._hashes.update((path, digest) for path, digest in record['outputs'].items())
+
+    def invalidate(self, key: Optional[str] = None, stages: Optional[Iterable[str]] = None) -> List[str]:
+        """Drop the records of key (every key if None) in stages (all if None).
+
+        Returns the output paths those records listed.
+        """
+        outputs = []
+        for stage in list(stages) if stages is not None else list(self.records):
+            stage_records = self.records.get(stage, {})
+            for record_key in [key] if key is not None else list(stage_records):
+                record = stage_records.pop(record_key, None)
+                if record is not None:
+                    outputs.extend(record['outputs'])
+        return outputs
@@ -0,0 +1,166 @@
+"""Run an independent job for every input file on a pool of worker processes.
+
+map_stages splits the job into read, compute and write steps. With one
+worker they run as a pipeline in this process: reader threads prefetch the
+next files while the current one is computed, and a writer thread saves the
+previous result in the background.
+"""
+import functools
+import os
+import queue
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Union
+
+# Worker processes used by map_files; 1 processes every file in this process
+WORKERS = os.cpu_count() or 1
+
+# Files read ahead of the one being computed by pipeline_files
+PREFETCH = 2
+
+# Computed results waiting for the writer before the compute step blocks
+WRITE_QUEUE_SIZE = 1
+
+@dataclass
+class FileResult:
+    """Outcome of processing one file: its return value or the error it raised."""
+    path: Union[str, Path]
+    value: Any = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def _run(func: Callable, path: Union[str, Path], args: tuple) -> FileResult:
+    try:
+        return FileResult(path, func(path, *args))
+    except Exception:
+        return FileResult(path, error=traceback.format_exc())
+
+def map_files(func: Callable, paths: Sequence[Union[str, Path]], *args, workers: Optional[int] = None) -> List[FileResult]:
+    """Call func(path, *args) for every path and return the results in the order of paths.
+
+    A file that raises does not stop the others; its FileResult carries the
+    traceback instead of a value. func must be defined at module level so the
+    worker processes can import it.
+    """
+    workers = min(workers or WORKERS, len(paths))
+    if workers <= 1:
+        return [_run(func, path, args) for path in paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run, func, path, args) for path in paths]
+        results = []
+        for path, future in zip(paths, futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                # The worker died or the result could not be sent back
+                results.append(FileResult(path, error=traceback.format_exc()))
+    return results
+
+def iter_files(func: Callable, paths: Sequence[Union[str, Path]], *args,
+               workers: Optional[int] = None) -> Iterator[FileResult]:
+    """Like map_files, but yield each FileResult as soon as its file is done.
+
+    Files are started in the order of paths and finish in any order.
+    """
+    workers = min(workers or WORKERS, len(paths))
+    if workers <= 1:
+        for path in paths:
+            yield _run(func, path, args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run, func, path, args): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception:
+                yield FileResult(futures[future], error=traceback.format_exc())
+
+def _run_stages(read: Callable, compute: Callable, write: Callable, path: Union[str, Path], *args) -> Any:
+    return write(path, compute(path, read(path), *args))
+
+def pipeline_files(read: Callable, compute: Callable, write: Callable, paths: Sequence[Union[str, Path]], *args,
+                   prefetch: Optional[int] = None) -> List[FileResult]:
+    """Call write(path, compute(path, read(path), *args)) for every path, overlapping the steps.
+
+    A pool of prefetch threads reads ahead, compute runs in this thread one
+    file at a time and a single thread writes. Reads are only started as
+    files are taken for compute, and compute waits while WRITE_QUEUE_SIZE
+    results are queued for the writer, so at most prefetch + WRITE_QUEUE_SIZE
+    + 2 files are held in memory. The steps overlap where they wait on disk
+    or run outside the interpreter lock, as pandas, openpyxl's parser and
+    the writers largely do.
+    """
+    prefetch = max(1, prefetch or PREFETCH)
+    results: List[Optional[FileResult]] = [None] * len(paths)
+    write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+
+    def write_outputs():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            index, output = item
+            results[index] = _run(write, paths[index], (output,))
+
+    writer = threading.Thread(target=write_outputs, name='pipeline-writer', daemon=True)
+    writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='pipeline-reader') as readers:
+            pending = deque()
+            upcoming = iter(enumerate(paths))
+
+            def read_next():
+                for index, path in upcoming:
+                    pending.append((index, readers.submit(_run, read, path, ())))
+                    return
+
+            for _ in range(prefetch):
+                read_next()
+            while pending:
+                index, future = pending.popleft()
+                loaded = future.result()
+                read_next()
+                if not loaded.ok:
+                    results[index] = loaded
+                    continue
+                computed = _run(compute, paths[index], (loaded.value, *args))
+                del loaded
+                if not computed.ok:
+                    results[index] = computed
+                    continue
+                write_queue.put((index, computed.value))
+                del computed
+    finally:
+        write_queue.put(None)
+        writer.join()
+    return results
+
+def map_stages(read: Callable, compute: Callable, write: Callable, paths: Sequence[Union[str, Path]], *args,
+               workers: Optional[int] = None) -> List[FileResult]:
+    """Like map_files for a job split into read, compute and write steps.
+
+    Each file goes through write(path, compute(path, read(path), *args)) and
+    the value write returns is the FileResult value. With more than one
+    worker the files are spread over processes as map_files does; with one,
+    pipeline_files overlaps reading, computing and writing them.
+    """
+    workers = min(workers or WORKERS, len(paths))
+    if workers <= 1:
+        return pipeline_files(read, compute, write, paths, *args)
+    return map_files(functools.partial(_run_stages, read, compute, write), paths, *args, workers=workers)
+
+def report_failures(results: List[FileResult]) -> List[FileResult]:
+    """Print the error of every failed file and return the failures."""
+    failures = [result for result in results if not result.ok]
+    for result in failures:
+        print(f"Error processing {os.path.basename(str(result.path))}:\n{result.error}")
+    return failures
@@ -0,0 +1,275 @@
+"""Intermediate tables handed from one pipeline stage to the next.
+
+Stages write their intermediate results with write_table/write_tables and the
+next stage reads them back with read_table/read_tables. In a columnar format a
+single table is one file (<stem>.parquet) and a set of tables is a directory
+with one file per table (<stem>/<name>.parquet). In 'xlsx' format they are a
+workbook with one sheet per table, which is how the pipeline always worked.
+A stage can describe an output in a small JSON sidecar (<stem>.meta.json) so
+the next one does not have to parse the table to learn about it; storing the
+file_signature of the output in it tells whether the sidecar still matches.
+
+Tables read a slice at a time can be written with write_dataset as a Parquet
+dataset partitioned by one column, one directory per value, and read_dataset
+reads back only the values asked for.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# Format for tables only read by the next stage: 'parquet', 'feather' or 'xlsx'
+INTERMEDIATE_FORMAT = 'parquet'
+
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'xlsx': '.xlsx'}
+
+# Schema metadata key listing columns stored as text because they mixed numbers and text
+MIXED_COLUMNS_KEY = b'censo_mixed_columns'
+
+# Each mixed column is stored next to a column of this suffix giving the type
+# of each cell, so numbers are read back exactly as they were and text that
+# looks like a number stays text
+MIXED_KIND_SUFFIX = '__kind'
+MIXED_KINDS = {1: int, 2: float, 3: lambda text: text == 'True'}
+MIXED_TEXT = {0: str, 1: lambda value: str(int(value)), 2: lambda value: repr(float(value)),
+              3: lambda value: str(bool(value))}
+
+# File in a dataset directory holding its schema, so a dataset with no rows can be read
+DATASET_SCHEMA_FILE = '_common_metadata'
+
+PathLike = Union[str, Path]
+
+def _format(fmt: Optional[str]) -> str:
+    fmt = fmt or INTERMEDIATE_FORMAT
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown intermediate format '{fmt}', expected one of {list(EXTENSIONS)}")
+    return fmt
+
+def _kind(value) -> int:
+    """Key in MIXED_KINDS of the type of a cell, 0 for text and anything else."""
+    if isinstance(value, (bool, np.bool_)):
+        return 3
+    if isinstance(value, (int, np.integer)):
+        return 1
+    if isinstance(value, (float, np.floating)):
+        return 2
+    return 0
+
+def _arrow_table(df: pd.DataFrame):
+    """df as a pyarrow Table, with mixed number/text columns stored as text
+    and the type of each of their cells."""
+    import pyarrow as pa
+
+    mixed_columns = [col for col in df.columns if df[col].dtype == object and
+                     pd.api.types.infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer')]
+    if mixed_columns:
+        df = df.copy()
+        for col in mixed_columns:
+            missing = df[col].isna()
+            # repr of a float is the shortest text that reads back as the same float; numpy
+            # scalars are made Python numbers first, as their repr is 'np.float64(1.5)'
+            df[f'{col}{MIXED_KIND_SUFFIX}'] = df[col].map(_kind).where(~missing, 0).astype(np.int8)
+            df[col] = df[col].where(missing, df[col].map(lambda value: MIXED_TEXT[_kind(value)](value)))
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[MIXED_COLUMNS_KEY] = json.dumps(mixed_columns).encode()
+    return table.replace_schema_metadata(metadata)
+
+def _to_pandas(table) -> pd.DataFrame:
+    """A Table made by _arrow_table as a DataFrame, restoring the numbers of mixed columns."""
+    df = table.to_pandas()
+    mixed_columns = json.loads((table.schema.metadata or {}).get(MIXED_COLUMNS_KEY, b'[]'))
+    for col in mixed_columns:
+        kinds = df.pop(f'{col}{MIXED_KIND_SUFFIX}').to_numpy()
+        values = df[col].to_numpy(dtype=object, copy=True)
+        for kind, restore in MIXED_KINDS.items():
+            rows = kinds == kind
+            values[rows] = [restore(text) for text in values[rows]]
+        df[col] = pd.Series(values, index=df.index, dtype=object)
+    return df
+
+def _write_columnar(df: pd.DataFrame, path: Path, fmt: str) -> None:
+    """Write df with pyarrow, storing mixed number/text columns as text."""
+    table = _arrow_table(df)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+
+def _read_columnar(path: Path) -> pd.DataFrame:
+    """Read a table written by _write_columnar, restoring numbers in mixed columns."""
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        import pyarrow.feather as feather
+        table = feather.read_table(path)
+    return _to_pandas(table)
+
+def table_path(path_stem: PathLike, fmt: Optional[str] = None) -> Path:
+    """Path write_table uses for path_stem."""
+    return Path(path_stem).with_name(Path(path_stem).name + EXTENSIONS[_format(fmt)])
+
+def tables_path(path_stem: PathLike, fmt: Optional[str] = None) -> Path:
+    """Path write_tables uses for path_stem: a workbook for xlsx, else a directory."""
+    return table_path(path_stem, fmt) if _format(fmt) == 'xlsx' else Path(path_stem)
+
+def write_table(df: pd.DataFrame, path_stem: PathLike, fmt: Optional[str] = None) -> Path:
+    """Write a single intermediate table and return the path written."""
+    fmt = _format(fmt)
+    path = table_path(path_stem, fmt)
+    if fmt == 'xlsx':
+        from censo_utils import excel
+        excel.write_workbook(path, {'Sheet1': df})
+    else:
+        _write_columnar(df, path, fmt)
+    return path
+
+def write_tables(tables: Dict[str, pd.DataFrame], path_stem: PathLike, fmt: Optional[str] = None) -> Path:
+    """Write a set of named intermediate tables and return the path written."""
+    fmt = _format(fmt)
+    path_stem = Path(path_stem)
+    if fmt == 'xlsx':
+        from censo_utils import excel
+        return excel.write_workbook(tables_path(path_stem, fmt), tables)
+
+    path_stem.mkdir(parents=True, exist_ok=True)
+    for name, df in tables.items():
+        _write_columnar(df, path_stem / f'{name}{EXTENSIONS[fmt]}', fmt)
+    return path_stem
+
+def read_table(path: PathLike, name: Optional[str] = None) -> pd.DataFrame:
+    """Read one intermediate table; name selects the sheet or file inside a set."""
+    path = Path(path)
+    if path.is_dir():
+        return _read_columnar(next(path.glob(f'{name}.*')))
+    if path.suffix == '.xlsx':
+        from censo_utils import excel
+        return excel.read_workbook(path, sheet_name=name if name is not None else 0)
+    return _read_columnar(path)
+
+def read_tables(path: PathLike, names: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+    """Read a set of intermediate tables, all of them unless names is given."""
+    path = Path(path)
+    if path.suffix == '.xlsx':
+        from censo_utils import excel
+        return excel.read_workbook(path, sheet_name=names)
+    if names is None:
+        names = sorted(p.stem for p in path.iterdir() if p.suffix in EXTENSIONS.values())
+    return {name: read_table(path, name) for name in names}
+
+def _partitioning(schema, partition_column: str):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([schema.field(partition_column)]), flavor='hive')
+
+def write_dataset(df: pd.DataFrame, path: PathLike, partition_column: str) -> Path:
+    """Write df as a Parquet dataset at path, replacing any there, and return path.
+
+    The rows of each value of partition_column go to their own directory,
+    <column>=<value>, null values to <column>=__HIVE_DEFAULT_PARTITION__.
+    The partition column is stored as text.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    table = _arrow_table(df.assign(**{partition_column: df[partition_column].astype(object)}))
+    index = table.schema.get_field_index(partition_column)
+    table = table.set_column(index, pa.field(partition_column, pa.string()), table.column(index).cast(pa.string()))
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+    ds.write_dataset(table, path, format='parquet', partitioning=_partitioning(table.schema, partition_column))
+    pq.write_metadata(table.schema, path / DATASET_SCHEMA_FILE)
+    return path
+
+def _dataset(path: PathLike, partition_column: str):
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    schema = pq.read_schema(path / DATASET_SCHEMA_FILE)
+    return ds.dataset(path, schema=schema, format='parquet', partitioning=_partitioning(schema, partition_column))
+
+def read_dataset(path: PathLike, partition_column: str, values: Optional[List] = None) -> pd.DataFrame:
+    """Read a dataset written by write_dataset, only the rows of the given
+    values of partition_column if values is given (NaN or None for nulls)."""
+    import pyarrow.dataset as ds
+
+    dataset = _dataset(path, partition_column)
+    condition = None
+    if values is not None:
+        field = ds.field(partition_column)
+        known = [value for value in values if not pd.isna(value)]
+        condition = field.isin(known) if known else ds.scalar(False)
+        if len(known) < len(values):
+            condition = condition | field.is_null()
+    return _to_pandas(dataset.to_table(filter=condition))
+
+def dataset_values(path: PathLike, partition_column: str) -> List:
+    """Values of partition_column in a dataset written by write_dataset, in the order
+    of its rows, nulls as NaN."""
+    column = _dataset(path, partition_column).to_table(columns=[partition_column]).column(0)
+    return column.unique().to_pandas().tolist()
+
+def metadata_path(path: PathLike) -> Path:
+    """Path of the metadata sidecar of an intermediate output."""
+    path = Path(path)
+    return path.with_name(f'{table_stem(path)}.meta.json')
+
+def write_metadata(path: PathLike, metadata: Dict) -> Path:
+    """Write the metadata sidecar of the intermediate output at path."""
+    sidecar = metadata_path(path)
+    with open(sidecar, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=1)
+    return sidecar
+
+def read_metadata(path: PathLike) -> Optional[Dict]:
+    """Read the metadata sidecar of the intermediate output at path, None if it has none."""
+    sidecar = metadata_path(path)
+    if not sidecar.exists():
+        return None
+    with open(sidecar, encoding='utf-8') as f:
+        return json.load(f)
+
+def file_signature(path: PathLike) -> Optional[Dict[str, int]]:
+    """Size and modification time of an intermediate output, adding up the
+    files of a directory; None if it does not exist.
+
+    Telling whether an output changed this way only takes a stat, where
+    hashing it takes reading it whole.
+    """
+    path = Path(path)
+    if path.is_dir():
+        stats = [os.stat(p) for p in path.rglob('*') if p.is_file()]
+    elif path.is_file():
+        stats = [os.stat(path)]
+    else:
+        return None
+    return {'size': sum(stat.st_size for stat in stats),
+            'mtime_ns': max((stat.st_mtime_ns for stat in stats), default=0)}
+
+def list_tables(directory: PathLike, fmt: Optional[str] = None) -> List[Path]:
+    """List the intermediate outputs in directory written in the given format."""
+    extension = EXTENSIONS[_format(fmt)]
+    paths = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix == extension:
+            paths.append(path)
+        elif path.is_dir() and any(path.glob(f'*{extension}')):
+            paths.append(path)
+    return paths
+
+def table_stem(path: PathLike) -> str:
+    """Name of an intermediate output without its extension."""
+    path = Path(path)
+    return path.name if path.is_dir() else path.stem
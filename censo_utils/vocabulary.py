@@ -0,0 +1,190 @@
+"""Canonical spellings of free-text census columns such as profession and birthplace.
+
+A vocabulary maps every spelling of a value to one canonical label per
+column, stored as JSON so the mapping and the code of each label stay the
+same from run to run. Spellings are compared by key: lowercased, without
+accents and with single spaces, so "Italia", "italia " and "ITALIA" are
+one value. Spellings that differ otherwise ("Italy") are merged by adding
+their key under the canonical label in the JSON file; suggestions lists
+the labels that look like another one, to help find them. Only the labels
+sharing the most character bigrams with a label are compared with it, so
+suggestions grows with the labels rather than with their square.
+
+Each distinct raw value is mapped once per run; canonicalize gives a
+categorical column, so grouping on it runs on small integer codes.
+"""
+import difflib
+import json
+import os
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+PathLike = Union[str, Path]
+
+# Similarity from which suggestions proposes merging a label into another
+SUGGESTION_CUTOFF = 0.85
+
+# Labels sharing the most bigrams with a label that suggestions compares it with, and
+# labels whose bigrams are compared with all the others at a time, bounding memory
+SUGGESTION_CANDIDATES = 10
+SUGGESTION_CHUNK_ROWS = 2_000
+
+def normalize(value) -> str:
+    """Key spellings of the same value share: lowercase, no accents, single spaces."""
+    text = str(value)
+    if text.isascii():
+        return ' '.join(text.lower().split())
+    text = unicodedata.normalize('NFKD', text).casefold()
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.split())
+
+def _bigram_presence(keys: List[str]) -> tuple:
+    """Matrix of the character bigrams each key has, and how many each has."""
+    ids = {}
+    grams = [{ids.setdefault(f' {key} '[i:i + 2], len(ids)) for i in range(len(key) + 1)} for key in keys]
+    rows = np.repeat(np.arange(len(keys)), [len(g) for g in grams])
+    present = np.zeros((len(keys), len(ids)), dtype=np.float32)
+    present[rows, [gram for g in grams for gram in g]] = 1
+    return present, present.sum(axis=1)
+
+def _candidates(keys: List[str], queries: List[int], count: int = SUGGESTION_CANDIDATES) -> List[np.ndarray]:
+    """Positions of the keys sharing the most bigrams with each of the queries
+    (positions in keys, Dice coefficient), the query itself excluded."""
+    present, sizes = _bigram_presence(keys)
+    count = min(count, len(keys) - 1)
+    found = []
+    for start in range(0, len(queries), SUGGESTION_CHUNK_ROWS):
+        chunk = np.asarray(queries[start:start + SUGGESTION_CHUNK_ROWS])
+        dice = 2 * (present[chunk] @ present.T) / (sizes[chunk, None] + sizes[None, :])
+        dice[np.arange(len(chunk)), chunk] = -1
+        found += list(np.argpartition(-dice, count - 1, axis=1)[:, :count]) if count > 0 else [[]] * len(chunk)
+    return found
+
+class Vocabulary:
+    """Canonical labels of each column and the keys mapped to them.
+
+    The code of a label is its position in the column's list of labels, -1
+    for missing values. Values whose key is not in the vocabulary yet are
+    added with their most common spelling as label, the first seen on a tie.
+    """
+
+    def __init__(self, path: Optional[PathLike] = None, columns: Optional[Dict[str, Dict]] = None):
+        self.path = Path(path) if path is not None else None
+        self.labels: Dict[str, List[str]] = {}
+        self.variants: Dict[str, Dict[str, str]] = {}
+        for column, entry in (columns or {}).items():
+            self.labels[column] = list(entry.get('canonical', []))
+            self.variants[column] = dict(entry.get('variants', {}))
+            for label in self.labels[column]:
+                self.variants[column].setdefault(normalize(label), label)
+        self._codes: Dict[str, Dict[str, int]] = {column: {label: code for code, label in enumerate(labels)}
+                                                  for column, labels in self.labels.items()}
+        self._memo: Dict[str, Dict[object, int]] = {}
+        self._learned: Dict[str, List[str]] = defaultdict(list)
+        self._timings: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    @classmethod
+    def load(cls, path: PathLike) -> 'Vocabulary':
+        """Load the vocabulary, starting empty if it does not exist yet."""
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        return cls(path)
+
+    def save(self) -> None:
+        columns = {column: {'canonical': labels, 'variants': self.variants.get(column, {})}
+                   for column, labels in self.labels.items()}
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(columns, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def _label_code(self, column: str, label: str) -> int:
+        codes = self._codes.setdefault(column, {})
+        if label not in codes:
+            codes[label] = len(codes)
+            self.labels.setdefault(column, []).append(label)
+            self._learned[column].append(label)
+        return codes[label]
+
+    def _learn(self, column: str, raw_values: Iterable, rows: Iterable[int]) -> None:
+        """Map raw values not seen yet, adding a label for each new key."""
+        variants = self.variants.setdefault(column, {})
+        spellings = defaultdict(Counter)
+        keys = {}
+        for raw, count in zip(raw_values, rows):
+            keys[raw] = key = normalize(raw)
+            if key not in variants:
+                spellings[key][' '.join(str(raw).split())] += count
+        for key, counts in spellings.items():
+            variants[key] = max(counts, key=counts.get)
+        memo = self._memo.setdefault(column, {})
+        for raw, key in keys.items():
+            memo[raw] = self._label_code(column, variants[key])
+
+    def codes(self, values: pd.Series, column: Optional[str] = None) -> np.ndarray:
+        """Code of the canonical label of every value, -1 where missing."""
+        column = column or values.name
+        start = time.perf_counter()
+        positions, uniques = pd.factorize(values)
+        memo = self._memo.setdefault(column, {})
+        new = [i for i, raw in enumerate(uniques) if raw not in memo]
+        if new:
+            rows = np.bincount(positions[positions >= 0], minlength=len(uniques))
+            self._learn(column, [uniques[i] for i in new], rows[new].tolist())
+        unique_codes = np.array([memo[raw] for raw in uniques] + [-1], dtype=np.int32)
+        codes = unique_codes[positions]
+        timing = self._timings[column]
+        timing[0] += len(values)
+        timing[1] += time.perf_counter() - start
+        return codes
+
+    def canonicalize(self, values: pd.Series, column: Optional[str] = None) -> pd.Series:
+        """values with every spelling replaced by its canonical label, as a
+        categorical of the labels found, in sorted order."""
+        column = column or values.name
+        codes = self.codes(values, column)
+        found = np.unique(codes[codes >= 0])
+        labels = [self.labels[column][code] for code in found]
+        order = np.argsort(labels, kind='stable')
+        # Vocabulary codes to positions among the sorted labels found
+        positions = np.full(len(self.labels.get(column, [])) + 1, -1, dtype=np.int32)
+        positions[found[order]] = np.arange(len(found))
+        categories = pd.Index([labels[i] for i in order], dtype=object)
+        return pd.Series(pd.Categorical.from_codes(positions[codes], categories), index=values.index, name=values.name)
+
+    def suggestions(self, cutoff: float = SUGGESTION_CUTOFF) -> pd.DataFrame:
+        """Labels added this run that look like another label of their column, for review.
+
+        Each is compared with the SUGGESTION_CANDIDATES labels sharing the most
+        bigrams with it only.
+        """
+        rows = []
+        for column, learned in self._learned.items():
+            others = {normalize(label): label for label in self.labels[column]}
+            keys = list(others)
+            positions = {key: i for i, key in enumerate(keys)}
+            learned_keys = [normalize(label) for label in learned]
+            found = _candidates(keys, [positions[key] for key in learned_keys])
+            for label, key, near in zip(learned, learned_keys, found):
+                matches = difflib.get_close_matches(key, [keys[i] for i in sorted(near)], n=1, cutoff=cutoff)
+                if matches:
+                    score = difflib.SequenceMatcher(None, key, matches[0]).ratio()
+                    rows.append({'Column': column, 'Value': label, 'Suggestion': others[matches[0]],
+                                 'Score': round(score, 3)})
+        return pd.DataFrame(rows, columns=['Column', 'Value', 'Suggestion', 'Score'])
+
+    def report(self) -> pd.DataFrame:
+        """Distinct raw values against canonical labels of each column mapped this run, and mapping speed."""
+        rows = []
+        for column, memo in self._memo.items():
+            mapped, seconds = self._timings[column]
+            rows.append({'Column': column, 'Raw values': len(memo), 'Canonical values': len(set(memo.values())),
+                         'Rows': mapped, 'Rows/s': round(mapped / seconds) if seconds else None})
+        return pd.DataFrame(rows, columns=['Column', 'Raw values', 'Canonical values', 'Rows', 'Rows/s'])
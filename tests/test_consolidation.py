@@ -0,0 +1,63 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from censo_utils import parallel
+
+ROOT = Path(__file__).resolve().parents[1]
+
+def load_script():
+    path = ROOT / 'censo_1914/procesamiento_bases/script.py'
+    spec = importlib.util.spec_from_file_location('script_1914', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+script = load_script()
+
+def make_partido(seed: int, parcels: int = 200) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'foto ': 1, 'N° registro': np.arange(parcels), 'partido': f'P{seed}',
+                         'Apellido': rng.choice(['Pereyra', 'PEREYRA', 'Gómez', 'Gomez ', 'Anchorena'], parcels),
+                         'Nombre': rng.choice(['Juan', 'José', 'Ana'], parcels),
+                         'Sup.': (rng.pareto(1.2, parcels) * 200_000).round(), 'prop': 'P'})
+
+@pytest.fixture
+def directories(tmp_path, monkeypatch):
+    (tmp_path / 'input').mkdir()
+    monkeypatch.setattr(script, 'input_directory', str(tmp_path / 'input'))
+    monkeypatch.setattr(script, 'output_directory', str(tmp_path / 'output'))
+    monkeypatch.setattr(script, 'CONSOLIDATE_PROVINCE', True)
+    monkeypatch.setattr(parallel, 'WORKERS', 1)
+    return tmp_path
+
+def test_owner_totals_key_on_normalized_names_in_any_order():
+    partidos = [pd.DataFrame({'Propietarios': ['Pereyra Juan', 'Gómez Ana'], 'Hectareas': [10.1, 0.2]}),
+                pd.DataFrame({'Propietarios': ['PEREYRA  JUAN', 'Gomez Ana', 'Gómez Ana'], 'Hectareas': [0.2, 1.0, 3]})]
+    forward, backward = script.OwnerTotals(), script.OwnerTotals()
+    for owners in partidos:
+        forward.add(owners)
+    for owners in reversed(partidos):
+        backward.add(owners)
+    assert forward.owners().to_dict('list') == {'Propietarios': ['Pereyra Juan', 'Gómez Ana'], 'Hectareas': [10.3, 4.2]}
+    assert backward.owners().to_dict('list') == {'Propietarios': ['PEREYRA  JUAN', 'Gomez Ana'], 'Hectareas': [10.3, 4.2]}
+
+def test_province_totals_add_up_the_partidos(directories):
+    for seed in range(3):
+        make_partido(seed).to_excel(directories / 'input' / f'partido_{seed}.xlsx', index=False)
+    script.main()
+    province = pd.read_excel(directories / 'output' / script.PROVINCE_FILE)
+    partidos = sum(pd.read_excel(directories / 'output' / f'partido_{seed}.xlsx')['Hectareas'].sum()
+                   for seed in range(3))
+    assert province['Hectareas'].sum() == pytest.approx(partidos)
+
+def test_province_not_written_when_a_partido_fails(directories, capsys):
+    make_partido(0).to_excel(directories / 'input' / 'partido_0.xlsx', index=False)
+    (directories / 'input' / 'partido_1.xlsx').write_text('not a workbook')
+    script.main()
+    assert (directories / 'output' / 'partido_0.xlsx').exists()
+    assert not (directories / 'output' / script.PROVINCE_FILE).exists()
+    assert f'{script.PROVINCE_FILE} not written' in capsys.readouterr().out
@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+CONTADOR = Path(__file__).resolve().parents[1] / 'censo_1895/Python_1895/demografia/contador_familias'
+sys.path.insert(0, str(CONTADOR))
+import benchmark_familias  # noqa: E402
+import contador_familias  # noqa: E402
+
+ROWS = 3_000
+
+# Short sheets cut through households, so many runs start inside an open block
+SHEET_ROWS = 37
+
+@pytest.fixture(scope='module')
+def register(tmp_path_factory) -> tuple:
+    """A register written to CSV, and the same register read whole and split into census sheets."""
+    df = benchmark_familias.make_register(ROWS, seed=5)
+    df.insert(0, 'Nombre', 'Juan ' + df.pop('Apellido_pila'))
+    df['Hoja_Censo'] = 'Hoja'
+    df['Subhoja_censo'] = (np.arange(ROWS) // SHEET_ROWS).astype(str)
+    path = tmp_path_factory.mktemp('register') / 'register.csv'
+    df.to_csv(path, index=False)
+    return path, contador_familias.prepare(pd.read_csv(path, dtype=str))
+
+@pytest.fixture(scope='module')
+def serial(register) -> pd.Series:
+    return contador_familias.prev_apellido_pila(register[1])
+
+def expected_stats(df: pd.DataFrame, prev: pd.Series) -> pd.DataFrame:
+    return df.assign(Prev_Apellido_pila=prev).groupby('Prev_Apellido_pila')['Edad'].agg(
+        Mean_Edad='mean', Count='count').reset_index()
+
+def test_blocks_cross_the_shard_boundaries(register, serial):
+    df = register[1]
+    starts = [start for start, _ in contador_familias.shard_bounds(df, 2 * contador_familias.SHARDS_PER_WORKER)]
+    assert len(starts) > 1
+    assert any(serial.iloc[start - 1] != '' and serial.iloc[start] != '' for start in starts[1:])
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_sharded_blocks_match_the_serial_ones_run_after_run(register, serial, workers):
+    df = register[1]
+    for _ in range(2):
+        prev, stats = contador_familias.sharded_blocks(df, workers)
+        pd.testing.assert_series_equal(prev, serial, check_exact=True)
+        pd.testing.assert_frame_equal(stats.mean_edad_and_count(), expected_stats(df, serial),
+                                      check_exact=True, check_dtype=False)
+
+@pytest.mark.parametrize('chunk_rows', [SHEET_ROWS, 1_000])
+def test_chunked_blocks_match_the_serial_ones(register, serial, tmp_path, chunk_rows):
+    path, df = register
+    output_path = tmp_path / 'blocks.csv'
+    stats = contador_familias.stream_blocks(path, chunk_rows, output_path)
+    streamed = pd.read_csv(output_path, dtype=str, keep_default_na=False)['Prev_Apellido_pila']
+    assert streamed.tolist() == serial.tolist()
+    pd.testing.assert_frame_equal(stats.mean_edad_and_count(), expected_stats(df, serial),
+                                  check_exact=True, check_dtype=False)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from censo_utils import excel
+
+def make_frame(rows: int = 11) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    dates = pd.Series(pd.date_range('1895-05-10', periods=rows, freq='D'))
+    dates[2] = pd.NaT
+    return pd.DataFrame({
+        'entero': np.arange(rows),
+        'real': np.where(rng.random(rows) < 0.2, np.nan, rng.random(rows) * 100),
+        'logico': rng.random(rows) < 0.5,
+        'fecha': dates,
+        'texto': [f'Titular {i}' for i in range(rows)],
+        'categoria': pd.Categorical(rng.choice(['A', 'M', 'P', None], rows)),
+        'mixto': pd.Series([1, 'dos', 3.5, None, True, 'seis', float('inf'), 8, 'nueve', 10.25, -1][:rows], dtype=object),
+    })
+
+def test_chunked_writes_read_back_as_one_pass(tmp_path, monkeypatch):
+    df = make_frame()
+    excel.write_workbook(tmp_path / 'whole.xlsx', {'Hoja': df})
+    monkeypatch.setattr(excel, 'WRITE_CHUNK_ROWS', 3)
+    excel.write_workbook(tmp_path / 'chunked.xlsx', {'Hoja': df, 'Vacia': df.iloc[:0]})
+    whole = pd.read_excel(tmp_path / 'whole.xlsx', sheet_name=None)
+    chunked = pd.read_excel(tmp_path / 'chunked.xlsx', sheet_name=None)
+    pd.testing.assert_frame_equal(chunked['Hoja'], whole['Hoja'])
+    assert len(chunked['Hoja']) == len(df)
+    assert chunked['Vacia'].columns.tolist() == df.columns.tolist() and chunked['Vacia'].empty
+
+def test_streaming_reader_warns_when_a_blank_gap_cuts_the_sheet(tmp_path, monkeypatch):
+    df = pd.DataFrame({'titular': ['Pereyra Juan', 'Gómez José', None, None, None, None, 'Duhau Luis'],
+                       'extension': [10, 20, None, None, None, None, 30]})
+    excel.write_workbook(tmp_path / 'gap.xlsx', {'Hoja': df})
+    monkeypatch.setattr(excel, 'BLANK_ROW_LIMIT', 3)
+    with pytest.warns(UserWarning, match='rows below were not read'):
+        read = excel.read_workbook(tmp_path / 'gap.xlsx', engine='streaming')
+    assert read['titular'].tolist() == ['Pereyra Juan', 'Gómez José']
+
+    monkeypatch.setattr(excel, 'BLANK_ROW_LIMIT', 5)
+    read = excel.read_workbook(tmp_path / 'gap.xlsx', engine='streaming')
+    assert read['extension'].tolist()[-1] == 30
+
+def test_streaming_reader_does_not_warn_on_trailing_blank_rows(tmp_path, monkeypatch, recwarn):
+    df = pd.DataFrame({'titular': ['Pereyra Juan', None, None, None], 'extension': [10, None, None, None]})
+    excel.write_workbook(tmp_path / 'trailing.xlsx', {'Hoja': df})
+    monkeypatch.setattr(excel, 'BLANK_ROW_LIMIT', 3)
+    assert excel.read_workbook(tmp_path / 'trailing.xlsx', engine='streaming')['titular'].tolist() == ['Pereyra Juan']
+    assert not [w for w in recwarn if 'not read' in str(w.message)]
@@ -0,0 +1,125 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from censo_utils import linkage, parallel, storage
+
+V3 = Path(__file__).resolve().parents[1] / 'censo_1895/Python_1895_v3'
+sys.path.insert(0, str(V3))
+import run_sequence  # noqa: E402
+
+def load_benchmark_format():
+    spec = importlib.util.spec_from_file_location('benchmark_format', V3 / '1_script_censo/benchmark_format.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Each owner written as the registers do, some EAPs under each spelling
+SPELLINGS = [['Pereyra Juan', 'Pereira Juan', 'PEREYRA JUAN'], ['Gómez José', 'Gomes Jose'],
+             ['Anchorena Tomás', 'Anchorena Thomas'], ['Duhau Luis']]
+
+def write_inputs(directory: Path, spellings: bool) -> None:
+    """Two stage 1 workbooks, the titulares written in the SPELLINGS of a few owners if spellings."""
+    make_partido = load_benchmark_format().make_partido
+    directory.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for i in range(2):
+        df = make_partido(200, seed=i)
+        df['extension'] = df['extension'].replace({'1/2': 0.5, 'sin dato': 3.0})
+        if spellings:
+            df['titular'] = [owner[rng.integers(len(owner))]
+                             for owner in (SPELLINGS[j] for j in rng.integers(0, len(SPELLINGS), len(df)))]
+        df.to_excel(directory / f'partido_{i}.xlsx', index=False)
+
+def point_stages(monkeypatch, root: Path) -> None:
+    """Stage modules reading root / 'input' and writing under root."""
+    script_format, script_limpieza, script_calculo, script_suma = run_sequence.load_stages()
+    directories = [(script_format, 'INPUT_DIRECTORY', str(root / 'input')),
+                   (script_format, 'OUTPUT_DIRECTORY', str(root / '1')),
+                   (script_format, 'PARSE_CACHE_PATH', str(root / 'parse_cache.json')),
+                   (script_limpieza, 'INPUT_DIRECTORY', root / '1'),
+                   (script_limpieza, 'OUTPUT_DIRECTORY', root / '2'),
+                   (script_calculo, 'INPUT_DIRECTORY', root / '2'),
+                   (script_calculo, 'OUTPUT_DIRECTORY', root / '3'),
+                   (script_suma, 'INPUT_DIRECTORY', str(root / '3')),
+                   (script_suma, 'OUTPUT_DIRECTORY', str(root / '4')),
+                   (run_sequence, 'MANIFEST_PATH', root / 'manifest.json'),
+                   (run_sequence, 'log_file_path', str(root / 'log.txt')),
+                   (parallel, 'WORKERS', 1)]
+    for module, name, value in directories:
+        monkeypatch.setattr(module, name, value)
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """Stage modules writing under tmp_path, with the titulares linked and stage 3 grouping by owner."""
+    script_format, script_limpieza, script_calculo, script_suma = run_sequence.load_stages()
+    write_inputs(tmp_path / 'input', spellings=True)
+    point_stages(monkeypatch, tmp_path)
+    monkeypatch.setattr(script_limpieza, 'LINK_TITULARES', True)
+    monkeypatch.setattr(script_calculo, 'GROUP_BY_OWNER', True)
+    return script_limpieza, script_calculo, tmp_path
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_runner_matches_the_stages_run_one_by_one(tmp_path, monkeypatch, streaming):
+    stages = run_sequence.load_stages()
+    script_calculo, script_suma = stages[2], stages[3]
+    write_inputs(tmp_path / 'runner' / 'input', spellings=False)
+    write_inputs(tmp_path / 'stages' / 'input', spellings=False)
+    point_stages(monkeypatch, tmp_path / 'runner')
+    run_sequence.run_pipeline(write_artifacts=True, incremental=False, streaming=streaming)
+    point_stages(monkeypatch, tmp_path / 'stages')
+    for stage in stages:
+        stage.main()
+
+    for partido in ['partido_0', 'partido_1']:
+        path = storage.tables_path(script_calculo.output_stem(f'{partido}_tabla_final'))
+        runner = storage.read_tables(tmp_path / 'runner' / '3' / path.name)
+        for name, table in storage.read_tables(path).items():
+            pd.testing.assert_frame_equal(runner[name], table, check_exact=True, obj=f'{partido} {name}')
+    workbook = Path(script_suma.output_path()).name
+    runner = pd.read_excel(tmp_path / 'runner' / '4' / workbook, sheet_name=None)
+    for name, sheet in pd.read_excel(tmp_path / 'stages' / '4' / workbook, sheet_name=None).items():
+        pd.testing.assert_frame_equal(runner[name], sheet, check_exact=True, obj=name)
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_runner_links_titulares_and_groups_by_owner(pipeline, monkeypatch, streaming):
+    script_limpieza, script_calculo, tmp_path = pipeline
+    run_sequence.run_pipeline(write_artifacts=True, incremental=False, streaming=streaming)
+    assert (tmp_path / '4' / 'suma_de_partidos.xlsx').exists()
+
+    for partido in ['partido_0', 'partido_1']:
+        table = storage.read_table(storage.table_path(script_limpieza.output_stem(partido)))
+        owners = table.groupby(linkage.OWNER_ID_COLUMN)[table.columns[0]].agg(set)
+        assert sorted(map(sorted, owners)) == sorted(
+            sorted({name for name in spellings if name in set(table.iloc[:, 0])}) for spellings in SPELLINGS)
+
+        written = storage.read_tables(storage.tables_path(script_calculo.output_stem(f'{partido}_tabla_final')))
+        cultivo = written['titular_sinfiltro_cultivo']
+        monkeypatch.setattr(script_calculo, 'GROUP_BY_OWNER', False)
+        by_eap = script_calculo.calculate_tables(table)['titular_sinfiltro_cultivo']
+        monkeypatch.setattr(script_calculo, 'GROUP_BY_OWNER', True)
+        # At most one owner per tenure counted, and the same land in other bins
+        assert cultivo[script_calculo.TENENCIA_COLUMN].sum() <= len(SPELLINGS) * len(script_calculo.TENURES)
+        assert cultivo[script_calculo.TENENCIA_COLUMN].sum() < by_eap[script_calculo.TENENCIA_COLUMN].sum()
+        assert cultivo[script_calculo.EXTENSION_COLUMN].sum() == pytest.approx(
+            by_eap[script_calculo.EXTENSION_COLUMN].sum())
+
+def test_group_by_owner_needs_linked_titulares(pipeline):
+    script_limpieza, script_calculo, tmp_path = pipeline
+    table = pd.DataFrame({'titular': ['Pereyra Juan'], script_calculo.TENENCIA_COLUMN: ['A']})
+    with pytest.raises(ValueError, match='LINK_TITULARES'):
+        script_calculo.group_owners(table)
+
+def test_both_modes_time_every_stage(tmp_path, monkeypatch):
+    write_inputs(tmp_path / 'input', spellings=False)
+    point_stages(monkeypatch, tmp_path)
+    streamed = run_sequence.run_pipeline(write_artifacts=False, streaming=True)
+    staged = run_sequence.run_pipeline(write_artifacts=False, streaming=False)
+    stages = [directory for directory, _ in run_sequence.STAGES]
+    assert set(stages) <= set(staged) and set(stages) <= set(streamed)
+    assert set(staged) <= set(streamed)
+    assert all(streamed[stage] > 0 for stage in stages)
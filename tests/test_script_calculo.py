@@ -0,0 +1,56 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from censo_utils import filters, storage
+
+V3 = Path(__file__).resolve().parents[1] / 'censo_1895/Python_1895_v3'
+sys.path.insert(0, str(V3))
+import run_sequence  # noqa: E402
+
+script_format, script_limpieza, script_calculo, script_suma = run_sequence.load_stages()
+
+def load_benchmark_format():
+    spec = importlib.util.spec_from_file_location('benchmark_format', V3 / '1_script_censo/benchmark_format.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture(scope='module')
+def stage_2_table() -> pd.DataFrame:
+    df = load_benchmark_format().make_partido(2_000, seed=3)
+    df['extension'] = df['extension'].replace({'1/2': 0.5, 'sin dato': 3.0})
+    return script_limpieza.clean_table(script_format.format_dataframe(df))
+
+def test_sheets_match_the_per_level_reference(stage_2_table):
+    sheets = script_calculo.calculate_tables(stage_2_table.copy())
+    reference = script_calculo.calculate_tables_per_level(stage_2_table.copy())
+    for name, sheet in reference.items():
+        pd.testing.assert_frame_equal(sheets[name], sheet, check_dtype=False, check_categorical=False, obj=name)
+
+def test_a_missing_tenure_is_all_zeros(stage_2_table):
+    tenencia = stage_2_table[script_calculo.TENENCIA_COLUMN]
+    without = stage_2_table[(tenencia != 'M').to_numpy()].reset_index(drop=True)
+    sheets = script_calculo.calculate_tables(without)
+    complete = script_calculo.calculate_tables(stage_2_table)
+    for name in ['titular_filtro_tenencia', 'titular_sinfiltro_tenencia']:
+        assert (sheets[name]['M'] == 0).all()
+        assert sheets[name]['A'].sum() == complete[name]['A'].sum()
+    partial = sheets[script_calculo.TENURE_PARTIAL_SHEET]
+    titular = stage_2_table.columns[0]
+    assert (partial[f'{titular}_M'] == 0).all()
+    assert (partial[f'{script_calculo.EXTENSION_COLUMN}_M'] == 0).all()
+    assert np.array_equal(partial[f'{titular}_A'], complete[script_calculo.TENURE_PARTIAL_SHEET][f'{titular}_A'])
+
+def test_level_counts_come_from_the_sidecar_until_the_table_changes(stage_2_table, tmp_path, monkeypatch):
+    monkeypatch.setattr(script_limpieza, 'WRITE_REVIEW_WORKBOOK', False)
+    script_limpieza.save_results(stage_2_table, tmp_path / 'partido')
+    path = storage.table_path(tmp_path / 'partido')
+    assert script_calculo.read_level_counts(path) == filters.level_counts(stage_2_table)
+
+    storage.write_table(stage_2_table.iloc[:100], tmp_path / 'partido')
+    assert script_calculo.read_level_counts(path) is None
@@ -0,0 +1,52 @@
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+V3 = Path(__file__).resolve().parents[1] / 'censo_1895/Python_1895_v3'
+sys.path.insert(0, str(V3))
+import run_sequence  # noqa: E402
+
+script_format = run_sequence.load_stages()[0]
+
+def load_benchmark_format():
+    spec = importlib.util.spec_from_file_location('benchmark_format', V3 / '1_script_censo/benchmark_format.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_cache_is_reloaded_under_the_same_grammar(tmp_path):
+    path = str(tmp_path / 'parse_cache.json')
+    cache = script_format.ParseCache(path=path)
+    cache.parse_many(pd.Series(['10 H', '3,5 cc', 'sin dato']))
+    cache.save()
+    assert script_format.ParseCache.load(path).entries == cache.entries
+
+def test_cache_of_another_grammar_is_discarded(tmp_path, monkeypatch):
+    path = str(tmp_path / 'parse_cache.json')
+    cache = script_format.ParseCache(path=path)
+    cache.parse_many(pd.Series(['10 H', '2 CC']))
+    cache.save()
+    rules = [(suffix, pattern, (lambda x: x * 2) if suffix == 'CC' else transformation)
+             for suffix, pattern, transformation in script_format.SUFFIX_RULES]
+    monkeypatch.setattr(script_format, 'SUFFIX_RULES', rules)
+    assert script_format.ParseCache.load(path).entries == {}
+
+def test_cache_without_a_grammar_is_discarded(tmp_path):
+    path = tmp_path / 'parse_cache.json'
+    path.write_text(json.dumps({'2 CC': 99.0}), encoding='utf-8')
+    assert script_format.ParseCache.load(str(path)).entries == {}
+
+def test_workers_hand_back_only_the_entries_they_added():
+    cache = script_format.ParseCache({'10 H': 10.0, '2 CC': 3.36})
+    df = load_benchmark_format().make_partido(300, seed=1)
+    _, added = script_format.format_file('partido.xlsx', df, cache)
+    assert added.entries and not set(added.entries) & {'10 H', '2 CC'}
+    assert set(added.entries) | {'10 H', '2 CC'} == set(cache.entries)
+    assert added.hits + added.misses > 0 and cache.hits == cache.misses == 0
+
+    total = script_format.ParseCache({'10 H': 10.0, '2 CC': 3.36})
+    total.merge(added)
+    assert total.entries == cache.entries
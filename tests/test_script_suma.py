@@ -0,0 +1,58 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+
+def load_script_suma():
+    path = ROOT / 'censo_1895/Python_1895_v3/4_script_suma/script_suma.py'
+    spec = importlib.util.spec_from_file_location('script_suma', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+script_suma = load_script_suma()
+
+def make_grouped(seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    grouped = pd.DataFrame({'extension_h_bins': script_suma.BIN_LABELS})
+    for measure in script_suma.CULTIVO_MEASURES:
+        grouped[measure] = rng.pareto(1.1, len(grouped)) * 1e4 + rng.random(len(grouped))
+    grouped[script_suma.PERCENT_COLUMN] = rng.random(len(grouped)) * 100
+    return grouped
+
+def make_partial(seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    partial = pd.DataFrame({'extension_h_bins': script_suma.BIN_LABELS})
+    for tenure in script_suma.TENURES:
+        partial[f'Titular_{tenure}'] = rng.integers(0, 50, len(partial))
+        partial[f'{script_suma.EXTENSION_COLUMN}_{tenure}'] = rng.pareto(1.1, len(partial)) * 1e4
+    return partial
+
+def totals(partidos) -> dict:
+    accumulator = script_suma.ProvinceAccumulator()
+    for partido in partidos:
+        accumulator.add_cultivo(partido, make_grouped(int(partido[1:])))
+        accumulator.add_tenencia(partido, make_partial(int(partido[1:])))
+    return accumulator
+
+def assert_same_totals(a, b) -> None:
+    for name, table in a.cultivo_tables().items():
+        pd.testing.assert_frame_equal(table, b.cultivo_tables()[name], check_exact=True)
+    pd.testing.assert_frame_equal(a.tenencia_table(), b.tenencia_table(), check_exact=True)
+
+def test_totals_do_not_depend_on_arrival_order():
+    partidos = [f'p{i:02d}' for i in range(12)]
+    assert_same_totals(totals(partidos), totals(partidos[::-1]))
+    assert_same_totals(totals(partidos), totals(partidos[5:] + partidos[:5]))
+
+def test_removing_and_adding_back_restores_totals():
+    partidos = [f'p{i:02d}' for i in range(12)]
+    accumulator = totals(partidos)
+    accumulator.remove('p03')
+    assert_same_totals(accumulator, totals([p for p in partidos if p != 'p03']))
+    accumulator.add_cultivo('p03', make_grouped(3))
+    accumulator.add_tenencia('p03', make_partial(3))
+    assert_same_totals(accumulator, totals(partidos))
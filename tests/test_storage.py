@@ -0,0 +1,38 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from censo_utils import storage
+
+MIXED = [146.32799999999997, 0.006220000000000001, 0.1 + 0.2, 5e-324, 2 ** 62 + 1, -0.0,
+         '123', '1e5', ' 7 ', 'nan', 'Titular', True, None, float('nan'),
+         np.float64(1.5), np.float64(0.1 + 0.2), np.float32(0.1), np.int64(2 ** 62 + 1), np.int8(-3), np.bool_(False)]
+
+def assert_same_cells(read: pd.Series, written: list) -> None:
+    """Cells read back as written, numpy scalars as the Python number of the same value."""
+    assert len(read) == len(written)
+    for got, expected in zip(read.tolist(), written):
+        if isinstance(expected, np.generic):
+            expected = expected.item()
+        if isinstance(expected, float) and math.isnan(expected) or expected is None:
+            assert pd.isna(got)
+        else:
+            assert type(got) is type(expected) and got == expected, (got, expected)
+            if isinstance(expected, float):
+                assert math.copysign(1, got) == math.copysign(1, expected)
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_mixed_columns_round_trip_exactly(tmp_path, fmt):
+    df = pd.DataFrame({'mixed': pd.Series(MIXED, dtype=object), 'number': range(len(MIXED))})
+    read = storage.read_table(storage.write_table(df, tmp_path / 'table', fmt))
+    assert read.columns.tolist() == ['mixed', 'number']
+    assert_same_cells(read['mixed'], MIXED)
+
+def test_mixed_columns_round_trip_in_datasets(tmp_path):
+    df = pd.DataFrame({'partido': ['A', 'B'] * (len(MIXED) // 2), 'mixed': pd.Series(MIXED, dtype=object)})
+    storage.write_dataset(df, tmp_path / 'dataset', 'partido')
+    read = storage.read_dataset(tmp_path / 'dataset', 'partido', ['A'])
+    assert read.columns.tolist() == ['partido', 'mixed']
+    assert_same_cells(read['mixed'], MIXED[::2])
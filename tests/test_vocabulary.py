@@ -0,0 +1,33 @@
+import difflib
+
+import pandas as pd
+
+from censo_utils.vocabulary import SUGGESTION_CUTOFF, Vocabulary, normalize
+
+PROFESIONES = ['Agricultor', 'Agricultora', 'Agricultur', 'Jornalero', 'Jornalera', 'Hacendado', 'Acendado',
+               'Comerciante', 'Comercianta', 'Estanciero', 'Carpintero', 'Carpintera', 'Panadero', 'Zapatero',
+               'Sapatero', 'Herrero', 'Costurera', 'Cocinero', 'Cocinera', 'Lavandera', 'Labrador', 'Peón',
+               'Peon de campo', 'Sirviente', 'Sirvienta', 'Maestro', 'Maestra'] + [f'Oficio {i}' for i in range(40)]
+
+def all_pairs_suggestions(labels: list) -> dict:
+    keys = {normalize(label): label for label in labels}
+    found = {}
+    for label in labels:
+        key = normalize(label)
+        matches = difflib.get_close_matches(key, [other for other in keys if other != key], n=1,
+                                            cutoff=SUGGESTION_CUTOFF)
+        if matches:
+            found[label] = keys[matches[0]]
+    return found
+
+def test_suggestions_match_comparing_all_labels():
+    vocabulary = Vocabulary()
+    vocabulary.codes(pd.Series(PROFESIONES, name='Profesión'))
+    suggestions = vocabulary.suggestions()
+    assert dict(zip(suggestions['Value'], suggestions['Suggestion'])) == all_pairs_suggestions(PROFESIONES)
+    assert not suggestions.empty
+
+def test_suggestions_of_a_single_label():
+    vocabulary = Vocabulary()
+    vocabulary.codes(pd.Series(['Agricultor'], name='Profesión'))
+    assert vocabulary.suggestions().empty